@@ -15,20 +15,35 @@
 #
 # ############################################################################ #
 
-# This script reads a specified pickle file created by an MBM-Flex model run,
-# It saves the variables given by the user (vars_to_extract) to a csv file for each room.
-# If the variable exist outdoors, it is saved in a separate csv file.
-# All csv files are stored in the extracted_outputs folder, inside the main output directory.
+# This script reads the results of an MBM-Flex model run and saves the variables given by
+# the user (vars_to_extract) to a csv (or parquet) file for each room.
+# If the variable exist outdoors, it is saved in a separate file.
+# All files are stored in the extracted_outputs folder, inside the main output directory.
 # An excel filename can optionally be provided, in which case the data will also be output to an excel file
+#
+# The results are read from the mbm_results folder (written by run_mbm.py with result_store='npy'),
+# from which only the variables to extract are read and the rooms are extracted in parallel,
+# or else from the pickle file.
+#
+# The settings below are the defaults, each can also be given on the command line, for example:
+#   python MBM_extractor.py 260123_160450_output --vars O3 NO NO2 --t-start 3600 --output-interval 300
+# (python MBM_extractor.py --help lists all of them)
 import os
+import argparse
 import pickle
+from typing import Dict, List, Optional
 import pandas as pd
+from multiprocess import Pool, cpu_count
+
+from multiroom_model.simulation_result import SimulationResult
+from multiroom_model.output_spec import OutputSpec
 
 # =============================================================================================== #
 # User-specified model variables to extract
 
 mbm_output_dir ='260123_160450_output'
 pickle_file = 'mbm_results.pkl'
+result_folder = 'mbm_results'
 extracted_outputs_folder = 'extracted_outputs'
 extracted_excel_filename = None
 
@@ -41,39 +56,126 @@ vars_to_extract = [
     'OH_reactivity','OH_production','J4','temp','ACRate','tsp','tspx',
                     ]
 
-# Load the datafile
-with open('%s/%s' % (mbm_output_dir,pickle_file), 'rb') as handle:
-    data = pickle.load(handle)
-
 # =============================================================================================== #
-# Extract the selected variables and save them to one csv files per room, plus one csv files for
-# outdoors concentrations
 
-for room_name, room_pd in data.items():
 
-    # create the extracted_outputs folder if it doesn't exist
-    path = os.getcwd()
-    if not os.path.exists(f'{path}/{mbm_output_dir}/{extracted_outputs_folder}'):
-        os.mkdir(f'{path}/{mbm_output_dir}/{extracted_outputs_folder}')
+def parse_arguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extract variables from the results of an MBM-Flex model run")
+    parser.add_argument("mbm_output_dir", nargs="?", default=mbm_output_dir,
+                        help="The output directory of the model run")
+    parser.add_argument("--vars", nargs="+", default=vars_to_extract,
+                        help="The model variables to extract (their outdoor values are extracted too)")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="The format of the extracted files")
+    parser.add_argument("--compress", action="store_true",
+                        help="Compress the csv files with gzip (parquet files are always compressed)")
+    parser.add_argument("--t-start", type=float, default=None, help="Extract from this time (s)")
+    parser.add_argument("--t-end", type=float, default=None, help="Extract until this time (s)")
+    parser.add_argument("--output-interval", type=float, default=None,
+                        help="Extract the results every output interval seconds from the start of the run")
+    parser.add_argument("--excel", default=extracted_excel_filename,
+                        help="Also save the variables to this excel file, one sheet per room")
+    parser.add_argument("--processes", type=int, default=cpu_count(), help="How many rooms to extract at once")
+    parser.add_argument("--pickle-file", default=pickle_file, help="The pickle file of the results")
+    parser.add_argument("--result-folder", default=result_folder, help="The result folder of the results")
+    parser.add_argument("--outputs-folder", default=extracted_outputs_folder,
+                        help="The folder, inside the output directory, to save the extracted files to")
+    return parser.parse_args(argv)
 
-    # extract those variables listed in vars_to_extract that exist in the data
-    existing_vars_to_extract = (v for v in vars_to_extract if v in room_pd.columns)
-    room_pd.to_csv(f'{path}/{mbm_output_dir}/{extracted_outputs_folder}/{room_name}.csv',
-                   columns=existing_vars_to_extract, index_label='Time')
 
-    # extract those variables listed in vars_to_extract that exist in the outdoor data
-    outvars_to_extract = (v+'OUT' for v in vars_to_extract if v+'OUT' in room_pd.columns)
-    room_pd.to_csv(f'{path}/{mbm_output_dir}/{extracted_outputs_folder}/{room_name}_outdoor.csv',
-                   columns=outvars_to_extract, index_label='Time')
+def select(room_pd: pd.DataFrame, variables: List[str], args: argparse.Namespace, origin: float) -> pd.DataFrame:
+    """
+    The variables of a room which exist in the results, within the time window and at the output interval
+    """
+    times = room_pd.index.to_numpy(dtype=float)
+    keep = OutputSpec(output_interval=args.output_interval).row_mask(times, origin)
+    if args.t_start is not None:
+        keep &= times >= args.t_start
+    if args.t_end is not None:
+        keep &= times <= args.t_end
+    return room_pd.loc[keep, [v for v in variables if v in room_pd.columns]]
 
 
-# =============================================================================================== #
-# Optional: Extract the selected variables and save them to one excel file with one sheet per room
+def write_room(room_name: str, room_pd: pd.DataFrame, args: argparse.Namespace, folder: str) -> List[str]:
+    """
+    Save the indoor and the outdoor variables of a room to separate files, returns the paths of the files
+    """
+    indoor = [v for v in args.vars if v in room_pd.columns]
+    outdoor = [v+'OUT' for v in args.vars if v+'OUT' in room_pd.columns]
+
+    paths = []
+    for suffix, columns in (('', indoor), ('_outdoor', outdoor)):
+        if args.format == 'parquet':
+            path = f'{folder}/{room_name}{suffix}.parquet'
+            room_pd[columns].rename_axis('Time').to_parquet(path)
+        else:
+            extension = 'csv.gz' if args.compress else 'csv'
+            path = f'{folder}/{room_name}{suffix}.{extension}'
+            room_pd.to_csv(path, columns=columns, index_label='Time')
+        paths.append(path)
+    return paths
+
+
+def read_result_room(room_name: str, args: argparse.Namespace) -> pd.DataFrame:
+    """
+    Read only the variables to extract of one room from the result folder
+    """
+    result = SimulationResult(f'{args.mbm_output_dir}/{args.result_folder}')
+    variables = [v for v in args.vars + [v+'OUT' for v in args.vars] if v in result.species]
+    room_pd = result.to_dataframe(room_name, variables, args.t_start, args.t_end)
+    return select(room_pd, variables, args, result.times[0] if len(result.times) else 0.0)
+
 
-if extracted_excel_filename:
-    with pd.ExcelWriter(f'{path}/{mbm_output_dir}/{extracted_outputs_folder}/{extracted_excel_filename}.xlsx') as writer:
+def extract_result_room(room_name: str, args: argparse.Namespace, folder: str) -> List[str]:
+    """
+    Read only the variables to extract of one room from the result folder and save them,
+    returns the paths of the files written (the data itself is not sent back)
+    """
+    return write_room(room_name, read_result_room(room_name, args), args, folder)
+
+
+def read_pickle(args: argparse.Namespace) -> Dict[str, pd.DataFrame]:
+    """
+    Read the pickle file of the results, which holds every variable of every room
+    """
+    with open(f'{args.mbm_output_dir}/{args.pickle_file}', 'rb') as handle:
+        return pickle.load(handle)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_arguments(argv)
+
+    # create the extracted_outputs folder if it doesn't exist
+    folder = os.path.join(os.getcwd(), args.mbm_output_dir, args.outputs_folder)
+    os.makedirs(folder, exist_ok=True)
+
+    if os.path.exists(f'{args.mbm_output_dir}/{args.result_folder}/{SimulationResult.index_file}'):
+        # Each room is read and saved by its own process, reading only the variables to extract,
+        # only the paths of the files written come back
+        rooms = list(SimulationResult(f'{args.mbm_output_dir}/{args.result_folder}').rooms)
+        with Pool(max(1, min(args.processes, len(rooms)))) as pool:
+            pool.starmap(extract_result_room, [(room_name, args, folder) for room_name in rooms])
+        data = None
+    else:
+        data = read_pickle(args)
+        variables = args.vars + [v+'OUT' for v in args.vars]
         for room_name, room_pd in data.items():
-            existing_vars_to_extract = list(v for v in vars_to_extract if v in room_pd.columns)
-            room_pd.to_excel(writer, columns=existing_vars_to_extract, index_label='Time', sheet_name=room_name)
+            origin = float(room_pd.index[0]) if len(room_pd.index) else 0.0
+            data[room_name] = select(room_pd, variables, args, origin)
+            write_room(room_name, data[room_name], args, folder)
+        rooms = list(data.keys())
+
+    # Optional: Extract the selected variables and save them to one excel file with one sheet per room
+    if args.excel:
+        with pd.ExcelWriter(f'{folder}/{args.excel}.xlsx') as writer:
+            for room_name in rooms:
+                # The rooms extracted by the processes are read again, one at a time
+                room_pd = data[room_name] if data is not None else read_result_room(room_name, args)
+                existing_vars_to_extract = list(v for v in args.vars if v in room_pd.columns)
+                room_pd.to_excel(writer, columns=existing_vars_to_extract, index_label='Time', sheet_name=room_name)
+
+    print(f'\n*** Selected variables extracted and saved to {args.outputs_folder}/ ***')
+
 
-print(f'\n*** Selected variables extracted and saved to {extracted_outputs_folder}/ ***')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+# ############################################################################ #
+# Benchmark of the pressure network airflow model in large buildings
+#
+# For floor plans of a growing grid of rooms (see benchmark_transport_paths)
+# times building the pressure network and solving it for a series of winds,
+# alongside the estimated number of transport paths the other airflow model
+# would have to enumerate. The cost of the network grows with the number of
+# rooms, not with the number of paths.
+#
+# Run from the root of the repository with:
+#     python -m benchmarks.benchmark_pressure_network
+# ############################################################################ #
+
+import math
+import time
+
+from multiroom_model.pressure_network import PressureNetwork
+from multiroom_model.transport_paths import estimate_path_count
+from benchmarks.benchmark_transport_paths import grid_building, timed
+
+grid_sizes = [(3, 3), (6, 10), (10, 10), (20, 20), (30, 30)]
+winds = [(1.0 + (n % 5), 2*math.pi*n/24) for n in range(24)]
+air_density = 1.2
+pressure_coefficients = (0.3, -0.2)
+
+if __name__ == '__main__':
+    print(f"{'rooms':>6} {'apertures':>10} {'paths (estimate)':>17} {'build (s)':>10} {'per wind (ms)':>14}")
+    for rows, columns in grid_sizes:
+        rooms, apertures = grid_building(rows, columns)
+        estimate = estimate_path_count(rooms, apertures, samples=200)
+
+        network, build_seconds = timed(lambda: PressureNetwork(rooms, apertures, 0.0, air_density,
+                                                                pressure_coefficients))
+        _, solve_seconds = timed(lambda: [network.solve(speed, direction) for speed, direction in winds])
+
+        print(f"{len(rooms):>6} {len(apertures):>10} {estimate:>17.3g} {build_seconds:>10.3f} "
+              f"{1000*solve_seconds/len(winds):>14.2f}")
@@ -0,0 +1,86 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+# ############################################################################ #
+# Benchmark of the collection of results in Simulation.run
+#
+# Compares the previous approach (pd.concat of every room on every transport
+# interval) with the ResultAccumulator, for an increasing number of intervals.
+# The time per interval of the accumulator should stay flat (linear scaling),
+# while the time per interval of pd.concat grows with the number of intervals.
+#
+# Run from the root of the repository with:
+#     python -m benchmarks.benchmark_result_accumulator
+# ############################################################################ #
+
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from multiroom_model.result_accumulator import ResultAccumulator
+
+# Shape of the synthetic results
+n_rooms = 9
+n_columns = 5000
+rows_per_interval = 4
+interval_counts = [25, 50, 100, 200, 400]
+
+
+def interval_results(interval: int) -> List[pd.DataFrame]:
+    """
+    Synthetic results of one interval, one DataFrame per room
+    """
+    times = interval*(rows_per_interval-1) + np.arange(rows_per_interval, dtype=float)
+    columns = [f"S{i}" for i in range(n_columns)]
+    values = np.random.default_rng(interval).random((rows_per_interval, n_columns))
+    return [pd.DataFrame(values, index=times, columns=columns) for _ in range(n_rooms)]
+
+
+def run_with_concat(results: List[List[pd.DataFrame]]):
+    cumulative = [r.copy() for r in results[0]]
+    for room_results in results[1:]:
+        cumulative = [pd.concat([cumulative[i], room_results[i]], axis=0) for i in range(n_rooms)]
+    return cumulative
+
+
+def run_with_accumulator(results: List[List[pd.DataFrame]]):
+    accumulator = ResultAccumulator(n_rooms, len(results)*rows_per_interval)
+    for room_results in results:
+        accumulator.append(room_results)
+    return accumulator.to_dataframes()
+
+
+if __name__ == '__main__':
+
+    print(f"{n_rooms} rooms, {n_columns} columns, {rows_per_interval} rows per interval")
+    print(f"{'intervals':>10} {'concat (s)':>12} {'per interval (ms)':>18} {'accumulator (s)':>16} {'per interval (ms)':>18}")
+
+    for n_intervals in interval_counts:
+        results = [interval_results(i) for i in range(n_intervals)]
+
+        start = time.perf_counter()
+        run_with_concat(results)
+        concat_time = time.perf_counter()-start
+
+        start = time.perf_counter()
+        run_with_accumulator(results)
+        accumulator_time = time.perf_counter()-start
+
+        print(f"{n_intervals:>10} {concat_time:>12.3f} {1000*concat_time/n_intervals:>18.3f}"
+              f" {accumulator_time:>16.3f} {1000*accumulator_time/n_intervals:>18.3f}")
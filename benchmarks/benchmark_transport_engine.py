@@ -0,0 +1,102 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+# ############################################################################ #
+# Benchmark of one transport step
+#
+# Compares applying the apertures one at a time with ApertureFlowCalculator
+# (pandas Series arithmetic, as Simulation used to) with the TransportEngine
+# (one matrix product over the whole building), for buildings of increasing size.
+# The rooms are laid out in a corridor, each with one window to the outside.
+# The species are those of the full MCM results in multiroom_model_tests/.
+#
+# Run from the root of the repository with:
+#     python -m benchmarks.benchmark_transport_engine
+# ############################################################################ #
+
+import pickle
+import time
+
+import numpy as np
+
+from multiroom_model.aperture_calculations import Fluxes
+from multiroom_model.aperture_flow_calculations import ApertureFlowCalculator
+from multiroom_model.transport_engine import TransportEngine
+
+room_counts = [3, 10, 30]
+delta_time = 60.0
+
+
+def building(n_rooms: int):
+    """
+    A corridor of rooms, returns the apertures as (origin, destination or None, fluxes) and the volumes
+    """
+    apertures = [(i, None, Fluxes(0.01, 0.02)) for i in range(n_rooms)]
+    apertures += [(i, i+1, Fluxes(0.03, 0.01)) for i in range(n_rooms-1)]
+    volumes = list(np.linspace(10, 50, n_rooms))
+    return apertures, volumes
+
+
+def flux_matrix(n_rooms, apertures):
+    result = np.zeros((n_rooms+1, n_rooms+1))
+    for origin, destination, flux in apertures:
+        i = origin+1
+        j = 0 if destination is None else destination+1
+        result[i, j] += flux.from_1_to_2
+        result[j, i] += flux.from_2_to_1
+    return result
+
+
+def step_per_aperture(calculator, concentrations, apertures, volumes):
+    result = [c.copy() for c in concentrations]
+    for origin, destination, flux in apertures:
+        if destination is None:
+            change = calculator.outdoor_concentration_changes(flux, delta_time, concentrations[origin], volumes[origin])
+            result[origin] = result[origin].add(change, fill_value=0.0)
+        else:
+            change_1, change_2 = calculator.concentration_changes(
+                flux, delta_time, concentrations[origin], concentrations[destination], volumes[origin], volumes[destination])
+            result[origin] = result[origin].add(change_1, fill_value=0.0)
+            result[destination] = result[destination].add(change_2, fill_value=0.0)
+    return result
+
+
+if __name__ == '__main__':
+
+    with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+        row = pickle.load(file).iloc[-1, :].astype(float)
+    calculator = ApertureFlowCalculator(row.index)
+
+    print(f"{len(row)} columns, {len(calculator.indoor_var_list)} transported species")
+    print(f"{'rooms':>6} {'apertures':>10} {'per aperture (s)':>17} {'engine (s)':>11}")
+
+    for n_rooms in room_counts:
+        apertures, volumes = building(n_rooms)
+        concentrations = [row*(1+i/n_rooms) for i in range(n_rooms)]
+        matrix = flux_matrix(n_rooms, apertures)
+
+        start = time.perf_counter()
+        step_per_aperture(calculator, concentrations, apertures, volumes)
+        per_aperture_time = time.perf_counter()-start
+
+        array = np.stack([c.to_numpy() for c in concentrations])
+        engine = TransportEngine(row.index, volumes)
+        start = time.perf_counter()
+        engine.apply(array, matrix, delta_time)
+        engine_time = time.perf_counter()-start
+
+        print(f"{n_rooms:>6} {len(apertures):>10} {per_aperture_time:>17.4f} {engine_time:>11.4f}")
@@ -0,0 +1,94 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+# ############################################################################ #
+# Benchmark of the enumeration of transport paths in large buildings
+#
+# For floor plans of a growing grid of rooms (each joined to its neighbours,
+# with windows on every outside wall) prints the estimated number of paths,
+# then times finding every path (while there are few enough), at most
+# max_paths of them, and the k shortest between each pair of outside sides.
+# The number of paths grows exponentially with the number of rooms, while
+# the k shortest paths stay quick to find.
+#
+# Run from the root of the repository with:
+#     python -m benchmarks.benchmark_transport_paths
+# ############################################################################ #
+
+import time
+import warnings
+from typing import List, Tuple
+
+from multiroom_model.aperture import Aperture, Side
+from multiroom_model.transport_paths import paths_through_building, estimate_path_count
+
+grid_sizes = [(2, 2), (3, 3), (3, 4), (4, 4), (5, 5), (6, 10)]
+max_paths = 100000
+k_shortest = 10
+exhaustive_limit = 1.0e6
+
+
+class GridRoom:
+    pass
+
+
+def grid_building(rows: int, columns: int, area: float = 1.0) -> Tuple[List[GridRoom], List[Aperture]]:
+    """
+    A floor plan of rows x columns rooms, each joined to its neighbours, with windows on every outside wall
+    """
+    rooms = [[GridRoom() for _ in range(columns)] for _ in range(rows)]
+    apertures = []
+    for i in range(rows):
+        for j in range(columns):
+            if j+1 < columns:
+                apertures.append(Aperture(rooms[i][j], rooms[i][j+1], area, Side.Front))
+            if i+1 < rows:
+                apertures.append(Aperture(rooms[i][j], rooms[i+1][j], area, Side.Front))
+    for j in range(columns):
+        apertures.append(Aperture(rooms[0][j], Side.Front, area, Side.Front))
+        apertures.append(Aperture(rooms[rows-1][j], Side.Back, area, Side.Back))
+    for i in range(rows):
+        apertures.append(Aperture(rooms[i][0], Side.Left, area, Side.Left))
+        apertures.append(Aperture(rooms[i][columns-1], Side.Right, area, Side.Right))
+    return [r for row in rooms for r in row], apertures
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter()-start
+
+
+if __name__ == '__main__':
+    warnings.simplefilter("ignore")
+
+    print(f"{'rooms':>6} {'estimate':>10} {'all (s)':>10} {'paths':>8} {'capped (s)':>11} {'k shortest (s)':>15}")
+
+    for rows, columns in grid_sizes:
+        rooms, apertures = grid_building(rows, columns)
+        estimate, _ = timed(lambda: estimate_path_count(rooms, apertures))
+
+        everything = "-"
+        count = "-"
+        if estimate < exhaustive_limit:
+            paths, seconds = timed(lambda: paths_through_building(rooms, apertures))
+            everything, count = f"{seconds:.3f}", len(paths)
+
+        _, capped = timed(lambda: paths_through_building(rooms, apertures, max_paths=max_paths))
+        _, shortest = timed(lambda: paths_through_building(rooms, apertures, k_shortest=k_shortest))
+
+        print(f"{len(rooms):>6} {estimate:>10.3g} {everything:>10} {count:>8} {capped:>11.3f} {shortest:>15.3f}")
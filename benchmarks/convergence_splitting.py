@@ -0,0 +1,125 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+# ############################################################################ #
+# Convergence study of the splitting between room chemistry and transport
+#
+# Runs the 9 room building of config_rooms/ with Lie and Strang splitting for
+# a range of transport intervals, and compares the final concentrations with a
+# reference run using a short interval. The error of Lie splitting should halve
+# when the interval is halved (first order) and the error of Strang splitting
+# should quarter (second order).
+#
+# The error is the largest, over the rooms, of the root mean square relative
+# difference of the transported species (ignoring species below a floor).
+#
+# Run from the root of the repository with:
+#     python -m benchmarks.convergence_splitting
+# ############################################################################ #
+
+import math
+import time
+
+import numpy as np
+
+from multiroom_model.global_settings import GlobalSettings
+from multiroom_model.json_parser import BuildingJSONParser
+from multiroom_model.simulation import Simulation
+from multiroom_model.aperture_flow_calculations import ApertureFlowCalculator
+
+t0 = 0.0
+t_total = 960.0
+reference_interval = 7.5
+intervals = [240.0, 120.0, 60.0, 30.0]
+schemes = ["lie", "strang"]
+
+# Concentrations below this (molecule/cm3) are left out of the relative error
+concentration_floor = 1.0e3
+
+
+def global_settings():
+    ambient_press = 1013.0
+    ambient_temp = 293.0
+    rho = (100*ambient_press) / (287.050 * ambient_temp)
+
+    return GlobalSettings(
+        filename='chem_mech/mcm_subset.fac',
+        INCHEM_additional=False,
+        particles=True,
+        constrained_file=None,
+        output_folder=None,
+        dt=7.5,
+        H2O2_dep=False,
+        O3_dep=False,
+        custom=False,
+        custom_filename=None,
+        diurnal=True,
+        city='London_urban',
+        date='21-06-2020',
+        lat=45.4,
+        path=None,
+        reactions_output=False,
+        building_direction_in_radians=math.radians(180),
+        air_density=rho,
+        upwind_pressure_coefficient=0.3,
+        downwind_pressure_coefficient=-0.2
+    )
+
+
+def final_state(simulation, rooms, initial_conditions, t_interval):
+    """
+    The concentrations of the transported species in every room at the end of the run (rooms x species)
+    """
+    result = simulation.run(init_conditions=initial_conditions, t0=t0, t_total=t_total, t_interval=t_interval)
+    species, _ = ApertureFlowCalculator.get_trans_vars(result[rooms[0]].columns)
+    return np.stack([result[r][species].iloc[-1, :].to_numpy(dtype=float) for r in rooms])
+
+
+def error(state, reference):
+    significant = np.abs(reference) > concentration_floor
+    relative = np.where(significant, (state-reference)/np.where(significant, reference, 1.0), 0.0)
+    return np.sqrt((relative**2).sum(axis=1)/significant.sum(axis=1)).max()
+
+
+if __name__ == '__main__':
+
+    building = BuildingJSONParser.from_json_file("config_rooms/building.json")
+    rooms = list(building['rooms'].values())
+    initial_conditions = building['initial_conditions']
+
+    simulations = dict((s, Simulation(global_settings(), rooms, building['apertures'], building['wind'],
+                                      transport_method="expm", splitting=s)) for s in schemes)
+
+    reference = final_state(simulations["strang"], rooms, initial_conditions, reference_interval)
+
+    print(f"{len(rooms)} rooms, {t_total} s, reference interval {reference_interval} s (Strang)")
+    print(f"{'scheme':>7} {'interval (s)':>13} {'restarts':>9} {'error':>11} {'order':>6} {'time (s)':>9}")
+
+    for s in schemes:
+        previous_error = None
+        for t_interval in intervals:
+            start = time.perf_counter()
+            e = error(final_state(simulations[s], rooms, initial_conditions, t_interval), reference)
+            elapsed = time.perf_counter()-start
+
+            order = "" if previous_error is None else f"{math.log2(previous_error/e):.2f}"
+            restarts = len(Simulation.interval_schedule(t0, t_total, t_interval))
+            print(f"{s:>7} {t_interval:>13} {restarts:>9} {e:>11.3e} {order:>6} {elapsed:>9.1f}")
+            previous_error = e
+
+    for simulation in simulations.values():
+        simulation.close()
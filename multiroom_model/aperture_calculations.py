@@ -16,10 +16,12 @@
 # ############################################################################ #
 
 from dataclasses import dataclass
-from typing import List, Union, Tuple, TypeVar
+from typing import List, Union, Tuple, TypeVar, Optional
 from .aperture import Aperture, Side
 from .transport_paths import TransportPath
 import math
+import numpy as np
+import scipy.sparse as sp
 
 Room = TypeVar('Room')
 
@@ -94,6 +96,100 @@ def transport_path_windspeed(transport_path: TransportPath,
     return wind_speed * math.cos(wind_direction-t_p_angle)
 
 
+class TransportPathIndex:
+    """
+        @brief Which transport paths pass through each room (and each side of the building), and the wind along
+        every path for the latest wind, shared by the calculations of all the apertures of a building
+
+        Finding whether a room is cross-ventilated by scanning the route of every path is done for each
+        aperture on each interval. Here the paths through each room are a row of a sparse incidence matrix,
+        so for a wind the cross-ventilated rooms are found once, by one sparse product with the mask of the
+        paths with wind along them, and each aperture then only looks up its rooms.
+        Rooms are numbered in the order they are met along the paths, so copies of an index (as sent to and
+        from worker processes) number them the same.
+
+    """
+
+    def __init__(self, transport_paths: List[TransportPath], building_direction_in_radians: float = 0):
+        """
+        @param transport_paths: The transport paths through the building.
+        @param building_direction_in_radians: Orientation of the building.
+        """
+        self.transport_paths = transport_paths
+        self.building_direction_in_radians = building_direction_in_radians
+
+        # The rooms and sides along the paths, each with its paths
+        self.nodes: List[Union[Room | Side]] = []
+        self._node_ids = {}
+        entries = set()
+        for p, t in enumerate(transport_paths):
+            for r in t.route:
+                for node in (r.aperture.origin, r.aperture.destination):
+                    if id(node) not in self._node_ids:
+                        self._node_ids[id(node)] = len(self.nodes)
+                        self.nodes.append(node)
+                    entries.add((self._node_ids[id(node)], p))
+        rows = [n for n, _ in entries]
+        columns = [p for _, p in entries]
+        self.incidence = sp.csr_matrix((np.ones(len(entries)), (rows, columns)),
+                                       shape=(len(self.nodes), len(transport_paths)))
+
+        self.path_angles = np.array([transport_path_angle_in_radians(t, building_direction_in_radians)
+                                     for t in transport_paths], dtype=float)
+
+        self._last_wind: Tuple[float, float] = None
+        self._last_path_windspeeds: np.ndarray = None
+        self._last_cross_ventilated: np.ndarray = None
+
+    def __getstate__(self):
+        # Rooms are looked up by id, which is not kept by a copy
+        state = self.__dict__.copy()
+        del state["_node_ids"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._node_ids = dict((id(node), n) for n, node in enumerate(self.nodes))
+
+    def node(self, room: Union[Room | Side]) -> Optional[int]:
+        """
+        The number of a room or side in the index, None if no path passes through it
+        """
+        return self._node_ids.get(id(room))
+
+    def paths_through(self, node: Optional[int]) -> np.ndarray:
+        """
+        The positions of the paths through a room or side (by its number)
+        """
+        if node is None:
+            return np.zeros(0, dtype=int)
+        return self.incidence.indices[self.incidence.indptr[node]:self.incidence.indptr[node+1]]
+
+    def _update(self, wind_speed: float, wind_direction: float):
+        if self._last_wind != (wind_speed, wind_direction):
+            windspeeds = wind_speed*np.cos(wind_direction-self.path_angles)
+            ventilating = (np.abs(windspeeds) > _zero_advection_tolerance).astype(float)
+            self._last_path_windspeeds = windspeeds
+            self._last_cross_ventilated = (self.incidence @ ventilating) > 0
+            self._last_wind = (wind_speed, wind_direction)
+
+    def path_windspeeds(self, wind_speed: float, wind_direction: float) -> np.ndarray:
+        """
+        The component of the wind along each path (the same as transport_path_windspeed)
+        """
+        self._update(wind_speed, wind_direction)
+        return self._last_path_windspeeds
+
+    def is_cross_ventilated(self, node: Optional[int], wind_speed: float, wind_direction: float) -> bool:
+        """
+        Whether a room or side (by its number) is cross-ventilated by the wind (the same as is_room_cross_ventilated)
+        """
+        if node is None:
+            return False
+        self._update(wind_speed, wind_direction)
+        return bool(self._last_cross_ventilated[node])
+
+
 def flow_advection(io_windspd: float, oarea: float, Cd: float, Cp: float, air_density: float):
     '''
     Calculate the advection flow through an opening (door or window), given its area
@@ -154,10 +250,60 @@ class Fluxes:
     from_2_to_1: float
 
 
+class WindResponse:
+    """
+        @brief The response of an aperture to the wind, tabulated by the direction of the transport paths
+
+        The wind along a path is wind_speed*cos(wind_direction - path angle), and the advection flow of each
+        contribution is proportional to it, with a discharge coefficient depending only on which way the wind
+        blows along the path. So the advection flow is wind_speed times a sum, over the directions of the paths
+        through the aperture (at most 8), of a coefficient times the cosine where it is positive and another
+        coefficient times the cosine where it is negative. The table holds those coefficients, so the flow
+        for any wind is found exactly without going through each contribution.
+        Similarly a room is cross-ventilated unless the wind is across every path through it, so only the
+        directions of the paths through each room of the aperture are kept.
+
+    """
+
+    def __init__(self,
+                 path_angles: Tuple[float, ...],
+                 forward_coefficients: Tuple[float, ...],
+                 backward_coefficients: Tuple[float, ...],
+                 ventilating_angles: Tuple[Tuple[float, ...], Tuple[float, ...]]):
+        """
+        @param path_angles: The distinct directions of the paths through the aperture (radians).
+        @param forward_coefficients: For each direction, the flow (m3/s, origin to destination) for each m/s
+                                     of wind along the paths in that direction.
+        @param backward_coefficients: The same for the wind against the paths in that direction.
+        @param ventilating_angles: The distinct directions of the paths through the origin and the destination.
+        """
+        self.path_angles = path_angles
+        self.forward_coefficients = forward_coefficients
+        self.backward_coefficients = backward_coefficients
+        self.ventilating_angles = ventilating_angles
+
+    def advection_flow_rate(self, wind_speed: float, wind_direction: float) -> float:
+        result = 0
+        for angle, forward, backward in zip(self.path_angles, self.forward_coefficients, self.backward_coefficients):
+            cosine = math.cos(wind_direction-angle)
+            result += (forward if cosine > 0 else backward)*cosine
+        return wind_speed*result
+
+    def is_cross_ventilated(self, side: int, wind_speed: float, wind_direction: float) -> bool:
+        """
+        Whether the origin (side 0) or the destination (side 1) is cross-ventilated by the wind
+        """
+        return any(abs(wind_speed*math.cos(wind_direction-angle)) > _zero_advection_tolerance
+                   for angle in self.ventilating_angles[side])
+
+
 class ApertureCalculation:
     """
         @brief A class which performs the calculations of advection flow, category and exchange flow of an aperture
 
+        lookup_trans_matrix_contributions gives the same fluxes as trans_matrix_contributions from the
+        WindResponse of the aperture, built once, rather than from each contribution.
+
     """
     @dataclass
     class Contribution:
@@ -179,6 +325,7 @@ class ApertureCalculation:
     air_density: float = 0
     building_pressure_coefficients: Tuple[float, float] = 0, 0
     contributions: List[Contribution] = []
+    path_index: TransportPathIndex = None
 
     def __init__(self,
                  aperture: Aperture,
@@ -186,9 +333,17 @@ class ApertureCalculation:
                  all_apertures: List[Aperture],
                  building_direction_in_radians: float = 0,
                  air_density: float = 0,
-                 building_pressure_coefficients: Tuple[float, float] = (0, 0)):
+                 building_pressure_coefficients: Tuple[float, float] = (0, 0),
+                 path_index: TransportPathIndex = None):
+        """
+        @param path_index: The index of the transport paths, best shared by the calculations of all the
+                           apertures so the wind along the paths is found once for each wind (built if not given).
+        """
         self.aperture = aperture
         self.transport_paths = transport_paths
+        self.path_index = TransportPathIndex(transport_paths, building_direction_in_radians) if path_index is None else path_index
+        self._origin_node = self.path_index.node(aperture.origin)
+        self._destination_node = self.path_index.node(aperture.destination)
         self.is_outdoor_aperture = (type(aperture.destination) is Side)
         self.has_room_with_outdoor_aperture = room_has_outdoor_aperture(
             aperture.origin, all_apertures) or room_has_outdoor_aperture(aperture.destination, all_apertures)
@@ -200,6 +355,9 @@ class ApertureCalculation:
         if (building_pressure_coefficients[0] < building_pressure_coefficients[1]):
             raise Exception("The higher building pressure coefficient should come first")
 
+        # Without an air density there is no advection flow to tabulate yet (see wind_response)
+        self._wind_response: WindResponse = self._build_wind_response() if air_density > 0 else None
+
     @classmethod
     def _build_contributions(cls, aperture: Aperture, transport_paths: List[TransportPath]) -> List[Contribution]:
         """
@@ -220,6 +378,50 @@ class ApertureCalculation:
                     ))
         return result
 
+    def _build_wind_response(self) -> WindResponse:
+        """
+        Tabulate the advection flow of the contributions by the direction of their paths
+        """
+        # The flow through this aperture for 1 m/s of wind along a path, with each discharge coefficient
+        unit_flows = {}
+
+        def unit_flow(position: float) -> float:
+            discharge_coefficient = 0.7/(1.0 + position)
+            if discharge_coefficient not in unit_flows:
+                unit_flows[discharge_coefficient] = flow_advection(1.0,
+                                                                   self.aperture.area,
+                                                                   discharge_coefficient,
+                                                                   self.building_pressure_coefficients,
+                                                                   self.air_density)
+            return unit_flows[discharge_coefficient]
+
+        coefficients = {}
+        for contribution in self.contributions:
+            angle = transport_path_angle_in_radians(contribution.path, self.building_direction_in_radians)
+            aperture_reversed_sign = -1 if contribution.reversed else 1
+            forward, backward = coefficients.get(angle, (0, 0))
+            # With the wind against the path the position is counted from the other end
+            coefficients[angle] = (forward + aperture_reversed_sign*unit_flow(contribution.position_down_path),
+                                   backward + aperture_reversed_sign*unit_flow(1.0-contribution.position_down_path))
+
+        def ventilating_angles(node: Optional[int]) -> Tuple[float, ...]:
+            return tuple(set(self.path_index.path_angles[self.path_index.paths_through(node)].tolist()))
+
+        return WindResponse(path_angles=tuple(coefficients.keys()),
+                            forward_coefficients=tuple(f for f, _ in coefficients.values()),
+                            backward_coefficients=tuple(b for _, b in coefficients.values()),
+                            ventilating_angles=(ventilating_angles(self._origin_node),
+                                                ventilating_angles(self._destination_node)))
+
+    @property
+    def wind_response(self) -> WindResponse:
+        """
+        The response of the aperture to the wind, built on first use if there was no air density at construction
+        """
+        if getattr(self, "_wind_response", None) is None:
+            self._wind_response = self._build_wind_response()
+        return self._wind_response
+
     def has_advection_flow(self, wind_speed: float, wind_direction: float):
         """
         detect whether given wind conditions cause any advection flow
@@ -269,17 +471,9 @@ class ApertureCalculation:
         3) if this aperture goes to a room with a connection to outside ("costal" room)
         4) if this aperture is none of the above (between 2 "landlocked" rooms)
         """
-        if is_room_cross_ventilated(self.aperture.origin,
-                                    self.transport_paths,
-                                    wind_speed,
-                                    wind_direction,
-                                    self.building_direction_in_radians):
+        if self.path_index.is_cross_ventilated(self._origin_node, wind_speed, wind_direction):
             return 1
-        elif is_room_cross_ventilated(self.aperture.destination,
-                                      self.transport_paths,
-                                      wind_speed,
-                                      wind_direction,
-                                      self.building_direction_in_radians):
+        elif self.path_index.is_cross_ventilated(self._destination_node, wind_speed, wind_direction):
             return 1
         elif self.is_outdoor_aperture:
             return 2
@@ -325,3 +519,86 @@ class ApertureCalculation:
                 from_1_to_2=exchange,
                 from_2_to_1=exchange
             )
+
+    def lookup_trans_matrix_contributions(self, wind_speed: float, wind_direction_in_radians: float):
+        """
+        the same fluxes as trans_matrix_contributions, from the wind response of the aperture
+        """
+        response = self.wind_response
+        advection = response.advection_flow_rate(wind_speed, wind_direction_in_radians)
+        if (advection > _zero_advection_tolerance):
+            return Fluxes(from_1_to_2=advection, from_2_to_1=0)
+        elif (advection < -_zero_advection_tolerance):
+            return Fluxes(from_1_to_2=0, from_2_to_1=-advection)
+
+        # No Advection flow, use exchange flow instead (in the same order as exchange_category)
+        if (response.is_cross_ventilated(0, wind_speed, wind_direction_in_radians) or
+                response.is_cross_ventilated(1, wind_speed, wind_direction_in_radians)):
+            category = 1
+        elif self.is_outdoor_aperture:
+            category = 2
+        elif self.has_room_with_outdoor_aperture:
+            category = 3
+        else:
+            category = 4
+        exchange = flow_exchange(category)
+        return Fluxes(from_1_to_2=exchange, from_2_to_1=exchange)
+
+
+class WindResponseTable:
+    """
+        @brief The wind responses of many apertures stacked into arrays, so the fluxes through every aperture
+        for a series of winds are found in one pass
+
+        Each row holds the directions of one aperture (padded with zero coefficients, and with no ventilating
+        direction), so the result for each wind and aperture is the same as its lookup_trans_matrix_contributions.
+
+    """
+
+    def __init__(self, calculations: List[ApertureCalculation]):
+        responses = [c.wind_response for c in calculations]
+        width = max([len(r.path_angles) for r in responses] + [1])
+        self.path_angles = np.zeros((len(responses), width))
+        self.forward_coefficients = np.zeros((len(responses), width))
+        self.backward_coefficients = np.zeros((len(responses), width))
+        for a, r in enumerate(responses):
+            self.path_angles[a, :len(r.path_angles)] = r.path_angles
+            self.forward_coefficients[a, :len(r.path_angles)] = r.forward_coefficients
+            self.backward_coefficients[a, :len(r.path_angles)] = r.backward_coefficients
+
+        # The ventilating directions of both rooms of each aperture, with a mask of those which are real
+        width = max([len(r.ventilating_angles[0]) + len(r.ventilating_angles[1]) for r in responses] + [1])
+        self.ventilating_angles = np.zeros((len(responses), width))
+        self.ventilating_mask = np.zeros((len(responses), width), dtype=bool)
+        for a, r in enumerate(responses):
+            angles = r.ventilating_angles[0] + r.ventilating_angles[1]
+            self.ventilating_angles[a, :len(angles)] = angles
+            self.ventilating_mask[a, :len(angles)] = True
+
+        # The exchange category of each aperture when neither room is cross-ventilated
+        self.still_categories = np.array([2 if c.is_outdoor_aperture else 3 if c.has_room_with_outdoor_aperture else 4
+                                          for c in calculations], dtype=int)
+        self.exchange_flows = np.array([0.0] + [flow_exchange(category) for category in (1, 2, 3, 4)])
+
+    def fluxes(self, wind_speeds: np.ndarray, wind_directions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The fluxes from room 1 to room 2 and from room 2 to room 1 of every aperture (columns) for
+        each wind (rows)
+        """
+        wind_speeds = np.asarray(wind_speeds, dtype=float)[:, None]
+        wind_directions = np.asarray(wind_directions, dtype=float)[:, None, None]
+
+        cosines = np.cos(wind_directions - self.path_angles[None, :, :])
+        coefficients = np.where(cosines > 0, self.forward_coefficients[None, :, :], self.backward_coefficients[None, :, :])
+        advection = wind_speeds*(coefficients*cosines).sum(axis=2)
+
+        ventilated = (np.abs(wind_speeds[:, :, None]*np.cos(wind_directions - self.ventilating_angles[None, :, :]))
+                      > _zero_advection_tolerance) & self.ventilating_mask[None, :, :]
+        categories = np.where(ventilated.any(axis=2), 1, self.still_categories[None, :])
+        exchange = self.exchange_flows[categories]
+
+        forward = advection > _zero_advection_tolerance
+        backward = advection < -_zero_advection_tolerance
+        from_1_to_2 = np.where(forward, advection, np.where(backward, 0.0, exchange))
+        from_2_to_1 = np.where(backward, -advection, np.where(forward, 0.0, exchange))
+        return from_1_to_2, from_2_to_1
@@ -0,0 +1,211 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import heapq
+import math
+from typing import Dict, List, Sequence
+import numpy as np
+import pandas as pd
+from multiprocess import cpu_count
+
+from .interval_scheduler import FixedIntervalScheduler
+
+
+def makespan(costs: Sequence[float], workers: int) -> float:
+    """
+    How long some tasks take on a number of workers, each task given to the least busy worker
+    (longest first)
+    """
+    loads = [0.0]*max(1, min(workers, len(costs)))
+    for cost in sorted(costs, reverse=True):
+        heapq.heapreplace(loads, loads[0]+cost)
+    return max(loads)
+
+
+class CostModel:
+    """
+        @brief How long each part of an interval of a simulation takes, measured by a short calibration run
+        (see Simulation.calibrate), from which the wall time of a whole run is projected
+
+        Each interval of length L costs:
+        - for each room, room_fixed + room_per_second*L seconds of chemistry
+        - one transport step of transport_seconds
+        With a pool of processes the evolver of each room is also sent to a worker (send_seconds, done by
+        this process in turn) and its results returned (result_seconds_per_row for each row of length/dt+1),
+        while the chemistry of the rooms is shared out between the workers.
+
+    """
+
+    def __init__(self,
+                 room_fixed: Sequence[float],
+                 room_per_second: Sequence[float],
+                 send_seconds: Sequence[float],
+                 result_seconds_per_row: Sequence[float],
+                 transport_seconds: float,
+                 dt: float,
+                 transport_rate: float = 0.0):
+        """
+        @param room_fixed: The cost of an interval of each room, whatever its length (s).
+        @param room_per_second: The cost of each simulated second of each room (s/s).
+        @param send_seconds: The cost of sending the evolver of each room to a worker process (s).
+        @param result_seconds_per_row: The cost of returning each row of results of each room from a worker (s).
+        @param transport_seconds: The cost of one transport step (s).
+        @param dt: The time step of the results (s).
+        @param transport_rate: The largest rate of change from transport relative to the concentration (1/s),
+                               which limits the interval (see AdaptiveIntervalScheduler).
+        """
+        self.room_fixed = np.maximum(np.asarray(room_fixed, dtype=float), 0.0)
+        self.room_per_second = np.maximum(np.asarray(room_per_second, dtype=float), 0.0)
+        self.send_seconds = np.asarray(send_seconds, dtype=float)
+        self.result_seconds_per_row = np.asarray(result_seconds_per_row, dtype=float)
+        self.transport_seconds = transport_seconds
+        self.dt = dt
+        self.transport_rate = transport_rate
+
+    def interval_seconds(self, backend: str, workers: int, length: float) -> float:
+        """
+        The projected wall time of one interval (with its transport step)
+        """
+        chemistry = self.room_fixed + self.room_per_second*length
+        if backend == "serial":
+            return float(chemistry.sum()) + self.transport_seconds
+        if backend == "process":
+            rows = length/self.dt + 1
+            returned = chemistry + self.result_seconds_per_row*rows
+            return float(self.send_seconds.sum()) + makespan(returned, workers) + self.transport_seconds
+        raise ValueError(f"No cost model for the {backend} executor")
+
+    def projected_seconds(self, backend: str, workers: int, intervals: Sequence[float]) -> float:
+        """
+        The projected wall time of a run with these interval lengths
+        """
+        per_length: Dict[float, float] = {}
+        for length in intervals:
+            if length not in per_length:
+                per_length[length] = self.interval_seconds(backend, workers, length)
+        return float(sum(per_length[length] for length in intervals))
+
+    def longest_interval(self, update_tolerance: float) -> float:
+        """
+        The longest interval for which one transport step changes no concentration by more than update_tolerance
+        """
+        return math.inf if self.transport_rate <= 0 else update_tolerance/self.transport_rate
+
+
+class TuningResult:
+    """
+        @brief The backend, number of workers and interval chosen by autotune, with the projections it compared
+    """
+
+    def __init__(self, candidates: pd.DataFrame, cost_model: CostModel, t_total: float):
+        """
+        @param candidates: One row for each option, with its backend, workers, t_interval, intervals and
+                           projected_seconds, the quickest first.
+        """
+        self.candidates = candidates
+        self.cost_model = cost_model
+        self.t_total = t_total
+        best = candidates.iloc[0]
+        self.backend: str = best["backend"]
+        self.workers: int = int(best["workers"])
+        self.t_interval: float = float(best["t_interval"])
+        self.projected_seconds: float = float(best["projected_seconds"])
+
+    def summary(self) -> str:
+        return (f"Auto-tuned for {self.t_total:g} s of simulation: the {self.backend} executor with "
+                f"{self.workers} worker(s) and a transport interval of {self.t_interval:g} s, "
+                f"projected to take {self.projected_seconds:.1f} s")
+
+
+def whole_steps(length: float, dt: float) -> float:
+    """
+    A length rounded down to a whole number of time steps, and at least one step
+    """
+    # Allow for the rounding of lengths such as 0.006/0.002
+    return max(math.floor(length/dt + 1.0e-9)*dt, dt)
+
+
+def interval_ladder(min_interval: float, max_interval: float, dt: float) -> List[float]:
+    """
+    Interval lengths from max_interval, halving down to min_interval, in multiples of dt
+    """
+    lengths = []
+    length = max_interval
+    while length >= min_interval:
+        rounded = whole_steps(length, dt)
+        if rounded not in lengths:
+            lengths.append(rounded)
+        length /= 2
+    return lengths or [whole_steps(min_interval, dt)]
+
+
+def autotune(simulation,
+             init_conditions: dict,
+             t0: float,
+             t_total: float,
+             max_interval: float,
+             min_interval: float = None,
+             update_tolerance: float = 0.1,
+             backends: Sequence[str] = ("serial", "process"),
+             max_workers: int = cpu_count(),
+             calibration_interval: float = None) -> TuningResult:
+    """
+    Choose the executor backend, number of workers and transport interval which minimise the projected
+    wall time of a run, from a calibration run of one interval of each room and one transport step.
+    The interval is at most max_interval, and no longer than one for which a transport step changes a
+    concentration by more than update_tolerance (judged at the end of the calibration), so the choice
+    keeps the accuracy of the run.
+    Threads are not projected, the chemistry holds the GIL so they are no quicker than serial, and
+    neither is MPI, whose workers depend on how the job was started.
+
+    @param simulation: The built simulation (not with resident workers).
+    @param init_conditions: The initial conditions of the run.
+    @param t0: The start of the run.
+    @param t_total: The duration of the run.
+    @param max_interval: The longest transport interval allowed.
+    @param min_interval: The shortest transport interval considered (by default max_interval/16).
+    @param update_tolerance: The largest relative change of a concentration from one transport step.
+    @param backends: The executors to choose from ("serial" and/or "process").
+    @param max_workers: The most worker processes to use.
+    @param calibration_interval: The length of the calibration interval (by default the shorter of min_interval
+                                 and t_total).
+    The intervals are rounded down to whole time steps of the simulation (at least one step), as the rooms
+    only give results at multiples of the time step.
+    """
+    dt = simulation.dt
+    min_interval = whole_steps(max_interval/16 if min_interval is None else min_interval, dt)
+    calibration_interval = whole_steps(min(min_interval, t_total) if calibration_interval is None
+                                       else calibration_interval, dt)
+    cost_model: CostModel = simulation.calibrate(init_conditions, t0, calibration_interval)
+
+    longest = min(max_interval, max(cost_model.longest_interval(update_tolerance), min_interval))
+    breakpoints = simulation.breakpoints()
+
+    rows = []
+    for t_interval in interval_ladder(min_interval, longest, cost_model.dt):
+        intervals = [length for _, length in
+                     FixedIntervalScheduler(t_interval).planned_intervals(t0, t0+t_total, breakpoints)]
+        for backend in backends:
+            for workers in ([1] if backend == "serial" else range(1, max(1, min(max_workers, len(simulation.rooms)))+1)):
+                rows.append({"backend": backend,
+                             "workers": workers,
+                             "t_interval": t_interval,
+                             "intervals": len(intervals),
+                             "projected_seconds": cost_model.projected_seconds(backend, workers, intervals)})
+
+    candidates = pd.DataFrame(rows).sort_values(["projected_seconds", "workers"], kind="stable").reset_index(drop=True)
+    return TuningResult(candidates, cost_model, t_total)
@@ -0,0 +1,166 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import time
+import pickle
+import uuid
+from typing import List, Any, Callable, BinaryIO
+import numpy as np
+import pandas as pd
+
+
+def write_file_atomically(path: str, write: Callable[[BinaryIO], Any]):
+    """
+    Write a file through a temporary file which replaces the file in one step,
+    so the file is never left half written if the process is killed.
+    The temporary file is unique, so processes writing the same file do not interfere.
+    """
+    temporary_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temporary_path, "wb") as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def write_atomically(path: str, data: Any):
+    """
+    Pickle data to a file atomically (see write_file_atomically)
+    """
+    write_file_atomically(path, lambda file: pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class Checkpointer:
+    """
+        @brief Writes the progress of Simulation.run to a folder at interval boundaries, so it can be resumed
+
+        A checkpoint is written every every_intervals intervals and/or every every_seconds seconds of wall
+        clock time (whichever comes first). The folder holds:
+        - state.pkl: the state vector of every room at the start of the next interval, the next interval,
+          the scheduler (and so its position), and the result sink with what it needs to restore its results
+        - whatever the result sink saves with a checkpoint, for results kept in memory (MemoryResultSink)
+          results_<run>_NNNNN.pkl holds the rows of results added since the previous checkpoint
+
+        Each checkpoint only writes the new rows of results, not all the results so far, and state.pkl is
+        replaced in one step after the rows it refers to are written. A checkpoint interrupted part way
+        leaves the previous checkpoint intact.
+
+    """
+
+    version = 2
+    state_file = "state.pkl"
+
+    def __init__(self, folder: str, every_intervals: int = None, every_seconds: float = None):
+        """
+        @param folder: The folder to write the checkpoints to (created if needed).
+        @param every_intervals: Write a checkpoint after this many intervals.
+        @param every_seconds: Write a checkpoint when this much wall clock time has passed since the last one.
+        """
+        if every_intervals is None and every_seconds is None:
+            raise ValueError("Either every_intervals or every_seconds must be given")
+        self.folder = folder
+        self.every_intervals = every_intervals
+        self.every_seconds = every_seconds
+
+        self._intervals_since = 0
+        self._last_write = time.monotonic()
+        self._run_id = uuid.uuid4().hex[:8]
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.folder, self.state_file)
+
+    def exists(self) -> bool:
+        """
+        Whether the folder holds a checkpoint
+        """
+        return os.path.exists(self.state_path)
+
+    def start(self):
+        """
+        Start counting for a new run, which writes its checkpoints from scratch
+        """
+        self._intervals_since = 0
+        self._last_write = time.monotonic()
+        # The results of a new run never overwrite those of an earlier run in the same folder
+        self._run_id = uuid.uuid4().hex[:8]
+
+    def interval_done(self) -> bool:
+        """
+        Count one more interval, and say whether a checkpoint is due
+        """
+        self._intervals_since += 1
+        if self.every_intervals is not None and self._intervals_since >= self.every_intervals:
+            return True
+        if self.every_seconds is not None and time.monotonic()-self._last_write >= self.every_seconds:
+            return True
+        return False
+
+    def write(self, run_state: dict, sink: "ResultSink"):
+        """
+        Write a checkpoint from the state of a run and the sink holding the results so far
+        """
+        os.makedirs(self.folder, exist_ok=True)
+
+        # The sink saves its results before the state which refers to them
+        sink_info = sink.checkpoint(self.folder, self._run_id)
+
+        state = dict(run_state)
+        state.update({
+            "version": self.version,
+            "run_id": self._run_id,
+            "sink": sink,
+            "sink_info": sink_info,
+        })
+        write_atomically(self.state_path, state)
+
+        self._intervals_since = 0
+        self._last_write = time.monotonic()
+
+    def load(self) -> dict:
+        """
+        Read the latest checkpoint, returns the state of the run with its result sink, restored to the results
+        of the checkpoint, under "sink". Counting carries on from this checkpoint.
+        """
+        if not self.exists():
+            raise Exception(f"There is no checkpoint in {self.folder}")
+        with open(self.state_path, "rb") as file:
+            state = pickle.load(file)
+        if state.get("version") != self.version:
+            raise Exception(f"Checkpoint version {state.get('version')} can not be read, expected {self.version}")
+
+        state["sink"].restore(self.folder, state["sink_info"])
+
+        self._intervals_since = 0
+        self._last_write = time.monotonic()
+        self._run_id = state["run_id"]
+        return state
+
+    @staticmethod
+    def room_states(initial_condition: List[pd.DataFrame]) -> np.ndarray:
+        """
+        The state vector of every room (rooms x columns) from the one row initial conditions of the next interval
+        """
+        return np.stack([r.iloc[-1, :].to_numpy(dtype=float) for r in initial_condition])
+
+    @staticmethod
+    def initial_condition(room_states: np.ndarray, columns: pd.Index, time: float) -> List[pd.DataFrame]:
+        """
+        The one row initial conditions of every room from their state vectors
+        """
+        return [pd.DataFrame(room_states[[i], :], index=[time], columns=columns) for i in range(room_states.shape[0])]
@@ -0,0 +1,233 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+from typing import List, Callable, Sequence, Tuple
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.integrate import solve_ivp
+
+from .transport_engine import transport_generator
+
+
+class RoomODESystem:
+    """
+        @brief The chemistry of one room written as an ODE system, dy/dt = rhs(t, y)
+
+        The coupled engine only needs the right hand side, its jacobian, and the outdoor concentrations
+        which the room exchanges with through its windows. Every room of a building must use the same species.
+
+    """
+
+    species: List[str] = []
+
+    def rhs(self, t: float, y: np.ndarray) -> np.ndarray:
+        """
+        The rate of change of every species (molecule/cm3/s)
+        """
+        raise NotImplementedError()
+
+    def jacobian(self, t: float, y: np.ndarray):
+        """
+        The jacobian of rhs, as a dense array or a scipy sparse matrix
+        """
+        raise NotImplementedError()
+
+    def outdoor_concentrations(self, t: float) -> np.ndarray:
+        """
+        The outdoor concentration of every species (zero for species with no outdoor concentration)
+        """
+        return np.zeros(len(self.species))
+
+
+class LinearRoomODESystem(RoomODESystem):
+    """
+        @brief A room whose chemistry is linear, dy/dt = A y + b, with constant outdoor concentrations
+        Useful for checking the coupled engine against exact solutions
+
+    """
+
+    def __init__(self, species: List[str], rate_matrix: np.ndarray, source: np.ndarray = None, outdoor: np.ndarray = None):
+        self.species = list(species)
+        self.rate_matrix = np.asarray(rate_matrix, dtype=float)
+        self.source = np.zeros(len(species)) if source is None else np.asarray(source, dtype=float)
+        self.outdoor = np.zeros(len(species)) if outdoor is None else np.asarray(outdoor, dtype=float)
+
+    def rhs(self, t: float, y: np.ndarray) -> np.ndarray:
+        return self.rate_matrix @ y + self.source
+
+    def jacobian(self, t: float, y: np.ndarray):
+        return self.rate_matrix
+
+    def outdoor_concentrations(self, t: float) -> np.ndarray:
+        return self.outdoor
+
+
+class CoupledBuildingSolver:
+    """
+        @brief Solves the chemistry of every room and the transport between them as one ODE system
+
+        The states of the rooms are stacked into one vector (room after room). The transport enters the right
+        hand side as linear coupling terms between the same species in different rooms (the generator of the
+        TransportEngine), built from a flux matrix as given by Simulation.trans_matrix, where element [i, j]
+        is the flow (m3/s) from i to j and index 0 is the outside. The system is integrated by one stiff (BDF)
+        integrator, with a block sparse jacobian made of the jacobian of each room on the diagonal and the
+        transport coupling off the diagonal.
+
+        The fluxes are held constant between breakpoints (for example the times at which the wind changes),
+        and evaluated at the start of each segment. The integrator only restarts at those breakpoints,
+        unlike the operator split Simulation which restarts the chemistry of every room each interval.
+
+    """
+
+    def __init__(self,
+                 room_systems: List[RoomODESystem],
+                 volumes: Sequence[float],
+                 transported_species: List[str],
+                 flux_matrix: Callable[[float], np.ndarray],
+                 rtol: float = 1.0e-6,
+                 atol: float = 1.0):
+        """
+        @param room_systems: The chemistry of each room, all with the same species.
+        @param volumes: The volume of each room (m3).
+        @param transported_species: The species which move through the apertures.
+        @param flux_matrix: Gives the (rooms+1 x rooms+1) flux matrix at a time.
+        @param rtol: Relative tolerance of the integrator.
+        @param atol: Absolute tolerance of the integrator (molecule/cm3).
+        """
+        if len(room_systems) != len(volumes):
+            raise Exception(f"Expected a volume for each of the {len(room_systems)} rooms, got {len(volumes)}")
+
+        self.species: List[str] = list(room_systems[0].species)
+        for i, r in enumerate(room_systems):
+            if list(r.species) != self.species:
+                raise Exception(f"The species of room {i} do not match the species of room 0")
+
+        self.room_systems = room_systems
+        self.volumes = np.asarray(volumes, dtype=float)
+        self.flux_matrix = flux_matrix
+        self.rtol = rtol
+        self.atol = atol
+
+        # Positions of the transported species in the state of a room
+        index = pd.Index(self.species)
+        missing = [s for s in transported_species if s not in index]
+        if missing:
+            raise Exception(f"Transported species are not in the room species: {missing}")
+        self._transported = index.get_indexer(transported_species)
+
+        # The transport generator of the current segment, set by _set_segment
+        self._generator: np.ndarray = None
+        self._coupling: sp.csr_matrix = None
+
+    @property
+    def n_rooms(self) -> int:
+        return len(self.room_systems)
+
+    @property
+    def n_species(self) -> int:
+        return len(self.species)
+
+    def _set_segment(self, t: float):
+        """
+        Evaluate the fluxes for the segment starting at t, and build the transport part of the jacobian
+        """
+        n, s = self.n_rooms, self.n_species
+        self._generator = transport_generator(self.flux_matrix(t), self.volumes)
+
+        # Element G[i, j] couples species p of room j to species p of room i, for every transported p
+        rows, columns, values = [], [], []
+        for i, j in zip(*np.nonzero(self._generator[:, :n])):
+            rows.append(i*s + self._transported)
+            columns.append(j*s + self._transported)
+            values.append(np.full(len(self._transported), self._generator[i, j]))
+        if rows:
+            self._coupling = sp.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+                                           shape=(n*s, n*s))
+        else:
+            self._coupling = sp.csr_matrix((n*s, n*s))
+
+    def rhs(self, t: float, y: np.ndarray) -> np.ndarray:
+        """
+        The rate of change of the stacked state of the building
+        """
+        n, s = self.n_rooms, self.n_species
+        rooms = y.reshape(n, s)
+        result = np.empty((n, s))
+        for i, r in enumerate(self.room_systems):
+            result[i, :] = r.rhs(t, rooms[i, :])
+
+        # Transport between the rooms and from the outside
+        outdoor = np.stack([r.outdoor_concentrations(t)[self._transported] for r in self.room_systems])
+        result[:, self._transported] += self._generator[:, :n] @ rooms[:, self._transported]
+        result[:, self._transported] += self._generator[:, n:] @ outdoor
+        return result.reshape(-1)
+
+    def jacobian(self, t: float, y: np.ndarray) -> sp.csc_matrix:
+        """
+        The block sparse jacobian of the stacked system
+        """
+        n, s = self.n_rooms, self.n_species
+        rooms = y.reshape(n, s)
+        blocks = [sp.csr_matrix(r.jacobian(t, rooms[i, :])) for i, r in enumerate(self.room_systems)]
+        return (sp.block_diag(blocks, format="csr") + self._coupling).tocsc()
+
+    def solve(self,
+              t0: float,
+              t_total: float,
+              initial_states: Sequence[np.ndarray],
+              output_times: Sequence[float] = None,
+              breakpoints: Sequence[float] = ()) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Integrate the building from t0 for t_total seconds
+
+        @param initial_states: The state of each room at t0 (in the order of the species).
+        @param output_times: The times to report the state at (by default the start and end).
+        @param breakpoints: Times at which the fluxes change, the integrator restarts at each of them.
+        Returns the times, and the states as a (rooms x times x species) array
+        """
+        t_final = t0+t_total
+        output_times = np.array([t0, t_final] if output_times is None else output_times, dtype=float)
+        if (output_times < t0).any() or (output_times > t_final).any():
+            raise Exception(f"Output times must be between {t0} and {t_final}")
+
+        boundaries = [t0] + sorted(b for b in set(breakpoints) if t0 < b < t_final) + [t_final]
+        y = np.concatenate([np.asarray(s, dtype=float) for s in initial_states])
+        result = np.empty((len(output_times), y.size))
+
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            self._set_segment(start)
+
+            # The output times within this segment, and its end from which the next segment starts
+            in_segment = (output_times >= start) & ((output_times < end) | (end == t_final) & (output_times == end))
+            t_eval = np.union1d(output_times[in_segment], [end])
+            solution = solve_ivp(self.rhs, (start, end), y, method="BDF", jac=self.jacobian,
+                                 t_eval=t_eval, rtol=self.rtol, atol=self.atol)
+            if not solution.success:
+                raise Exception(f"The coupled integration failed between {start} and {end}: {solution.message}")
+
+            result[in_segment, :] = solution.y[:, np.searchsorted(t_eval, output_times[in_segment])].T
+            y = solution.y[:, -1]
+
+        states = result.reshape(len(output_times), self.n_rooms, self.n_species).transpose(1, 0, 2)
+        return output_times, states
+
+    def to_dataframes(self, times: np.ndarray, states: np.ndarray) -> List[pd.DataFrame]:
+        """
+        One DataFrame per room from the result of solve, in the layout of the Simulation results
+        """
+        return [pd.DataFrame(states[i], index=pd.Index(times), columns=self.species) for i in range(self.n_rooms)]
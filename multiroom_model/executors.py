@@ -0,0 +1,158 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+from typing import Any, Callable, Iterable, List, Sequence, Union
+import dill
+from multiprocess import Pool, cpu_count
+from multiprocess.pool import ThreadPool
+
+
+class Executor:
+    """
+        @brief Runs a function on each of a list of arguments, in the same way as Pool.starmap
+
+        The pool of an executor is started by its first call and used for every later call until it is closed,
+        so a simulation does not start new processes on each run (a closed executor starts a new pool if it is
+        called again). The backends are:
+        - "serial": each call in turn in this process, with no overhead (best for a few small rooms)
+        - "thread": a pool of threads in this process, nothing is copied. The calls must be safe to run together,
+          which InChemPy is not, so the InChemPy room evolvers take turns (see RoomInchemPyEvolver)
+        - "process": a pool of processes on this machine (multiprocess.Pool)
+        - "mpi": a pool of MPI processes, which can span the nodes of a cluster (needs mpi4py)
+
+    """
+
+    # Whether the function is run on the arguments themselves, rather than on copies of them
+    # (rooms must then not share anything which the function changes)
+    shares_memory = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def starmap(self, function: Callable, args: Iterable[Sequence[Any]]) -> List[Any]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SerialExecutor(Executor):
+    """
+        @brief Runs each call in turn in this process
+    """
+
+    shares_memory = True
+
+    def starmap(self, function: Callable, args: Iterable[Sequence[Any]]) -> List[Any]:
+        return [function(*a) for a in args]
+
+
+class ThreadExecutor(Executor):
+    """
+        @brief Runs the calls in a pool of threads in this process
+    """
+
+    shares_memory = True
+
+    def __init__(self, processes: int = cpu_count()):
+        self._processes = processes
+        self._pool = None
+
+    def starmap(self, function: Callable, args: Iterable[Sequence[Any]]) -> List[Any]:
+        if self._pool is None:
+            self._pool = ThreadPool(self._processes)
+        return self._pool.starmap(function, args)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+class ProcessExecutor(Executor):
+    """
+        @brief Runs the calls in a pool of processes on this machine
+    """
+
+    def __init__(self, processes: int = cpu_count()):
+        self._processes = processes
+        self._pool = None
+
+    def starmap(self, function: Callable, args: Iterable[Sequence[Any]]) -> List[Any]:
+        if self._pool is None:
+            self._pool = Pool(self._processes)
+        return self._pool.starmap(function, args)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+class MPIExecutor(Executor):
+    """
+        @brief Runs the calls in a pool of MPI processes, which can be spread over the nodes of a cluster
+
+        The script must be started through mpi4py, for example:
+            mpiexec -n 17 python -m mpi4py.futures run_mbm.py
+        which gives one process running the script and 16 running the calls.
+    """
+
+    def __init__(self, processes: int = None):
+        try:
+            from mpi4py import MPI
+            from mpi4py.futures import MPIPoolExecutor
+        except ImportError:
+            raise Exception("The mpi executor needs mpi4py (pip install mpi4py)")
+
+        # The arguments are sent with dill, as they are to a pool of processes
+        MPI.pickle.__init__(dill.dumps, dill.loads)
+        self._pool = MPIPoolExecutor(max_workers=processes)
+
+    def starmap(self, function: Callable, args: Iterable[Sequence[Any]]) -> List[Any]:
+        return list(self._pool.starmap(function, args))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+executor_backends = ("serial", "thread", "process", "mpi")
+
+
+def make_executor(executor: Union[str, Executor], processes: int = cpu_count()) -> Executor:
+    """
+    The executor of a backend (one of executor_backends) with a cap on the number of processes,
+    an executor which is already started is returned as it is
+    """
+    if isinstance(executor, Executor):
+        return executor
+    if executor == "serial":
+        return SerialExecutor()
+    if executor == "thread":
+        return ThreadExecutor(processes)
+    if executor == "process":
+        return ProcessExecutor(processes)
+    if executor == "mpi":
+        return MPIExecutor(processes)
+    raise ValueError(f"Unknown executor {executor}, expected one of {executor_backends}")
@@ -0,0 +1,222 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+from typing import List, Dict, Sequence, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from .result_sink import ResultSink
+
+
+# WHO air quality guidelines (2021) for gas phase species in ug/m3, the long and short term guideline
+# https://www.who.int/publications/i/item/9789240034228
+WHO_2021_GUIDELINES = {"O3": [60.0, 100.0], "NO2": [10.0, 25.0], "SO2": [40.0], "CO": [4000.0]}
+
+
+def who_2021_thresholds() -> Dict[str, List[float]]:
+    """
+    The WHO 2021 guidelines in molecule/cm3, converted as in model_tools/MBM_metrics.R
+    (1 ppb = 2 ug/m3 = 2.46e10 molecule/cm3 at standard temperature and pressure)
+    """
+    return dict((s, [g*2.46e10/2 for g in guidelines]) for s, guidelines in WHO_2021_GUIDELINES.items())
+
+
+class ExposureMetrics(ResultSink):
+    """
+        @brief Reduces the results of each room, as they are computed, to exposure and air quality metrics
+
+        For each room and each chosen species it keeps:
+        - mean: the time weighted mean concentration
+        - max: the largest concentration
+        - time_above_<threshold>: the time (s) the concentration is above each threshold
+        and the same while adults (or children) are in the room (mean_adults, max_adults, time_above_<threshold>_adults...),
+        and the exposure: the integral of the concentration times the number of adults (or children) in the room.
+        The pseudo species "occupancy" gives the duration of the results, the time when adults (or children)
+        are in the room and their mean number.
+
+        The concentrations are taken as linear between the rows of the results, and the number of people as
+        constant from one row to the next. Used as the sink of a simulation there is no need to store the time
+        series (see TeeResultSink to do both), and results gives a Series of metrics for each room.
+
+    """
+
+    groups = ("adults", "children")
+
+    def __init__(self, n_rooms: int, species: Sequence[str], thresholds: Dict[str, Sequence[float]] = None):
+        """
+        @param n_rooms: The number of rooms.
+        @param species: The columns of the results to compute metrics of.
+        @param thresholds: The concentrations of each species to measure the time above (in the units of the results).
+        """
+        thresholds = {} if thresholds is None else thresholds
+        unknown = [s for s in thresholds if s not in species]
+        if unknown:
+            raise ValueError(f"Thresholds given for species which are not in the metrics: {unknown}")
+
+        self.n_rooms = n_rooms
+        self.species = list(species)
+        self.thresholds: List[Tuple[str, float]] = [(s, float(t)) for s in self.species for t in thresholds.get(s, [])]
+        self._threshold_species = np.array([self.species.index(s) for s, _ in self.thresholds], dtype=int)
+        self._threshold_values = np.array([t for _, t in self.thresholds])
+
+        n_species = len(self.species)
+        n_thresholds = len(self.thresholds)
+        self._duration = np.zeros(n_rooms)
+        self._integral = np.zeros((n_rooms, n_species))
+        self._max = np.full((n_rooms, n_species), -np.inf)
+        self._time_above = np.zeros((n_rooms, n_thresholds))
+        self._occupied_time = dict((g, np.zeros(n_rooms)) for g in self.groups)
+        self._occupancy_integral = dict((g, np.zeros(n_rooms)) for g in self.groups)
+        self._occupied_integral = dict((g, np.zeros((n_rooms, n_species))) for g in self.groups)
+        self._occupied_max = dict((g, np.full((n_rooms, n_species), -np.inf)) for g in self.groups)
+        self._occupied_time_above = dict((g, np.zeros((n_rooms, n_thresholds))) for g in self.groups)
+        self._exposure = dict((g, np.zeros((n_rooms, n_species))) for g in self.groups)
+
+        self._n_rows = 0
+        self._positions: Optional[np.ndarray] = None
+        self._columns: Optional[pd.Index] = None
+        # The last interval is only added to the metrics when the next one arrives, so its last row can be replaced
+        self._pending: Optional[Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]] = None
+
+    def _select(self, room_results: List[pd.DataFrame]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        The chosen species (rooms x rows x species) and number of people in each group (rooms x rows)
+        """
+        columns = room_results[0].columns
+        if self._columns is None or not (columns is self._columns or columns.equals(self._columns)):
+            positions = columns.get_indexer(self.species + list(self.groups))
+            if (positions < 0).any():
+                missing = [c for c, p in zip(self.species + list(self.groups), positions) if p < 0]
+                raise Exception(f"The results have no columns {missing} for the exposure metrics")
+            self._columns = columns
+            self._positions = positions
+
+        values = np.stack([r.iloc[:, self._positions].to_numpy(dtype=float) for r in room_results])
+        n_species = len(self.species)
+        occupancy = dict((g, values[:, :, n_species+i]) for i, g in enumerate(self.groups))
+        return values[:, :, :n_species], occupancy
+
+    def append(self, room_results: List[pd.DataFrame]):
+        if len(room_results) != self.n_rooms:
+            raise Exception(f"Expected results for {self.n_rooms} rooms, got {len(room_results)}")
+        self._commit()
+        values, occupancy = self._select(room_results)
+        self._pending = (room_results[0].index.to_numpy(dtype=float), values, occupancy)
+        self._n_rows += len(room_results[0])
+
+    def replace_last_row(self, room_rows: List[pd.DataFrame]):
+        if self._pending is None:
+            raise Exception("There are no results to replace")
+        times, values, occupancy = self._pending
+        if float(room_rows[0].index[-1]) != times[-1]:
+            raise Exception(f"The time of the rows does not match the last time {times[-1]}")
+        new_values, new_occupancy = self._select([r.iloc[[-1], :] for r in room_rows])
+        values[:, -1, :] = new_values[:, 0, :]
+        for g in self.groups:
+            occupancy[g][:, -1] = new_occupancy[g][:, 0]
+
+    def __len__(self) -> int:
+        return self._n_rows
+
+    def _commit(self):
+        """
+        Add the pending interval to the metrics
+        """
+        if self._pending is None:
+            return
+        times, values, occupancy = self._pending
+        self._pending = None
+
+        dt = np.diff(times)
+        segment_mean = (values[:, :-1, :]+values[:, 1:, :])/2
+        segment_above = self._fraction_above(values)
+
+        self._duration += dt.sum()
+        self._integral += np.einsum("rjs,j->rs", segment_mean, dt)
+        self._max = np.maximum(self._max, values.max(axis=1))
+        self._time_above += np.einsum("rjk,j->rk", segment_above, dt)
+
+        for g in self.groups:
+            # People are in the room from one row to the next if they are at its start
+            people = occupancy[g][:, :-1]*dt
+            occupied = (occupancy[g][:, :-1] > 0)*dt
+            self._occupied_time[g] += occupied.sum(axis=1)
+            self._occupancy_integral[g] += people.sum(axis=1)
+            self._occupied_integral[g] += np.einsum("rjs,rj->rs", segment_mean, occupied)
+            self._exposure[g] += np.einsum("rjs,rj->rs", segment_mean, people)
+            self._occupied_time_above[g] += np.einsum("rjk,rj->rk", segment_above, occupied)
+            self._occupied_max[g] = np.maximum(self._occupied_max[g],
+                                               np.where(occupancy[g][:, :, None] > 0, values, -np.inf).max(axis=1))
+
+    def _fraction_above(self, values: np.ndarray) -> np.ndarray:
+        """
+        The fraction of each step between rows when each species is above each of its thresholds (rooms x steps x thresholds)
+        """
+        start = values[:, :-1, self._threshold_species]
+        end = values[:, 1:, self._threshold_species]
+        low, high = np.minimum(start, end), np.maximum(start, end)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing = (high-self._threshold_values)/(high-low)
+        return np.where(low > self._threshold_values, 1.0, np.where(high <= self._threshold_values, 0.0, crossing))
+
+    def results(self) -> List[pd.Series]:
+        """
+        The metrics of each room, indexed by species and metric
+        """
+        self._commit()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self._integral/self._duration[:, None]
+            occupied_mean = dict((g, self._occupied_integral[g]/self._occupied_time[g][:, None]) for g in self.groups)
+            mean_occupancy = dict((g, self._occupancy_integral[g]/self._duration) for g in self.groups)
+
+        def maximum(m):
+            return np.where(np.isneginf(m), np.nan, m)
+
+        labels, columns = [], []
+
+        def add(species, metric, values):
+            labels.append((species, metric))
+            columns.append(values)
+
+        add("occupancy", "duration", self._duration)
+        for g in self.groups:
+            add("occupancy", f"time_{g}", self._occupied_time[g])
+            add("occupancy", f"mean_{g}", mean_occupancy[g])
+
+        for i, s in enumerate(self.species):
+            add(s, "mean", mean[:, i])
+            add(s, "max", maximum(self._max[:, i]))
+            for g in self.groups:
+                add(s, f"mean_{g}", occupied_mean[g][:, i])
+                add(s, f"max_{g}", maximum(self._occupied_max[g][:, i]))
+                add(s, f"exposure_{g}", self._exposure[g][:, i])
+            for k, (threshold_species, threshold) in enumerate(self.thresholds):
+                if threshold_species == s:
+                    add(s, f"time_above_{threshold:g}", self._time_above[:, k])
+                    for g in self.groups:
+                        add(s, f"time_above_{threshold:g}_{g}", self._occupied_time_above[g][:, k])
+
+        index = pd.MultiIndex.from_tuples(labels, names=["species", "metric"])
+        table = np.stack(columns, axis=1)
+        return [pd.Series(table[r], index=index, name="value") for r in range(self.n_rooms)]
+
+    def checkpoint(self, folder: str, run_id: str) -> dict:
+        # The metrics are small, they are saved with the sink in the checkpoint state
+        return {}
+
+    def restore(self, folder: str, info: dict):
+        pass
@@ -41,7 +41,12 @@ class GlobalSettings:
         building_direction_in_radians: float = 0.0,
         air_density: float = 0.0,
         upwind_pressure_coefficient: float = 0.3,
-        downwind_pressure_coefficient: float = -0.2
+        downwind_pressure_coefficient: float = -0.2,
+        mechanism_cache_folder: str = None,
+        max_path_length: int = None,
+        max_transport_paths: int = None,
+        k_shortest_paths: int = None,
+        airflow_model: str = "transport_paths"
     ):
         """
         @param filename: Input FACSIMILE format filename.
@@ -62,6 +67,17 @@ class GlobalSettings:
         @param air_density: Density of the air for advection flow calculations.
         @param upwind_pressure_coefficient: for advection flow calculations.
         @param downwind_pressure_coefficient: for advection flow calculations.
+        @param mechanism_cache_folder: Folder in which generated mechanisms are kept and reused by later runs
+                                       (see MechanismCache), None to generate the mechanism in every run.
+        @param max_path_length: Only transport paths through at most this many apertures (None for no limit).
+        @param max_transport_paths: At most this many transport paths in all, the shortest of each pair of outside
+                                    sides (None for no limit).
+        @param k_shortest_paths: Only the k shortest transport paths between each pair of outside sides
+                                 (None for all of them). These limits keep large buildings tractable,
+                                 see paths_through_building and estimate_path_count.
+        @param airflow_model: How the advection flows are found, "transport_paths" (the wind along each path
+                              through the building) or "pressure_network" (the pressure in each room, see
+                              PressureNetwork), which needs no paths and so suits large buildings.
     """
         self.filename = filename
         self.INCHEM_additional = INCHEM_additional
@@ -83,3 +99,8 @@ class GlobalSettings:
         self.air_density = air_density
         self.upwind_pressure_coefficient = upwind_pressure_coefficient
         self.downwind_pressure_coefficient = downwind_pressure_coefficient
+        self.mechanism_cache_folder = mechanism_cache_folder
+        self.max_path_length = max_path_length
+        self.max_transport_paths = max_transport_paths
+        self.k_shortest_paths = k_shortest_paths
+        self.airflow_model = airflow_model
@@ -0,0 +1,361 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import math
+from typing import List, Tuple, Callable, Optional, Sequence
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from .transport_engine import transport_generator
+
+
+class TransportProbe:
+    """
+        @brief What an interval scheduler can see of a running simulation
+
+        The fluxes through the apertures at any time, and the state of the building at the current time
+        (which is only gathered if a scheduler asks for it).
+
+    """
+
+    # How many flux matrices to keep
+    flux_cache_size: int = 256
+
+    def __init__(self, flux_matrix: Callable[[float], np.ndarray], volumes: Sequence[float]):
+        """
+        @param flux_matrix: Gives the (rooms+1 x rooms+1) flux matrix at a time (as Simulation.trans_matrix).
+        @param volumes: The volume of each room (m3).
+        """
+        self._flux_matrix = flux_matrix
+        self.volumes = np.asarray(volumes, dtype=float)
+        self._fluxes: OrderedDict = OrderedDict()
+        self._state_source: Optional[Callable[[], np.ndarray]] = None
+        self._state: Optional[np.ndarray] = None
+
+    def flux_matrix(self, time: float) -> np.ndarray:
+        """
+        The flux matrix at a time, remembered since a scheduler may ask for the same time more than once
+        """
+        if time in self._fluxes:
+            self._fluxes.move_to_end(time)
+            return self._fluxes[time]
+        result = self._flux_matrix(time)
+        self._fluxes[time] = result
+        if len(self._fluxes) > self.flux_cache_size:
+            self._fluxes.popitem(last=False)
+        return result
+
+    def set_state(self, state_source: Optional[Callable[[], np.ndarray]]):
+        """
+        Set how to gather the current building state (2*rooms x species, as TransportEngine.building_state)
+        """
+        self._state_source = state_source
+        self._state = None
+
+    @property
+    def has_state(self) -> bool:
+        return self._state_source is not None
+
+    @property
+    def state(self) -> Optional[np.ndarray]:
+        if self._state is None and self._state_source is not None:
+            self._state = self._state_source()
+        return self._state
+
+    def relative_transport_rate(self, time: float, concentration_floor: float) -> float:
+        """
+        The largest rate of change from transport relative to the concentration (1/s),
+        over the rooms and the species above the concentration floor
+        """
+        state = self.state
+        if state is None:
+            return 0.0
+        n = len(self.volumes)
+        rate = transport_generator(self.flux_matrix(time), self.volumes) @ state
+        indoor = np.abs(state[:n, :])
+        significant = indoor > concentration_floor
+        if not significant.any():
+            return 0.0
+        return float((np.abs(rate[significant])/indoor[significant]).max())
+
+
+class IntervalScheduler:
+    """
+        @brief Chooses the length of each interval of chemistry (between transport steps) in a run
+
+        A run calls reset, then next_interval at the start of each interval until it returns None.
+        No interval crosses a breakpoint (a time at which a schedule of the building changes), instead
+        it is shortened to end there, so the next interval starts with the new values.
+        Every interval chosen is recorded, with the reason for its length, and can be reported after the run.
+
+    """
+
+    def __init__(self):
+        self._steps: List[Tuple[float, float, str]] = []
+        self._t_final: float = None
+        self._breakpoints: List[float] = []
+        self._last_proposed: float = None
+
+    def reset(self, t0: float, t_final: float, breakpoints: Sequence[float] = ()):
+        """
+        Start a new run from t0 to t_final, with intervals aligned to the breakpoints
+        """
+        self._steps = []
+        self._t_final = t_final
+        self._breakpoints = self.breakpoints_within(t0, t_final, breakpoints)
+        self._last_proposed = None
+
+    @property
+    def breakpoints(self) -> List[float]:
+        """
+        The breakpoints of the current run
+        """
+        return self._breakpoints
+
+    @staticmethod
+    def breakpoints_within(t0: float, t_final: float, breakpoints: Sequence[float]) -> List[float]:
+        """
+        The breakpoints strictly between t0 and t_final, in order
+        """
+        return sorted(b for b in set(breakpoints) if t0 < b < t_final)
+
+    def next_breakpoint(self, time: float) -> Optional[float]:
+        """
+        The first breakpoint after time (one which time has not already reached)
+        """
+        for b in self._breakpoints:
+            if b-time > _time_tolerance(b):
+                return b
+        return None
+
+    def next_interval(self, time: float, probe: TransportProbe) -> Optional[float]:
+        """
+        The length of the interval starting at time, or None when the run is finished
+        """
+        choice = self._choose(time, probe)
+        if choice is None:
+            return None
+        length, reason = choice
+        self._last_proposed = length
+
+        # Never step over a breakpoint
+        b = self.next_breakpoint(time)
+        if b is not None and time+length > b+_time_tolerance(b):
+            length, reason = b-time, "breakpoint"
+
+        self._steps.append((time, length, reason))
+        return length
+
+    def _choose(self, time: float, probe: TransportProbe) -> Optional[Tuple[float, str]]:
+        raise NotImplementedError()
+
+    def planned_intervals(self, t0: float, t_final: float, breakpoints: Sequence[float] = ()) -> Optional[List[Tuple[float, float]]]:
+        """
+        The (start, length) of every interval if they are known before the run, otherwise None
+        """
+        return None
+
+    def estimated_interval_count(self, t0: float, t_final: float) -> int:
+        """
+        An estimate of the number of intervals in a run
+        """
+        return 1 + len(self._breakpoints)
+
+    def step_report(self) -> pd.DataFrame:
+        """
+        The intervals chosen in the last run, with their start, length, and what limited their length
+        """
+        return pd.DataFrame(self._steps, columns=["start", "length", "limited_by"])
+
+
+def _time_tolerance(time: float) -> float:
+    """
+    How close two times must be to be the same time, allowing for rounding when times are added up
+    """
+    return 1.0e-9*max(1.0, abs(time))
+
+
+class FixedIntervalScheduler(IntervalScheduler):
+    """
+        @brief Intervals of one fixed length
+
+        Intervals of t_interval are taken while they fit in the total time, then any time left is one
+        shorter interval. The first interval is always a whole interval. An interval which contains
+        breakpoints is split at them, and the intervals after it keep to the same regular times.
+
+    """
+
+    def __init__(self, t_interval: float):
+        super().__init__()
+        if t_interval <= 0:
+            raise ValueError(f"The interval must be positive, got {t_interval}")
+        self.t_interval = t_interval
+        self._planned: List[Tuple[float, float, str]] = []
+
+    def _plan(self, t0: float, t_final: float, breakpoints: Sequence[float]) -> List[Tuple[float, float, str]]:
+        """
+        The (start, length, reason) of every interval
+        """
+        # The first interval is always a whole interval
+        intervals = [(t0, self.t_interval)]
+        solved_time = t0+self.t_interval
+
+        # Stop when another increment would take it over the total
+        while (solved_time+self.t_interval <= t_final):
+            intervals.append((solved_time, self.t_interval))
+            solved_time = solved_time+self.t_interval
+
+        # Final interval if there is any time smaller than a single interval left to be solved
+        if solved_time < t_final:
+            intervals.append((solved_time, t_final-solved_time))
+
+        # Split the intervals at the breakpoints
+        breakpoints = self.breakpoints_within(t0, t_final, breakpoints)
+        result = []
+        for start, length in intervals:
+            reason = "fixed" if length == self.t_interval else "end"
+            end = start+length
+            for b in breakpoints:
+                if start+_time_tolerance(b) < b < end-_time_tolerance(b):
+                    result.append((start, b-start, "breakpoint"))
+                    start, length = b, end-b
+            result.append((start, length, reason))
+        return result
+
+    def planned_intervals(self, t0: float, t_final: float, breakpoints: Sequence[float] = ()) -> List[Tuple[float, float]]:
+        return [(start, length) for start, length, _ in self._plan(t0, t_final, breakpoints)]
+
+    def estimated_interval_count(self, t0: float, t_final: float) -> int:
+        return len(self._plan(t0, t_final, self._breakpoints))
+
+    def reset(self, t0: float, t_final: float, breakpoints: Sequence[float] = ()):
+        super().reset(t0, t_final, breakpoints)
+        self._planned = self._plan(t0, t_final, breakpoints)
+
+    def _choose(self, time: float, probe: TransportProbe) -> Optional[Tuple[float, str]]:
+        if len(self._steps) == len(self._planned):
+            return None
+        start, length, reason = self._planned[len(self._steps)]
+        if abs(start-time) > _time_tolerance(start):
+            raise Exception(f"Expected the interval starting at {start}, asked for the interval starting at {time}")
+
+        # Keep to the planned end, whatever rounding there has been in adding up the times
+        if start != time:
+            length = start+length-time
+        return length, reason
+
+
+class AdaptiveIntervalScheduler(IntervalScheduler):
+    """
+        @brief Intervals whose length follows how fast the transport changes the building
+
+        Each interval starts from the previous length multiplied by a growth factor (capped by max_interval)
+        and is then shortened so that:
+        - one transport step changes no concentration by more than update_tolerance (relative), judged from
+          the current state of the building
+        - the fluxes through the apertures change by no more than flux_tolerance (relative to the largest
+          flux) over the interval, by halving the interval until they do
+        Intervals are never shorter than min_interval (or the granularity) unless they must end at a breakpoint,
+        and the last interval ends exactly at the end of the run.
+        Quiet periods are crossed in long intervals, gusts in short ones.
+
+    """
+
+    def __init__(self,
+                 min_interval: float,
+                 max_interval: float,
+                 flux_tolerance: float = 0.1,
+                 update_tolerance: float = 0.1,
+                 initial_interval: float = None,
+                 growth_factor: float = 2.0,
+                 minimum_flux: float = 1.0e-4,
+                 concentration_floor: float = 1.0e3,
+                 granularity: float = None):
+        """
+        @param min_interval: The shortest interval (s).
+        @param max_interval: The longest interval (s).
+        @param flux_tolerance: The largest relative change of the fluxes over one interval.
+        @param update_tolerance: The largest relative change of a concentration from one transport step.
+        @param initial_interval: The length of the first interval before any limit (by default min_interval).
+        @param growth_factor: How much longer an interval can be than the one before.
+        @param minimum_flux: Flux (m3/s) below which changes are judged against this instead (so calm is not noisy).
+        @param concentration_floor: Concentrations below this (molecule/cm3) are ignored by the update tolerance.
+        @param granularity: If given, interval lengths are rounded down to a multiple of this (for example the
+                            output step dt of the solver), except for the last interval. Simulation.run uses
+                            its time step when none is given.
+        """
+        super().__init__()
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError(f"Expected 0 < min_interval <= max_interval, got {min_interval} and {max_interval}")
+        if growth_factor < 1:
+            raise ValueError(f"The growth factor must be at least 1, got {growth_factor}")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.flux_tolerance = flux_tolerance
+        self.update_tolerance = update_tolerance
+        self.initial_interval = min_interval if initial_interval is None else min(max(initial_interval, min_interval), max_interval)
+        self.growth_factor = growth_factor
+        self.minimum_flux = minimum_flux
+        self.concentration_floor = concentration_floor
+        self.granularity = granularity
+
+    def estimated_interval_count(self, t0: float, t_final: float) -> int:
+        return max(1, math.ceil((t_final-t0)/self.max_interval)) + len(self._breakpoints)
+
+    def flux_change(self, probe: TransportProbe, time: float, length: float) -> float:
+        """
+        The largest relative change of the fluxes from time, at the middle and the end of the interval
+        """
+        start = probe.flux_matrix(time)
+        scale = max(np.abs(start).max(), self.minimum_flux)
+        return max(np.abs(probe.flux_matrix(time+f*length) - start).max()/scale for f in (0.5, 1.0))
+
+    def _choose(self, time: float, probe: TransportProbe) -> Optional[Tuple[float, str]]:
+        remaining = self._t_final-time
+        if remaining <= _time_tolerance(self._t_final):
+            return None
+
+        # The interval can go no further than the next breakpoint or the end
+        b = self.next_breakpoint(time)
+        horizon, horizon_reason = (remaining, "end") if b is None else (b-time, "breakpoint")
+
+        if self._last_proposed is not None:
+            # Grow from the length proposed last time, not one shortened to end at a breakpoint
+            length = min(self.max_interval, self.growth_factor*self._last_proposed)
+            reason = "max" if length == self.max_interval else "growth"
+        else:
+            length, reason = self.initial_interval, "initial"
+
+        # Limit the size of the transport update relative to the state
+        rate = probe.relative_transport_rate(time, self.concentration_floor)
+        if rate > 0 and self.update_tolerance/rate < length:
+            length, reason = max(self.update_tolerance/rate, self.min_interval), "update"
+
+        # Shorten the interval until the fluxes are nearly constant over it
+        length = min(length, horizon)
+        while length > self.min_interval and self.flux_change(probe, time, length) > self.flux_tolerance:
+            length, reason = max(length/2, self.min_interval), "flux"
+
+        if self.granularity:
+            length = max(math.floor(length/self.granularity)*self.granularity, self.granularity)
+
+        # Finish exactly at the breakpoint or the end, without leaving an interval shorter than the minimum
+        if length >= horizon or horizon-length < self.min_interval:
+            length, reason = horizon, horizon_reason
+
+        return length, reason
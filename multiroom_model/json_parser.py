@@ -369,6 +369,11 @@ class GlobalSettingsJSONBuilder:
             air_density=float(data.get("air_density", 0.0)),
             upwind_pressure_coefficient=float(data.get("upwind_pressure_coefficient", 0.3)),
             downwind_pressure_coefficient=float(data.get("downwind_pressure_coefficient", -0.2)),
+            mechanism_cache_folder=data.get("mechanism_cache_folder"),
+            max_path_length=data.get("max_path_length"),
+            max_transport_paths=data.get("max_transport_paths"),
+            k_shortest_paths=data.get("k_shortest_paths"),
+            airflow_model=str(data.get("airflow_model", "transport_paths")),
         )
 
 
@@ -0,0 +1,229 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+import argparse
+import warnings
+from typing import Any, Callable, List, Optional, Sequence
+import pandas as pd
+
+from .checkpoint import write_file_atomically
+
+# The arguments of the main class which name files, whose contents (not names) go into the key
+_FILE_ARGUMENTS = ("filename", "custom_filename", "constrained_file")
+
+# The arguments which do not change the generated main class
+_IGNORED_ARGUMENTS = ("output_folder",)
+
+
+def _freeze(value: Any) -> Any:
+    """
+    A form of the arguments whose repr is the same for equal arguments
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if hasattr(value, "tolist"):
+        return _freeze(value.tolist())
+    return value
+
+
+def file_digest(path: Optional[str]) -> Optional[str]:
+    """
+    The sha256 of the content of a file, or the name itself if there is no such file
+    """
+    if path is None or not os.path.isfile(path):
+        return path
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class MechanismCache:
+    """
+        @brief A folder of generated InChemPy main classes (the parsed mechanism and its generated rate and
+        jacobian code), so a mechanism is only generated once across runs and jobs
+
+        Each entry is keyed by the sha256 of the contents of the mechanism files (the FAC file, the custom
+        reactions and the constraints), and of every other argument the main class is generated from (the
+        INCHEM_additional, particles and custom flags, the volume and surfaces of the room...).
+        Changing any of them gives a different key, so an entry is never used for another mechanism.
+        The folder holds <key>.pkl, the pickled main class, and <key>.json, what it was generated from.
+        Entries are written in one step, so several jobs can share one folder.
+
+        From the command line:
+            python -m multiroom_model.mechanism_cache <folder> list
+            python -m multiroom_model.mechanism_cache <folder> evict --older-than-days 30 --max-megabytes 2000
+            python -m multiroom_model.mechanism_cache <folder> clear
+
+    """
+
+    # Increased when the way the entries are written changes, so older entries are no longer used
+    version = 1
+
+    def __init__(self, folder: str):
+        """
+        @param folder: The folder of the cache (created if needed).
+        """
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, arguments: dict) -> str:
+        """
+        The key of the main class generated from the arguments (as given to generate_main_class)
+        """
+        files = dict((name, file_digest(arguments.get(name))) for name in _FILE_ARGUMENTS)
+        others = dict((k, v) for k, v in arguments.items() if k not in _FILE_ARGUMENTS + _IGNORED_ARGUMENTS)
+        description = repr((self.version, _freeze(files), _freeze(others)))
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.folder, f"{key}.{extension}")
+
+    def load(self, key: str) -> Optional[Any]:
+        """
+        The main class of the entry, None if there is no such entry (or it can not be read)
+        """
+        path = self._path(key, "pkl")
+        try:
+            with open(path, "rb") as file:
+                main_class = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # The modification time records when the entry was last used
+        os.utime(path)
+        return main_class
+
+    def store(self, key: str, main_class: Any, arguments: dict) -> bool:
+        """
+        Add an entry, returns False (with a warning) if the main class can not be pickled
+        """
+        try:
+            data = pickle.dumps(main_class, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            warnings.warn(f"The mechanism generated from {arguments.get('filename')} can not be cached: {e}")
+            return False
+        write_file_atomically(self._path(key, "pkl"), lambda file: file.write(data))
+        description = {"filename": arguments.get("filename"),
+                       "files": dict((name, file_digest(arguments.get(name))) for name in _FILE_ARGUMENTS),
+                       "created": time.time()}
+        write_file_atomically(self._path(key, "json"),
+                              lambda file: file.write(json.dumps(description, indent=1, default=str).encode()))
+        return True
+
+    def get(self, arguments: dict, generate: Callable[..., Any]) -> Any:
+        """
+        The main class generated from the arguments, from the cache or else generated (with generate(**arguments))
+        and added to the cache
+        """
+        key = self.key(arguments)
+        main_class = self.load(key)
+        if main_class is None:
+            main_class = generate(**arguments)
+            self.store(key, main_class, arguments)
+        return main_class
+
+    def entries(self) -> pd.DataFrame:
+        """
+        The entries of the cache, with their mechanism file, size, and when they were created and last used
+        """
+        rows = []
+        for name in sorted(os.listdir(self.folder)):
+            if not name.endswith(".pkl"):
+                continue
+            key = name[:-len(".pkl")]
+            stat = os.stat(self._path(key, "pkl"))
+            try:
+                with open(self._path(key, "json")) as file:
+                    description = json.load(file)
+            except (OSError, ValueError):
+                description = {}
+            rows.append({"key": key,
+                         "filename": description.get("filename"),
+                         "megabytes": stat.st_size/1e6,
+                         "created": pd.to_datetime(description.get("created", stat.st_mtime), unit="s"),
+                         "last_used": pd.to_datetime(stat.st_mtime, unit="s")})
+        return pd.DataFrame(rows, columns=["key", "filename", "megabytes", "created", "last_used"])
+
+    def remove(self, keys: Sequence[str]):
+        for key in keys:
+            for extension in ("pkl", "json"):
+                if os.path.exists(self._path(key, extension)):
+                    os.remove(self._path(key, extension))
+
+    def evict(self, older_than_days: float = None, max_megabytes: float = None) -> List[str]:
+        """
+        Remove the entries not used for older_than_days, then the least recently used entries until the
+        cache is no larger than max_megabytes. Returns the keys removed.
+        """
+        entries = self.entries().sort_values("last_used")
+        removed = []
+        if older_than_days is not None:
+            cutoff = pd.Timestamp.fromtimestamp(time.time()-older_than_days*86400, tz="UTC").tz_localize(None)
+            removed += entries.loc[entries["last_used"] < cutoff, "key"].tolist()
+            entries = entries.loc[entries["last_used"] >= cutoff]
+        if max_megabytes is not None:
+            total = entries["megabytes"].sum()
+            for key, megabytes in zip(entries["key"], entries["megabytes"]):
+                if total <= max_megabytes:
+                    break
+                removed.append(key)
+                total -= megabytes
+        self.remove(removed)
+        return removed
+
+    def clear(self):
+        self.remove(self.entries()["key"].tolist())
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Inspect and evict the entries of a mechanism cache")
+    parser.add_argument("folder", help="The folder of the cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List the entries")
+    evict = commands.add_parser("evict", help="Remove old entries")
+    evict.add_argument("--older-than-days", type=float, default=None, help="Remove the entries not used for this many days")
+    evict.add_argument("--max-megabytes", type=float, default=None,
+                       help="Then remove the least recently used entries until the cache is no larger than this")
+    remove = commands.add_parser("remove", help="Remove some entries")
+    remove.add_argument("keys", nargs="+", help="The keys of the entries")
+    commands.add_parser("clear", help="Remove every entry")
+    args = parser.parse_args(argv)
+
+    cache = MechanismCache(args.folder)
+    if args.command == "list":
+        entries = cache.entries()
+        print(entries.to_string(index=False) if len(entries) else "The cache is empty")
+    elif args.command == "evict":
+        removed = cache.evict(args.older_than_days, args.max_megabytes)
+        print(f"Removed {len(removed)} entries")
+    elif args.command == "remove":
+        cache.remove(args.keys)
+    elif args.command == "clear":
+        cache.clear()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
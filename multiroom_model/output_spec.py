@@ -0,0 +1,169 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import re
+from typing import List, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+from .result_sink import ResultSink
+
+
+class OutputSpec:
+    """
+        @brief Which columns and which times of the results of a simulation are stored
+
+        The simulation carries the full state of every room from one interval to the next, the output
+        spec only chooses the part of it which is stored in the results.
+
+    """
+
+    def __init__(self,
+                 species: Sequence[str] = None,
+                 pattern: str = None,
+                 output_interval: float = None,
+                 include_outdoor: bool = True):
+        """
+        @param species: The names of the columns to store (names not in the results are ignored).
+        @param pattern: A regular expression, the columns whose whole name matches it are also stored.
+                        If neither species nor pattern is given every column is stored.
+        @param output_interval: Store the rows every output_interval seconds from the start of the run,
+                                rather than every time step of the solver (None for every row).
+        @param include_outdoor: Also store the outdoor column (the name followed by OUT) of each species.
+        """
+        if output_interval is not None and output_interval <= 0:
+            raise ValueError(f"The output interval must be positive, got {output_interval}")
+        self.species = None if species is None else list(species)
+        self.pattern = pattern
+        self.output_interval = output_interval
+        self.include_outdoor = include_outdoor
+        self._regex = None if pattern is None else re.compile(pattern)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_regex"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._regex = None if self.pattern is None else re.compile(self.pattern)
+
+    def selects_all_columns(self) -> bool:
+        return self.species is None and self.pattern is None
+
+    def column_positions(self, columns: pd.Index) -> np.ndarray:
+        """
+        The positions of the columns to store, in the order of the results
+        """
+        if self.selects_all_columns():
+            return np.arange(len(columns))
+
+        names = set()
+        if self.species is not None:
+            names.update(self.species)
+            if self.include_outdoor:
+                names.update(f"{s}OUT" for s in self.species)
+
+        selected = [i for i, c in enumerate(columns)
+                    if c in names or (self._regex is not None and self._regex.fullmatch(str(c)) is not None)]
+        if not selected:
+            raise Exception(f"The output spec selects none of the {len(columns)} columns of the results")
+        return np.array(selected)
+
+    def check_time_step(self, dt: float):
+        """
+        Check that the output interval is a whole number of time steps, otherwise the rows at some output
+        times would not exist and would be silently missing from the results
+        """
+        if self.output_interval is None:
+            return
+        steps = self.output_interval/dt
+        if abs(steps-round(steps)) > 1.0e-9*max(1.0, steps):
+            raise ValueError(f"The output interval {self.output_interval} is not a multiple of the time step {dt}")
+
+    def row_mask(self, times: np.ndarray, origin: float) -> np.ndarray:
+        """
+        Which of the times to store, those a whole number of output intervals after the origin
+        """
+        if self.output_interval is None:
+            return np.ones(len(times), dtype=bool)
+        steps = (times-origin)/self.output_interval
+        tolerance = 1.0e-9*np.maximum(1.0, np.abs(times))
+        return np.abs(steps-np.round(steps))*self.output_interval <= tolerance
+
+
+class OutputSpecSink(ResultSink):
+    """
+        @brief Stores the part of the results chosen by an output spec in another sink
+
+    """
+
+    def __init__(self, sink: ResultSink, output_spec: OutputSpec):
+        """
+        @param sink: The sink which stores the chosen rows and columns.
+        @param output_spec: Which rows and columns to store.
+        """
+        self.sink = sink
+        self.output_spec = output_spec
+        self._origin: Optional[float] = None
+        self._last_time: Optional[float] = None
+        self._columns: Optional[pd.Index] = None
+        self._positions: Optional[np.ndarray] = None
+
+    def _select(self, room_results: List[pd.DataFrame], rows: np.ndarray) -> List[pd.DataFrame]:
+        columns = room_results[0].columns
+        if self._columns is None or not (columns is self._columns or columns.equals(self._columns)):
+            self._columns = columns
+            self._positions = self.output_spec.column_positions(columns)
+        return [r.iloc[rows, self._positions] for r in room_results]
+
+    def append(self, room_results: List[pd.DataFrame]):
+        times = room_results[0].index.to_numpy(dtype=float)
+        if self._origin is None:
+            self._origin = times[0]
+
+        rows = np.flatnonzero(self.output_spec.row_mask(times, self._origin))
+        if self._last_time is not None:
+            # Each interval starts at the time which ended the previous one, with the state after the transport
+            # between them, which replaces the stored row of that time
+            if len(rows) and times[rows[0]] == self._last_time:
+                self.sink.replace_last_row(self._select(room_results, rows[:1]))
+            rows = rows[times[rows] > self._last_time]
+        if len(rows) == 0:
+            return
+        self.sink.append(self._select(room_results, rows))
+        self._last_time = times[rows[-1]]
+
+    def replace_last_row(self, room_rows: List[pd.DataFrame]):
+        # Only a row which was stored is replaced
+        if self._last_time is not None and float(room_rows[0].index[-1]) == self._last_time:
+            self.sink.replace_last_row(self._select(room_rows, np.array([len(room_rows[0])-1])))
+
+    def __len__(self) -> int:
+        return len(self.sink)
+
+    def close(self):
+        self.sink.close()
+
+    def results(self):
+        return self.sink.results()
+
+    def checkpoint(self, folder: str, run_id: str) -> dict:
+        return self.sink.checkpoint(folder, run_id)
+
+    def restore(self, folder: str, info: dict):
+        self.sink.restore(folder, info)
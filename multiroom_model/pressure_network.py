@@ -0,0 +1,305 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import math
+from typing import List, Tuple, TypeVar, Optional
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import spsolve
+
+from .aperture import Aperture, Side
+from .aperture_calculations import Fluxes, flow_exchange, _zero_advection_tolerance
+
+Room = TypeVar('Room')
+
+# The direction of the wind (as WindDefinition, relative to the building direction) which blows straight
+# into each side of the building, matching the directions of the transport paths (see transport_path_angle_in_radians)
+_side_inward_angles = {
+    Side.Back: 0.0,
+    Side.Front: math.pi,
+    Side.Left: math.pi/2,
+    Side.Right: -math.pi/2,
+}
+
+# The wind gives no pressure on apertures in the roof or the floor, they open onto the still outside air
+_still_air_sides = (Side.Upward, Side.Downward)
+
+
+class PressureNetwork:
+    """
+        @brief The airflow through every aperture of a building, from the pressure in each room
+
+        The wind gives a pressure on each side of the building, 0.5 * air_density * wind_speed^2 * Cp, with
+        the pressure coefficient Cp going from the upwind coefficient on the side facing the wind to the
+        downwind coefficient on the opposite side (with the cosine of the angle between them). Apertures in the
+        roof or the floor (Upward or Downward) are at the pressure of the still outside air, as the model has no
+        stack effect.
+        The flow through an aperture follows the orifice equation, Cd * area * sqrt(2 |dP| / air_density),
+        from the higher to the lower pressure. The pressure in each room is found by Newton iteration so that
+        as much air flows into each room as flows out of it.
+
+        The system has one unknown for each room and one term for each aperture, so its cost grows with the size
+        of the building, not with the number of transport paths through it. Rooms which are not connected
+        to the outside have no flow.
+
+    """
+
+    def __init__(self,
+                 rooms: List[Room],
+                 apertures: List[Aperture],
+                 building_direction_in_radians: float = 0,
+                 air_density: float = 0,
+                 building_pressure_coefficients: Tuple[float, float] = (0, 0),
+                 discharge_coefficient: float = 0.7,
+                 linear_pressure: float = 1.0e-6,
+                 tolerance: float = 1.0e-10,
+                 max_iterations: int = 100):
+        """
+        @param rooms: The rooms of the building.
+        @param apertures: The apertures between the rooms and to the outside.
+        @param building_direction_in_radians: Orientation of the building.
+        @param air_density: Density of the air (kg/m3).
+        @param building_pressure_coefficients: The upwind and downwind pressure coefficients.
+        @param discharge_coefficient: The discharge coefficient (Cd) of every aperture.
+        @param linear_pressure: Below this pressure difference (Pa) the flow is taken as linear in the pressure
+                                difference, so the flow has a finite derivative where there is no flow.
+        @param tolerance: The largest imbalance of the flows into a room (relative to the largest flow).
+        @param max_iterations: The most Newton iterations before giving up.
+        """
+        if building_pressure_coefficients[0] < building_pressure_coefficients[1]:
+            raise Exception("The higher building pressure coefficient should come first")
+
+        self.rooms = rooms
+        self.apertures = apertures
+        self.building_direction_in_radians = building_direction_in_radians
+        self.air_density = air_density
+        self.building_pressure_coefficients = building_pressure_coefficients
+        self.linear_pressure = linear_pressure
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+        room_index = dict((id(r), i) for i, r in enumerate(rooms))
+        n_apertures = len(apertures)
+
+        # The incidence of the apertures on the rooms, the pressure difference across aperture a (origin minus
+        # destination) is incidence @ room_pressures - outdoor_pressures
+        rows, columns, values = [], [], []
+        self._outdoor_side: List[Optional[Side]] = []
+        for a, aperture in enumerate(apertures):
+            rows.append(a)
+            columns.append(room_index[id(aperture.origin)])
+            values.append(1.0)
+            if type(aperture.destination) is Side:
+                if aperture.destination not in _side_inward_angles and aperture.destination not in _still_air_sides:
+                    raise ValueError(f"The pressure network has no wind pressure on the {aperture.destination} side")
+                self._outdoor_side.append(aperture.destination)
+            else:
+                rows.append(a)
+                columns.append(room_index[id(aperture.destination)])
+                values.append(-1.0)
+                self._outdoor_side.append(None)
+        incidence = sp.csr_matrix((values, (rows, columns)), shape=(n_apertures, len(rooms)))
+
+        # Only rooms connected (through other rooms) to an outdoor aperture have flows
+        adjacency = incidence.T @ incidence
+        _, component = connected_components(adjacency, directed=False)
+        outdoor = np.array([s is not None for s in self._outdoor_side], dtype=bool)
+        ventilated_components = set(component[incidence[outdoor].indices]) if outdoor.any() else set()
+        self._solved_rooms = np.array([c in ventilated_components for c in component], dtype=bool)
+        self._incidence = incidence[:, self._solved_rooms].tocsr()
+
+        self._outdoor = outdoor
+        self._conductance = discharge_coefficient*np.array([a.area for a in apertures], dtype=float) * \
+            (math.sqrt(2/air_density) if air_density > 0 else 0.0)
+
+        # Apertures to a room which is not connected to the outside, or which have no area, have no flow
+        self._has_outdoor_aperture = np.zeros(len(rooms), dtype=bool)
+        for a, aperture in enumerate(apertures):
+            if outdoor[a]:
+                self._has_outdoor_aperture[room_index[id(aperture.origin)]] = True
+        # The rooms each side of each aperture, by position (rooms are not looked up by id as the network may be
+        # pickled with the simulation)
+        self.aperture_rooms: List[Tuple[int, Optional[int]]] = [
+            (room_index[id(a.origin)], None if type(a.destination) is Side else room_index[id(a.destination)])
+            for a in apertures]
+        self._last_wind: Optional[Tuple[float, float]] = None
+        self._last_flows: np.ndarray = np.zeros(n_apertures)
+        self._last_pressures: np.ndarray = np.zeros(len(rooms))
+        self._last_throughflow: np.ndarray = np.zeros(len(rooms), dtype=bool)
+        self._room_incidence = abs(incidence).T.tocsr()
+
+    def side_pressures(self, wind_speed: float, wind_direction: float) -> np.ndarray:
+        """
+        The wind pressure (Pa) outside each aperture (zero for apertures between rooms, and in the roof or the floor)
+        """
+        upwind, downwind = self.building_pressure_coefficients
+        dynamic_pressure = 0.5*self.air_density*wind_speed**2
+        result = np.zeros(len(self.apertures))
+        for a, side in enumerate(self._outdoor_side):
+            if side in _side_inward_angles:
+                angle = wind_direction - self.building_direction_in_radians - _side_inward_angles[side]
+                cp = 0.5*(upwind+downwind) + 0.5*(upwind-downwind)*math.cos(angle)
+                result[a] = dynamic_pressure*cp
+        return result
+
+    def _orifice_flows(self, pressure_differences: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The flow through each aperture (m3/s, from origin to destination) and its derivative by the pressure difference
+        """
+        magnitude = np.abs(pressure_differences)
+        linear = magnitude < self.linear_pressure
+        root = np.sqrt(np.where(linear, self.linear_pressure, magnitude))
+        flows = self._conductance*np.where(linear, pressure_differences/root, np.sign(pressure_differences)*root)
+        derivatives = self._conductance*np.where(linear, 1.0/root, 0.5/root)
+        return flows, derivatives
+
+    def solve(self, wind_speed: float, wind_direction: float) -> np.ndarray:
+        """
+        The flow through each aperture (m3/s, positive from its origin to its destination) for a wind,
+        the last solution is kept as every aperture asks for the same wind in turn
+        """
+        if self._last_wind == (wind_speed, wind_direction):
+            return self._last_flows
+
+        outside = self.side_pressures(wind_speed, wind_direction)
+        n_solved = self._incidence.shape[1]
+        pressures = np.zeros(n_solved)
+        if n_solved > 0 and np.abs(outside).max(initial=0.0) > 0 and self._conductance.any():
+            pressures = self._newton(outside)
+
+        room_pressures = np.zeros(len(self.rooms))
+        room_pressures[self._solved_rooms] = pressures
+        flows, _ = self._orifice_flows(self._incidence @ pressures - outside)
+
+        self._last_wind = (wind_speed, wind_direction)
+        self._last_flows = flows
+        self._last_pressures = room_pressures
+        self._last_throughflow = (self._room_incidence @ (np.abs(flows) > _zero_advection_tolerance).astype(float)) > 0
+        return flows
+
+    def room_pressures(self, wind_speed: float, wind_direction: float) -> np.ndarray:
+        """
+        The pressure (Pa, relative to the still outside air) in each room for a wind
+        """
+        self.solve(wind_speed, wind_direction)
+        return self._last_pressures
+
+    def _newton(self, outside: np.ndarray) -> np.ndarray:
+        """
+        The room pressures where the flows into each room balance, found by damped Newton iteration
+        """
+        incidence = self._incidence
+        transpose = incidence.T.tocsr()
+        regularisation = sp.identity(incidence.shape[1], format="csr")*1.0e-300
+
+        # Start from the pressures of a network with flows linear in the pressure difference
+        conductance = sp.diags(self._conductance/math.sqrt(max(np.abs(outside).max(), self.linear_pressure)))
+        pressures = spsolve((transpose @ conductance @ incidence + regularisation).tocsc(),
+                            transpose @ (conductance @ outside))
+        pressures = np.atleast_1d(pressures)
+
+        def imbalance(p: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+            flows, derivatives = self._orifice_flows(incidence @ p - outside)
+            return transpose @ flows, derivatives
+
+        residual, derivatives = imbalance(pressures)
+        scale = max(np.abs(self._orifice_flows(-outside)[0]).max(), 1.0e-300)
+        for _ in range(self.max_iterations):
+            if np.abs(residual).max() <= self.tolerance*scale:
+                return pressures
+            jacobian = (transpose @ sp.diags(derivatives) @ incidence + regularisation).tocsc()
+            step = np.atleast_1d(spsolve(jacobian, -residual))
+
+            # Halve the step until the imbalance falls
+            norm = np.abs(residual).max()
+            for _ in range(40):
+                candidate = pressures + step
+                candidate_residual, candidate_derivatives = imbalance(candidate)
+                if np.abs(candidate_residual).max() < norm:
+                    break
+                step = step/2
+            pressures, residual, derivatives = candidate, candidate_residual, candidate_derivatives
+
+        if np.abs(residual).max() <= self.tolerance*scale*1.0e3:
+            return pressures
+        raise Exception(f"The pressure network did not converge in {self.max_iterations} iterations")
+
+    def has_throughflow(self, room_index: int, wind_speed: float, wind_direction: float) -> bool:
+        """
+        Whether any air flows through a room (by its position) for a wind, the equivalent of cross ventilation
+        by a transport path
+        """
+        self.solve(wind_speed, wind_direction)
+        return bool(self._last_throughflow[room_index])
+
+    def has_outdoor_aperture(self, room_index: int) -> bool:
+        return bool(self._has_outdoor_aperture[room_index])
+
+
+class NetworkApertureCalculation:
+    """
+        @brief The fluxes through one aperture from a pressure network, used by Simulation.trans_matrix
+        in the same way as an ApertureCalculation
+
+        An aperture with advection flow gives it in one direction. An aperture with none gives the exchange flow
+        of its category, in the same order of priority as ApertureCalculation.exchange_category, with
+        a room through which any air flows counted as cross-ventilated.
+
+    """
+
+    def __init__(self, network: PressureNetwork, index: int):
+        """
+        @param network: The pressure network of the building (shared by all its apertures).
+        @param index: The position of the aperture in the apertures of the network.
+        """
+        self.network = network
+        self.index = index
+        self.aperture = network.apertures[index]
+        self.is_outdoor_aperture = type(self.aperture.destination) is Side
+        self.origin_index, self.destination_index = network.aperture_rooms[index]
+
+    def advection_flow_rate(self, wind_speed: float, wind_direction: float) -> float:
+        return float(self.network.solve(wind_speed, wind_direction)[self.index])
+
+    def exchange_category(self, wind_speed: float, wind_direction: float) -> int:
+        if self.network.has_throughflow(self.origin_index, wind_speed, wind_direction):
+            return 1
+        elif not self.is_outdoor_aperture and self.network.has_throughflow(self.destination_index, wind_speed, wind_direction):
+            return 1
+        elif self.is_outdoor_aperture:
+            return 2
+        elif self.network.has_outdoor_aperture(self.origin_index) or self.network.has_outdoor_aperture(self.destination_index):
+            return 3
+        else:
+            return 4
+
+    def trans_matrix_contributions(self, wind_speed: float, wind_direction_in_radians: float) -> Fluxes:
+        """
+        the advection or exchange fluxes resulting from given wind conditions
+        """
+        advection = self.advection_flow_rate(wind_speed, wind_direction_in_radians)
+        if advection > _zero_advection_tolerance:
+            return Fluxes(from_1_to_2=advection, from_2_to_1=0)
+        elif advection < -_zero_advection_tolerance:
+            return Fluxes(from_1_to_2=0, from_2_to_1=-advection)
+        else:
+            exchange = flow_exchange(self.exchange_category(wind_speed, wind_direction_in_radians))
+            return Fluxes(from_1_to_2=exchange, from_2_to_1=exchange)
+
+    # The network is already solved once for each wind, so there is nothing more to tabulate
+    lookup_trans_matrix_contributions = trans_matrix_contributions
@@ -0,0 +1,198 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+from typing import List, Optional, Tuple, Sequence
+import numpy as np
+import pandas as pd
+
+
+def typed_dataframe(values: np.ndarray, index: pd.Index, columns: pd.Index, dtypes: Sequence) -> pd.DataFrame:
+    """
+    A DataFrame of float values (rows x columns) whose columns are cast to their original types
+    """
+    # Group the column positions by their original type, casting each group in one go is much
+    # faster than casting the columns one by one
+    positions_by_dtype = {}
+    for position, dtype in enumerate(dtypes):
+        positions_by_dtype.setdefault(dtype, []).append(position)
+
+    if len(positions_by_dtype) == 1:
+        dtype, = positions_by_dtype.keys()
+        return pd.DataFrame(values.astype(dtype), index=index, columns=columns)
+
+    column_order = np.argsort(np.concatenate(list(positions_by_dtype.values())))
+    parts = [pd.DataFrame(values[:, positions].astype(dtype), index=index, columns=columns[positions])
+             for dtype, positions in positions_by_dtype.items()]
+    df = pd.concat(parts, axis=1).iloc[:, column_order]
+    df.columns = columns
+    return df
+
+
+class ResultAccumulator:
+    """
+        @brief A growable rooms x time x species array which collects the results of a simulation
+
+        Each interval of results is copied into a preallocated float array which shares one time index
+        across all the rooms. When the array is full its capacity is doubled, so appending is linear
+        in the number of intervals. The results are only turned into DataFrames when requested.
+
+    """
+
+    def __init__(self, n_rooms: int, capacity: int = 0):
+        """
+        @param n_rooms: The number of rooms whose results are collected.
+        @param capacity: An estimate of the total number of rows, used to preallocate the array.
+        """
+        self._n_rooms = n_rooms
+        self._capacity = capacity
+        self._n_rows = 0
+        self._times: Optional[np.ndarray] = None
+        self._values: Optional[np.ndarray] = None
+        self._columns: Optional[pd.Index] = None
+        self._dtypes: Optional[pd.Series] = None
+        self._index_name = None
+
+    def __len__(self):
+        return self._n_rows
+
+    @property
+    def columns(self) -> Optional[pd.Index]:
+        return self._columns
+
+    def times(self) -> np.ndarray:
+        """
+        The time index shared by all of the rooms
+        """
+        if self._times is None:
+            return np.empty(0)
+        return self._times[:self._n_rows]
+
+    def append(self, room_results: List[pd.DataFrame]):
+        """
+        Copy one interval of results (one DataFrame per room) into the end of the array
+        All the rooms must share the same time index and the same columns
+        """
+        if len(room_results) != self._n_rooms:
+            raise Exception(f"Expected results for {self._n_rooms} rooms, got {len(room_results)}")
+
+        # The first results define the columns and time index of the array
+        if self._columns is None:
+            self._columns = room_results[0].columns
+            self._dtypes = room_results[0].dtypes
+            self._index_name = room_results[0].index.name
+
+        times = room_results[0].index.to_numpy(dtype=float)
+        for i, r in enumerate(room_results):
+            if not r.columns.equals(self._columns):
+                raise Exception(f"The columns of room {i} do not match the columns of the accumulated results")
+            if not np.array_equal(r.index.to_numpy(dtype=float), times):
+                raise Exception(f"The times of room {i} do not match the times of the other rooms")
+
+        n_new_rows = len(times)
+        self._reserve(self._n_rows + n_new_rows)
+
+        # Copy the new rows into the array
+        rows = slice(self._n_rows, self._n_rows + n_new_rows)
+        self._times[rows] = times
+        for i, r in enumerate(room_results):
+            self._values[i, rows, :] = r.to_numpy(dtype=float)
+
+        self._n_rows += n_new_rows
+
+    def layout(self) -> Optional[dict]:
+        """
+        The columns, column types and index name of the results (None before any results are appended)
+        """
+        if self._columns is None:
+            return None
+        return {"columns": self._columns, "dtypes": self._dtypes, "index_name": self._index_name}
+
+    def rows(self, start: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The times and values (rooms x rows x columns) of the rows from start onwards
+        """
+        if self._columns is None:
+            return np.empty(0), np.empty((self._n_rooms, 0, 0))
+        return self._times[start:self._n_rows].copy(), self._values[:, start:self._n_rows, :].copy()
+
+    def append_rows(self, times: np.ndarray, values: np.ndarray, layout: dict = None):
+        """
+        Copy rows as given by rows() into the end of the array
+        The layout (as given by layout()) is needed if no results have been appended yet
+        """
+        if self._columns is None:
+            if layout is None:
+                raise Exception("The layout of the results is needed to append rows to empty results")
+            self._columns = layout["columns"]
+            self._dtypes = layout["dtypes"]
+            self._index_name = layout["index_name"]
+        if values.shape != (self._n_rooms, len(times), len(self._columns)):
+            raise Exception(f"Expected rows of shape {(self._n_rooms, len(times), len(self._columns))}, got {values.shape}")
+
+        self._reserve(self._n_rows + len(times))
+        rows = slice(self._n_rows, self._n_rows + len(times))
+        self._times[rows] = times
+        self._values[:, rows, :] = values
+        self._n_rows += len(times)
+
+    def replace_last_row(self, room_rows: List[pd.DataFrame]):
+        """
+        Overwrite the last row of every room (for example with the state after a final transport step)
+        Each room gives a DataFrame whose last row has the same time and columns as the last accumulated row
+        """
+        if self._n_rows == 0:
+            raise Exception("There are no accumulated results to replace")
+        if len(room_rows) != self._n_rooms:
+            raise Exception(f"Expected results for {self._n_rooms} rooms, got {len(room_rows)}")
+
+        time = self._times[self._n_rows-1]
+        for i, r in enumerate(room_rows):
+            if not r.columns.equals(self._columns):
+                raise Exception(f"The columns of room {i} do not match the columns of the accumulated results")
+            if float(r.index[-1]) != time:
+                raise Exception(f"The time of room {i} does not match the last accumulated time {time}")
+            self._values[i, self._n_rows-1, :] = r.iloc[-1, :].to_numpy(dtype=float)
+
+    def to_dataframes(self) -> List[pd.DataFrame]:
+        """
+        Convert the array into one DataFrame per room, restoring the column types of the original results
+        """
+        if self._columns is None:
+            return [pd.DataFrame() for _ in range(self._n_rooms)]
+
+        index = pd.Index(self.times(), name=self._index_name)
+        return [typed_dataframe(self._values[i, :self._n_rows, :], index, self._columns, self._dtypes)
+                for i in range(self._n_rooms)]
+
+    def _reserve(self, n_rows: int):
+        """
+        Ensure the array has space for at least n_rows, doubling the capacity when it grows
+        """
+        if self._values is not None and self._values.shape[1] >= n_rows:
+            return
+
+        current_capacity = 0 if self._values is None else self._values.shape[1]
+        new_capacity = max(n_rows, self._capacity, 2*current_capacity)
+
+        times = np.empty(new_capacity)
+        values = np.empty((self._n_rooms, new_capacity, len(self._columns)))
+        if self._values is not None:
+            times[:self._n_rows] = self._times[:self._n_rows]
+            values[:, :self._n_rows, :] = self._values[:, :self._n_rows, :]
+
+        self._times = times
+        self._values = values
@@ -0,0 +1,489 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import json
+import pickle
+from typing import List, Dict, Any, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+from .result_accumulator import ResultAccumulator, typed_dataframe
+from .checkpoint import write_atomically, write_file_atomically
+
+
+def write_json_atomically(path: str, data: Any):
+    write_file_atomically(path, lambda file: file.write(json.dumps(data, indent=1).encode()))
+
+
+def write_npy_atomically(path: str, array: np.ndarray):
+    write_file_atomically(path, lambda file: np.save(file, array))
+
+
+def room_folder(folder: str, room: int) -> str:
+    return os.path.join(folder, f"room_{room:03d}")
+
+
+def read_times(folder: str, name: str) -> np.ndarray:
+    return np.load(os.path.join(folder, f"times_{name}.npy"))
+
+
+class ResultSink:
+    """
+        @brief Where Simulation.run puts the results of each interval as soon as they are computed
+
+        A sink receives the rows of every interval (one DataFrame per room, all with the same times and columns),
+        and can replace the last row (the state after a final transport step). It can save its progress with a
+        checkpoint of the run and be restored to that checkpoint when the run is resumed.
+        After the run, results gives the results of each room.
+
+    """
+
+    def append(self, room_results: List[pd.DataFrame]):
+        raise NotImplementedError()
+
+    def replace_last_row(self, room_rows: List[pd.DataFrame]):
+        raise NotImplementedError()
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Write out anything still held in memory
+        """
+        pass
+
+    def results(self) -> List[Any]:
+        """
+        The results of each room
+        """
+        raise NotImplementedError()
+
+    def checkpoint(self, folder: str, run_id: str) -> dict:
+        """
+        Save the results so far along with a checkpoint written to folder, returns what restore needs
+        """
+        raise NotImplementedError()
+
+    def restore(self, folder: str, info: dict):
+        """
+        Return to the results saved by checkpoint
+        """
+        raise NotImplementedError()
+
+
+class MemoryResultSink(ResultSink):
+    """
+        @brief Keeps the results in memory in a ResultAccumulator, and gives them as DataFrames
+
+        Checkpoints write the rows added since the previous checkpoint to a pickle file in the checkpoint folder.
+
+    """
+
+    def __init__(self, n_rooms: int, capacity: int = 0):
+        """
+        @param n_rooms: The number of rooms whose results are collected.
+        @param capacity: An estimate of the total number of rows, used to preallocate the results.
+        """
+        self.n_rooms = n_rooms
+        self.accumulator = ResultAccumulator(n_rooms, capacity)
+        self._chunks: List[str] = []
+        self._rows_saved = 0
+
+    def __getstate__(self):
+        # The results are saved by checkpoint, not with the sink itself
+        state = dict(self.__dict__)
+        state["accumulator"] = None
+        return state
+
+    def append(self, room_results: List[pd.DataFrame]):
+        self.accumulator.append(room_results)
+
+    def replace_last_row(self, room_rows: List[pd.DataFrame]):
+        self.accumulator.replace_last_row(room_rows)
+
+    def __len__(self) -> int:
+        return len(self.accumulator)
+
+    def results(self) -> List[pd.DataFrame]:
+        return self.accumulator.to_dataframes()
+
+    def checkpoint(self, folder: str, run_id: str) -> dict:
+        # Only the rows added since the previous checkpoint are written
+        if len(self.accumulator) > self._rows_saved:
+            chunk = f"results_{run_id}_{len(self._chunks):05d}.pkl"
+            write_atomically(os.path.join(folder, chunk), self.accumulator.rows(self._rows_saved))
+            self._chunks.append(chunk)
+            self._rows_saved = len(self.accumulator)
+        return {"layout": self.accumulator.layout(), "chunks": list(self._chunks), "n_rows": self._rows_saved}
+
+    def restore(self, folder: str, info: dict):
+        self.accumulator = ResultAccumulator(self.n_rooms, info["n_rows"])
+        for chunk in info["chunks"]:
+            with open(os.path.join(folder, chunk), "rb") as file:
+                times, values = pickle.load(file)
+            self.accumulator.append_rows(times, values, info["layout"])
+        if len(self.accumulator) != info["n_rows"]:
+            raise Exception(f"Checkpoint in {folder} has {len(self.accumulator)} rows of results, expected {info['n_rows']}")
+        self._chunks = list(info["chunks"])
+        self._rows_saved = info["n_rows"]
+
+
+class TeeResultSink(ResultSink):
+    """
+        @brief Sends the results to several sinks, for example to store them and to compute metrics of them
+
+        results gives, for each room, a tuple of the results of each sink.
+
+    """
+
+    def __init__(self, sinks: Sequence[ResultSink]):
+        self.sinks = list(sinks)
+
+    def append(self, room_results: List[pd.DataFrame]):
+        for sink in self.sinks:
+            sink.append(room_results)
+
+    def replace_last_row(self, room_rows: List[pd.DataFrame]):
+        for sink in self.sinks:
+            sink.replace_last_row(room_rows)
+
+    def __len__(self) -> int:
+        return len(self.sinks[0])
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def results(self) -> List[tuple]:
+        return list(zip(*[sink.results() for sink in self.sinks]))
+
+    def checkpoint(self, folder: str, run_id: str) -> dict:
+        return {"sinks": [sink.checkpoint(folder, f"{run_id}_{i}") for i, sink in enumerate(self.sinks)]}
+
+    def restore(self, folder: str, info: dict):
+        for sink, sink_info in zip(self.sinks, info["sinks"]):
+            sink.restore(folder, sink_info)
+
+
+class ChunkedResultSink(ResultSink):
+    """
+        @brief Writes the results to a folder on disk in chunks of rows, so the memory used stays flat
+
+        Rows are held in memory until there are chunk_rows of them (or a checkpoint, or close), then written
+        as one chunk. The folder holds:
+        - layout.json: the columns, their types and the name of the time index
+        - manifest.json: the chunks written so far and their number of rows
+        - times_NNNNNN.*: the times of each chunk (shared by every room)
+        - room_RRR/values_NNNNNN.*: the values of each chunk for each room
+        The manifest is replaced in one step after the chunks it lists are written, so the folder can be read
+        (with ChunkedResultStore) while the run is going on, or after it stopped part way.
+
+        Subclasses choose the file format of the chunks.
+
+    """
+
+    layout_file = "layout.json"
+    manifest_file = "manifest.json"
+    format = None
+
+    def __init__(self, folder: str, n_rooms: int, chunk_rows: int = 256):
+        """
+        @param folder: The folder to write to (created if needed, any results already in it are replaced).
+        @param n_rooms: The number of rooms whose results are written.
+        @param chunk_rows: How many rows to hold in memory before they are written.
+        """
+        self.folder = folder
+        self.n_rooms = n_rooms
+        self.chunk_rows = chunk_rows
+
+        self._columns: Optional[pd.Index] = None
+        self._chunks: List[Dict[str, Any]] = []
+        self._n_rows_written = 0
+        self._buffer_times: List[np.ndarray] = []
+        self._buffer_values: List[np.ndarray] = []
+
+        os.makedirs(folder, exist_ok=True)
+        for i in range(n_rooms):
+            os.makedirs(self._room_folder(i), exist_ok=True)
+        if os.path.exists(os.path.join(folder, self.manifest_file)):
+            os.remove(os.path.join(folder, self.manifest_file))
+
+    def __getstate__(self):
+        # The rows held in memory are saved by checkpoint (which writes them out) not with the sink itself
+        state = dict(self.__dict__)
+        state["_buffer_times"] = []
+        state["_buffer_values"] = []
+        return state
+
+    def _room_folder(self, room: int) -> str:
+        return room_folder(self.folder, room)
+
+    def _buffered_rows(self) -> int:
+        return sum(len(t) for t in self._buffer_times)
+
+    def __len__(self) -> int:
+        return self._n_rows_written + self._buffered_rows()
+
+    def append(self, room_results: List[pd.DataFrame]):
+        if len(room_results) != self.n_rooms:
+            raise Exception(f"Expected results for {self.n_rooms} rooms, got {len(room_results)}")
+
+        if self._columns is None:
+            self._columns = room_results[0].columns
+            write_json_atomically(os.path.join(self.folder, self.layout_file), {
+                "columns": [str(c) for c in self._columns],
+                "dtypes": [str(d) for d in room_results[0].dtypes],
+                "index_name": room_results[0].index.name,
+                "format": self.format})
+
+        times = room_results[0].index.to_numpy(dtype=float)
+        for i, r in enumerate(room_results):
+            if not r.columns.equals(self._columns):
+                raise Exception(f"The columns of room {i} do not match the columns of the results")
+            if not np.array_equal(r.index.to_numpy(dtype=float), times):
+                raise Exception(f"The times of room {i} do not match the times of the other rooms")
+
+        self._buffer_times.append(times)
+        self._buffer_values.append(np.stack([r.to_numpy(dtype=float) for r in room_results]))
+
+        if self._buffered_rows() >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the rows held in memory as a new chunk
+        """
+        if not self._buffer_times:
+            return
+        times = np.concatenate(self._buffer_times)
+        values = np.concatenate(self._buffer_values, axis=1)
+        name = f"{len(self._chunks):06d}"
+
+        self._write_times(name, times)
+        for i in range(self.n_rooms):
+            self._write_values(i, name, values[i])
+
+        self._chunks.append({"name": name, "n_rows": len(times)})
+        self._n_rows_written += len(times)
+        self._buffer_times = []
+        self._buffer_values = []
+        self._write_manifest()
+
+    def _write_manifest(self):
+        write_json_atomically(os.path.join(self.folder, self.manifest_file),
+                              {"n_rooms": self.n_rooms, "n_rows": self._n_rows_written, "chunks": self._chunks})
+
+    def replace_last_row(self, room_rows: List[pd.DataFrame]):
+        if len(self) == 0:
+            raise Exception("There are no results to replace")
+        new_rows = np.stack([r.iloc[-1, :].to_numpy(dtype=float) for r in room_rows])
+
+        if self._buffer_times:
+            if float(room_rows[0].index[-1]) != self._buffer_times[-1][-1]:
+                raise Exception(f"The time of the rows does not match the last time {self._buffer_times[-1][-1]}")
+            self._buffer_values[-1][:, -1, :] = new_rows
+        else:
+            # Rewrite the last chunk on disk
+            name = self._chunks[-1]["name"]
+            if float(room_rows[0].index[-1]) != read_times(self.folder, name)[-1]:
+                raise Exception(f"The time of the rows does not match the last time of the results")
+            for i in range(self.n_rooms):
+                values = np.array(self._read_values(self.folder, i, name, self._columns, None))
+                values[-1, :] = new_rows[i]
+                self._write_values(i, name, values)
+
+    def close(self):
+        self.flush()
+
+    def results(self) -> List["ChunkedRoomReader"]:
+        self.flush()
+        store = ChunkedResultStore(self.folder)
+        return [store.room(i) for i in range(self.n_rooms)]
+
+    def checkpoint(self, folder: str, run_id: str) -> dict:
+        self.flush()
+        return {"n_rows": self._n_rows_written, "n_chunks": len(self._chunks)}
+
+    def restore(self, folder: str, info: dict):
+        """
+        Drop any chunks written after the checkpoint
+        """
+        with open(os.path.join(self.folder, self.manifest_file)) as file:
+            chunks = json.load(file)["chunks"]
+        if len(chunks) < info["n_chunks"] or sum(c["n_rows"] for c in chunks[:info["n_chunks"]]) != info["n_rows"]:
+            raise Exception(f"The results in {self.folder} do not match the checkpoint in {folder}")
+        self._chunks = chunks[:info["n_chunks"]]
+        self._n_rows_written = info["n_rows"]
+        self._buffer_times = []
+        self._buffer_values = []
+        self._write_manifest()
+
+    def _write_times(self, name: str, times: np.ndarray):
+        write_npy_atomically(os.path.join(self.folder, f"times_{name}.npy"), times)
+
+    # The file format of the values of the chunks
+
+    def _write_values(self, room: int, name: str, values: np.ndarray):
+        raise NotImplementedError()
+
+    @staticmethod
+    def _read_values(folder: str, room: int, name: str, columns: pd.Index, positions: Optional[np.ndarray]) -> np.ndarray:
+        raise NotImplementedError()
+
+
+class NpyResultSink(ChunkedResultSink):
+    """
+        @brief A chunked result sink which writes numpy .npy files, with no extra dependencies
+
+        The values of each chunk are stored column by column (Fortran order), so reading a few species
+        from a memory mapped chunk only touches those columns.
+
+    """
+
+    format = "npy"
+
+    def _write_values(self, room: int, name: str, values: np.ndarray):
+        write_npy_atomically(os.path.join(self._room_folder(room), f"values_{name}.npy"), np.asfortranarray(values))
+
+    @staticmethod
+    def _read_values(folder: str, room: int, name: str, columns: pd.Index, positions: Optional[np.ndarray]) -> np.ndarray:
+        values = np.load(os.path.join(room_folder(folder, room), f"values_{name}.npy"), mmap_mode="r")
+        return values if positions is None else values[:, positions]
+
+
+class ParquetResultSink(ChunkedResultSink):
+    """
+        @brief A chunked result sink which writes one Parquet file per chunk and room (needs pyarrow)
+
+    """
+
+    format = "parquet"
+
+    def __init__(self, folder: str, n_rooms: int, chunk_rows: int = 256):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise Exception("The Parquet result sink needs the pyarrow package")
+        super().__init__(folder, n_rooms, chunk_rows)
+
+    def _write_values(self, room: int, name: str, values: np.ndarray):
+        df = pd.DataFrame(values, columns=[str(c) for c in self._columns])
+        write_file_atomically(os.path.join(self._room_folder(room), f"values_{name}.parquet"), lambda file: df.to_parquet(file))
+
+    @staticmethod
+    def _read_values(folder: str, room: int, name: str, columns: pd.Index, positions: Optional[np.ndarray]) -> np.ndarray:
+        selected = None if positions is None else [str(columns[p]) for p in positions]
+        return pd.read_parquet(os.path.join(room_folder(folder, room), f"values_{name}.parquet"), columns=selected).to_numpy()
+
+
+class ChunkedRoomReader:
+    """
+        @brief Reads the results of one room from a chunked result store
+
+    """
+
+    def __init__(self, store: "ChunkedResultStore", room: int):
+        self.store = store
+        self.room = room
+
+    @property
+    def columns(self) -> pd.Index:
+        return self.store.columns
+
+    def times(self) -> np.ndarray:
+        return self.store.times()
+
+    def read(self, columns: Sequence[str] = None, t_start: float = None, t_end: float = None) -> pd.DataFrame:
+        """
+        Read some (or all) of the columns between two times (inclusive) as a DataFrame
+        """
+        return self.store.read(self.room, columns, t_start, t_end)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return self.read()
+
+
+class ChunkedResultStore:
+    """
+        @brief Reads a folder written by a ChunkedResultSink, including one whose run is still going or stopped
+
+    """
+
+    def __init__(self, folder: str):
+        """
+        @param folder: The folder written by the sink.
+        """
+        self.folder = folder
+        with open(os.path.join(folder, ChunkedResultSink.layout_file)) as file:
+            layout = json.load(file)
+        self.columns = pd.Index(layout["columns"])
+        self.dtypes = [np.dtype(d) for d in layout["dtypes"]]
+        self.index_name = layout["index_name"]
+        self._format = {"npy": NpyResultSink, "parquet": ParquetResultSink}[layout["format"]]
+
+        with open(os.path.join(folder, ChunkedResultSink.manifest_file)) as file:
+            manifest = json.load(file)
+        self.n_rooms = manifest["n_rooms"]
+        self.chunks = [c["name"] for c in manifest["chunks"]]
+
+    def room(self, room: int) -> ChunkedRoomReader:
+        return ChunkedRoomReader(self, room)
+
+    def times(self) -> np.ndarray:
+        if not self.chunks:
+            return np.empty(0)
+        return np.concatenate([read_times(self.folder, c) for c in self.chunks])
+
+    def read_chunk(self, room: int, chunk: str, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        The values (rows x columns) of one chunk of a room, all the columns or those at positions
+        """
+        return np.asarray(self._format._read_values(self.folder, room, chunk, self.columns, positions))
+
+    def read(self, room: int, columns: Sequence[str] = None, t_start: float = None, t_end: float = None) -> pd.DataFrame:
+        """
+        Read some (or all) of the columns of a room between two times (inclusive) as a DataFrame
+        """
+        if columns is None:
+            positions = None
+            selected = self.columns
+            dtypes = self.dtypes
+        else:
+            positions = self.columns.get_indexer(list(columns))
+            if (positions < 0).any():
+                missing = [c for c, p in zip(columns, positions) if p < 0]
+                raise Exception(f"Unknown columns: {missing}")
+            selected = self.columns[positions]
+            dtypes = [self.dtypes[p] for p in positions]
+
+        times, values = [], []
+        for c in self.chunks:
+            chunk_times = read_times(self.folder, c)
+            keep = np.ones(len(chunk_times), dtype=bool)
+            if t_start is not None:
+                keep &= chunk_times >= t_start
+            if t_end is not None:
+                keep &= chunk_times <= t_end
+            if keep.any():
+                times.append(chunk_times[keep])
+                values.append(self.read_chunk(room, c, positions)[keep, :])
+
+        index = pd.Index(np.concatenate(times) if times else np.empty(0), name=self.index_name)
+        data = np.concatenate(values) if values else np.empty((0, len(selected)))
+        return typed_dataframe(data, index, selected, dtypes)
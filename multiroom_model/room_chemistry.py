@@ -55,3 +55,16 @@ class RoomChemistry:
 
     def surface_area_dictionary(self):
         return self.composition.surface_area_dictionary(self.surf_area_in_m2)
+
+    def schedule_times(self) -> List[float]:
+        """
+        Every time at which one of the step values of the room changes (in order)
+        The occupancy and humidity, which the evolver reads once at the start of each interval.
+        The temperature, air change, light switch and emissions are given to InChemPy as whole schedules,
+        so an interval may span their changes.
+        """
+        times = set()
+        for schedule in (self.rh_in_percent, self.n_adults, self.n_children):
+            if schedule is not None:
+                times.update(schedule.times())
+        return sorted(times)
@@ -15,10 +15,14 @@
 #
 # ############################################################################ #
 
-from typing import List, Tuple
+import copy
+import threading
+from typing import List, Tuple, Any, Dict, Hashable
+import numpy as np
 from .global_settings import GlobalSettings
 from .room_chemistry import RoomChemistry
 from .inchem import generate_main_class, run_main_class
+from .mechanism_cache import MechanismCache
 from .time_dep_value import TimeDependentValue
 
 
@@ -35,6 +39,44 @@ def interpret_light_on_times(room_mrlswitch: List[Tuple[float, float]], end_of_t
     return light_on_times
 
 
+# InChemPy is not safe to run in several threads at once (such as by the thread executor), so the evolvers of
+# one process take turns to generate and run their main classes
+_inchempy_lock = threading.Lock()
+
+# The mechanism arguments which only give the size of the room, each room binds its own to the main class it runs
+GEOMETRY_ARGUMENTS = ("volume", "surface_area")
+
+
+def _hashable(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return _hashable(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def mechanism_key(arguments: dict) -> Hashable:
+    """
+    A hashable key of the mechanism arguments of a room, equal for rooms with equal arguments
+    The geometry of the room is left out, so rooms which differ only in size share one generated main class
+    """
+    return _hashable(dict((k, v) for k, v in arguments.items() if k not in GEOMETRY_ARGUMENTS))
+
+
+def bind_geometry(main_class: Any, room: RoomChemistry):
+    """
+    Give a main class (which may have been generated for another room) the volume and surfaces of the room
+    """
+    for name, value in (("volume", room.volume_in_m3), ("surface_area", room.surface_area_dictionary())):
+        if not hasattr(main_class, name):
+            raise Exception(f"The InChemPy main class has no {name} to give the geometry of the room")
+        setattr(main_class, name, value)
+
+
 class RoomInchemPyEvolver:
     """
         @brief A class which can evolve the state of species in a room using Inchem py
@@ -47,20 +89,48 @@ class RoomInchemPyEvolver:
     global_settings: GlobalSettings = None
     const_dict: dict = None
 
-    def __init__(self, room: RoomChemistry, global_settings: GlobalSettings, const_dict: dict = None):
+    # The const dict used when none is provided
+    default_const_dict = {
+        'O2': 0.2095,
+        'N2': 0.7809,
+        'H2': 550e-9,
+        'saero': 1.3e-2  # aerosol surface area concentration
+    }
+
+    def __init__(self, room: RoomChemistry, global_settings: GlobalSettings, const_dict: dict = None, main_class=None):
+        """
+        @param main_class: An InChemPy main class already generated from the same mechanism arguments
+                           (see mechanism_key), which is used rather than generating a new one.
+                           The volume and surfaces of this room are bound to it on each run.
+        """
 
         # Store the room and settings
         self.room = room
         self.global_settings = global_settings
 
         # If the const dict is not provided, use this default one
-        self.const_dict = const_dict or {
-            'O2': 0.2095,
-            'N2': 0.7809,
-            'H2': 550e-9,
-            'saero': 1.3e-2  # aerosol surface area concentration
-        }
+        self.const_dict = const_dict or dict(self.default_const_dict)
+
+        if main_class is not None:
+            self.inchem = main_class
+            return
+
+        #Generate an inchempy instance, (including calculating the jacobians for later use)
+        arguments = self.mechanism_arguments(room, global_settings, self.const_dict)
+        cache_folder = getattr(global_settings, "mechanism_cache_folder", None)
+        with _inchempy_lock:
+            if cache_folder is not None:
+                # or load the one generated by an earlier run from the same mechanism
+                self.inchem = MechanismCache(cache_folder).get(arguments, generate_main_class)
+            else:
+                self.inchem = generate_main_class(**arguments)
 
+    @staticmethod
+    def mechanism_arguments(room: RoomChemistry, global_settings: GlobalSettings, const_dict: dict = None) -> dict:
+        """
+        The arguments from which the InChemPy main class of a room is generated,
+        rooms with the same arguments can share one generated main class
+        """
         # Change the rooms emisions into the format of dictionary which inchempy understands
         timed_emissions = hasattr(room, "emissions")
         if timed_emissions:
@@ -68,23 +138,22 @@ class RoomInchemPyEvolver:
         else:
             timed_inputs = None
 
-        #Generate an inchempy instance, (including calculating the jacobians for later use)
-        self.inchem = generate_main_class(
-            filename=self.global_settings.filename,
-            INCHEM_additional=self.global_settings.INCHEM_additional,
-            particles=self.global_settings.particles,
-            constrained_file=self.global_settings.constrained_file,
-            output_folder=self.global_settings.output_folder,
-            dt=self.global_settings.dt,
+        return dict(
+            filename=global_settings.filename,
+            INCHEM_additional=global_settings.INCHEM_additional,
+            particles=global_settings.particles,
+            constrained_file=global_settings.constrained_file,
+            output_folder=global_settings.output_folder,
+            dt=global_settings.dt,
             volume=room.volume_in_m3,
             surface_area=room.surface_area_dictionary(),
-            const_dict=self.const_dict,
-            H2O2_dep=self.global_settings.H2O2_dep,
-            O3_dep=self.global_settings.O3_dep,
-            custom=self.global_settings.custom,
+            const_dict=const_dict or dict(RoomInchemPyEvolver.default_const_dict),
+            H2O2_dep=global_settings.H2O2_dep,
+            O3_dep=global_settings.O3_dep,
+            custom=global_settings.custom,
             timed_emissions=timed_emissions,
             timed_inputs=timed_inputs,
-            custom_filename=self.global_settings.custom_filename
+            custom_filename=global_settings.custom_filename
         )
 
     def run(self, t0, seconds_to_integrate, initial_dataframe=None, initial_text_file=None, const_dict: dict = None):
@@ -135,33 +204,62 @@ class RoomInchemPyEvolver:
         else:
             timed_inputs = None
 
-        # Run the inchempy instance with these properties, times and initial conditions
-        result = run_main_class(self.inchem,
-                                t0=t0,
-                                seconds_to_integrate=seconds_to_integrate,
-                                dt=self.global_settings.dt,
-                                timed_emissions=timed_emissions,
-                                timed_inputs=timed_inputs,
-                                spline=spline,
-                                temperatures=temperatures,
-                                rel_humidity=rel_humidity,
-                                const_dict=cd,
-                                M=M,
-                                light_type=self.room.light_type,
-                                glass=self.room.glass_type,
-                                diurnal=self.global_settings.diurnal,
-                                city=self.global_settings.city,
-                                date=self.global_settings.date,
-                                lat=self.global_settings.lat,
-                                ACRate_dict=ACRate_dict,
-                                light_on_times=light_on_times,
-                                initial_conditions_gas=initial_conditions_gas,
-                                initials_from_run=initials_from_run,
-                                path=self.global_settings.path,
-                                adults=adults,
-                                children=children,
-                                output_folder=self.global_settings.output_folder,
-                                reactions_output=self.global_settings.reactions_output,
-                                initial_dataframe=initial_dataframe
-                                )
+        # Only one evolver of this process runs InChemPy at a time
+        with _inchempy_lock:
+            # The main class may be shared with (or copied from) a room of another size
+            bind_geometry(self.inchem, self.room)
+
+            # Run the inchempy instance with these properties, times and initial conditions
+            result = run_main_class(self.inchem,
+                                    t0=t0,
+                                    seconds_to_integrate=seconds_to_integrate,
+                                    dt=self.global_settings.dt,
+                                    timed_emissions=timed_emissions,
+                                    timed_inputs=timed_inputs,
+                                    spline=spline,
+                                    temperatures=temperatures,
+                                    rel_humidity=rel_humidity,
+                                    const_dict=cd,
+                                    M=M,
+                                    light_type=self.room.light_type,
+                                    glass=self.room.glass_type,
+                                    diurnal=self.global_settings.diurnal,
+                                    city=self.global_settings.city,
+                                    date=self.global_settings.date,
+                                    lat=self.global_settings.lat,
+                                    ACRate_dict=ACRate_dict,
+                                    light_on_times=light_on_times,
+                                    initial_conditions_gas=initial_conditions_gas,
+                                    initials_from_run=initials_from_run,
+                                    path=self.global_settings.path,
+                                    adults=adults,
+                                    children=children,
+                                    output_folder=self.global_settings.output_folder,
+                                    reactions_output=self.global_settings.reactions_output,
+                                    initial_dataframe=initial_dataframe
+                                    )
         return result
+
+
+class SharedMechanismBuilder:
+    """
+        @brief Builds room evolvers, generating the InChemPy main class (parsing the mechanism and generating
+        the jacobian) once for all the rooms with the same mechanism arguments
+
+        The first room with some mechanism arguments generates its main class, each later room with the same
+        arguments (whatever its size) gets its own deep copy of it, which is far quicker than generating it again.
+        Every room still has its own evolver, with its own schedules of people, temperature, light and air change.
+        Rooms must all be built before any of them is run, as the copies are taken from the first room's main class.
+
+    """
+
+    def __init__(self):
+        self._main_classes: Dict[Hashable, Any] = {}
+
+    def __call__(self, room: RoomChemistry, global_settings: GlobalSettings) -> RoomInchemPyEvolver:
+        key = mechanism_key(RoomInchemPyEvolver.mechanism_arguments(room, global_settings))
+        if key in self._main_classes:
+            return RoomInchemPyEvolver(room, global_settings, main_class=copy.deepcopy(self._main_classes[key]))
+        evolver = RoomInchemPyEvolver(room, global_settings)
+        self._main_classes[key] = evolver.inchem
+        return evolver
@@ -0,0 +1,200 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import traceback
+from typing import List, Dict, Tuple, Any, Union, Callable
+import numpy as np
+import pandas as pd
+from multiprocess import Process, Pipe
+
+from .global_settings import GlobalSettings
+from .room_chemistry import RoomChemistry
+
+
+def _is_float_only(frame: pd.DataFrame) -> bool:
+    """
+    Whether every column of a result is float64, so its rows can be sent as a plain array of floats
+    """
+    return bool((frame.dtypes == np.float64).all())
+
+
+def _room_worker_main(connection, rooms: List[Tuple[int, RoomChemistry]], global_settings: GlobalSettings, build_evolver: Callable):
+    """
+    The loop run inside a resident worker process
+    Builds the room evolvers once, then evolves them each time a request arrives until told to stop
+
+    Requests are ("run", t0, t_interval, {room_index: initial_condition}, txt_file)
+    The initial condition is either a text file name, a DataFrame,
+    or a state vector (in the order of the columns of the room's previous result)
+    The reply is ("ok", {room_index: result}) or ("error", traceback)
+    The first result of each room is a whole DataFrame, after that it is a (times, values) pair of arrays
+    while its columns stay the same and all float. A result with any other column (such as integers) is
+    always sent as a DataFrame, so its dtypes are kept.
+    """
+    try:
+        evolvers = dict((i, build_evolver(room, global_settings)) for i, room in rooms)
+        columns: Dict[int, pd.Index] = {}
+        connection.send(("ok", None))
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+        return
+
+    while True:
+        request = connection.recv()
+        if request[0] == "stop":
+            break
+
+        _, t0, t_interval, initial_conditions, txt_file = request
+        try:
+            result = {}
+            for i, initial_condition in initial_conditions.items():
+                evolver = evolvers[i]
+                if (txt_file):
+                    df, _ = evolver.run(t0=t0, seconds_to_integrate=t_interval, initial_text_file=initial_condition)
+                else:
+                    if isinstance(initial_condition, pd.DataFrame):
+                        initial_dataframe = initial_condition
+                    else:
+                        # Rebuild the single row of initial conditions from the state vector
+                        initial_dataframe = pd.DataFrame(np.asarray(initial_condition, dtype=float)[np.newaxis, :],
+                                                         index=[t0], columns=columns[i])
+                    df, _ = evolver.run(t0=t0, seconds_to_integrate=t_interval, initial_dataframe=initial_dataframe)
+
+                if i in columns and df.columns.equals(columns[i]) and _is_float_only(df):
+                    result[i] = (df.index.to_numpy(dtype=float), df.to_numpy(dtype=float))
+                else:
+                    # Later results (and initial states) of the room are sent as arrays only while it is all float
+                    if _is_float_only(df):
+                        columns[i] = df.columns
+                    else:
+                        columns.pop(i, None)
+                    result[i] = df
+            connection.send(("ok", result))
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+
+    connection.close()
+
+
+class ResidentRoomWorkers:
+    """
+        @brief A set of worker processes which each build and keep the room evolvers of some of the rooms
+
+        The evolvers (including their InChemPy main class and jacobians) are built once inside the workers
+        and never leave them. Each interval only the initial state vector and the time window are sent to a
+        worker, and only the new results come back, so nothing large is serialized on every interval.
+        The states and results of a room whose columns are all float are sent as arrays, those of a room
+        with other columns are sent as DataFrames, which keeps their dtypes.
+        Rooms are shared between the workers in turn, so each room has one dedicated worker.
+
+    """
+
+    def __init__(self, rooms: List[RoomChemistry], global_settings: GlobalSettings, n_workers: int, build_evolver: Callable):
+        """
+        @param rooms: The rooms to evolve.
+        @param global_settings: Settings used to build every room evolver.
+        @param n_workers: Cap on the number of worker processes.
+        @param build_evolver: Builds the evolver of one room from the room and the global settings (called inside the workers).
+        """
+        self._n_rooms = len(rooms)
+        n_workers = max(1, min(n_workers, len(rooms)))
+
+        # Room i is kept by worker i % n_workers
+        self._worker_of_room = [i % n_workers for i in range(len(rooms))]
+        self._columns: Dict[int, pd.Index] = {}
+        self._connections = []
+        self._processes = []
+
+        for w in range(n_workers):
+            worker_rooms = [(i, r) for i, r in enumerate(rooms) if self._worker_of_room[i] == w]
+            parent_connection, child_connection = Pipe()
+            process = Process(target=_room_worker_main,
+                              args=(child_connection, worker_rooms, global_settings, build_evolver),
+                              daemon=True)
+            process.start()
+            self._connections.append(parent_connection)
+            self._processes.append(process)
+
+        # Wait until every worker has built its evolvers (they are built in parallel)
+        try:
+            for c in self._connections:
+                self._receive(c)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def evolve(self, t0: float, t_interval: float, initial_conditions: List[Union[str, pd.DataFrame]], txt_file: bool) -> List[pd.DataFrame]:
+        """
+        Evolve every room for one interval of time
+        The initial conditions are either text file names or DataFrames (whose last row is the state)
+        Returns the results of each room as a DataFrame
+        """
+        requests: List[Dict[int, Any]] = [{} for _ in self._connections]
+        for i, initial_condition in enumerate(initial_conditions):
+            if (txt_file or i not in self._columns):
+                requests[self._worker_of_room[i]][i] = initial_condition if txt_file else initial_condition.iloc[[-1], :]
+            else:
+                requests[self._worker_of_room[i]][i] = initial_condition.iloc[-1, :].to_numpy(dtype=float)
+
+        # Send all the requests before receiving any, so the workers evolve in parallel
+        for c, request in zip(self._connections, requests):
+            c.send(("run", t0, t_interval, request, txt_file))
+
+        result: List[pd.DataFrame] = [None]*self._n_rooms
+        for c in self._connections:
+            for i, r in self._receive(c).items():
+                if isinstance(r, pd.DataFrame):
+                    # The same choice as the worker makes, of whether the room is sent as arrays
+                    if _is_float_only(r):
+                        self._columns[i] = r.columns
+                    else:
+                        self._columns.pop(i, None)
+                    result[i] = r
+                else:
+                    times, values = r
+                    result[i] = pd.DataFrame(values, index=times, columns=self._columns[i])
+        return result
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        for c, p in zip(self._connections, self._processes):
+            if p.is_alive():
+                try:
+                    c.send(("stop",))
+                except (BrokenPipeError, OSError):
+                    pass
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+            c.close()
+        self._connections = []
+        self._processes = []
+
+    @staticmethod
+    def _receive(connection):
+        status, payload = connection.recv()
+        if status != "ok":
+            raise Exception(f"Resident room worker failed:\n{payload}")
+        return payload
@@ -15,20 +15,35 @@
 #
 # ############################################################################ #
 
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Union, Hashable
 import math
+import copy
+import hashlib
+from time import perf_counter
 
-from .aperture_flow_calculations import ApertureFlowCalculator
 from .room_chemistry import RoomChemistry
 from .aperture import Aperture, Side
-from .room_inchempy_evolver import RoomInchemPyEvolver
-from .aperture_calculations import ApertureCalculation
-from .transport_paths import paths_through_building
+from .room_inchempy_evolver import RoomInchemPyEvolver, SharedMechanismBuilder, mechanism_key
+from .aperture_calculations import ApertureCalculation, WindResponseTable, TransportPathIndex
+from .transport_paths import paths_through_building, warn_if_many_paths
+from .pressure_network import PressureNetwork, NetworkApertureCalculation
 from .global_settings import GlobalSettings
 from .wind_definition import WindDefinition
+from .result_sink import ResultSink, MemoryResultSink
+from .output_spec import OutputSpec, OutputSpecSink
+from .transport_engine import TransportEngine
+from .coupled_engine import CoupledBuildingSolver
+from .aperture_flow_calculations import ApertureFlowCalculator
+from .room_workers import ResidentRoomWorkers
+from .interval_scheduler import IntervalScheduler, FixedIntervalScheduler, AdaptiveIntervalScheduler, TransportProbe
+from .autotune import CostModel
+from .checkpoint import Checkpointer, write_file_atomically
+from .executors import Executor, make_executor
+from .mechanism_cache import file_digest
 import pandas as pd
 import numpy as np
-from multiprocess import Pool, cpu_count
+from multiprocess import cpu_count
+import dill
 
 
 def yellow_text(str):
@@ -39,14 +54,37 @@ class Simulation:
     """
         @brief A class which can evolve the state of species in a set of rooms and apertures
 
+        The chemistry in the rooms and the transport between them are solved separately (operator splitting).
+        Two schemes are available:
+        - "lie": each interval of chemistry is followed by the transport over the whole interval (first order)
+        - "strang": half an interval of transport, the chemistry, then the other half of the transport
+          (second order). The half steps at each interval boundary are merged into one transport step.
+        - "coupled": no splitting, the chemistry of every room and the transport between them are solved as one
+          ODE system (see CoupledBuildingSolver), which only restarts at the breakpoints. This needs room evolvers
+          which give their chemistry as a RoomODESystem (ode_system), which the InChemPy evolvers do not.
+
     """
 
+    splitting_schemes = ("lie", "strang", "coupled")
+
+    airflow_models = ("transport_paths", "pressure_network")
+
+    # Warn before finding the transport paths when more than this many are expected
+    path_count_warning = 1.0e5
+
+    # Increased when what save writes changes, so older saved simulations are rebuilt rather than loaded
+    artifact_version = 3
+
     def __init__(self,
                  global_settings: GlobalSettings,
                  rooms: List[RoomChemistry],
                  apertures: List[Aperture],
                  wind_definition: WindDefinition = None,
-                 cpu_count: int = cpu_count()):
+                 cpu_count: int = cpu_count(),
+                 resident_workers: bool = False,
+                 transport_method: str = "euler",
+                 splitting: str = "lie",
+                 executor: Union[str, Executor] = "process"):
         """
         @brief Initialize the Simulation with
         details about the building, rooms and apertures.
@@ -55,80 +93,533 @@ class Simulation:
         @param rooms: Information about the rooms.
         @param apertures: Information about the apertures.
         @param cpu_count: Cap on the number of processes to use when solving with multiprocess.
+        @param resident_workers: Build each room evolver once inside a dedicated worker process and keep it there,
+                                 so only state vectors are exchanged on each interval (the executor then only
+                                 builds the aperture calculations, and its pool is stopped before the workers start).
+        @param transport_method: How the transport is stepped, "euler" (explicit Euler step) or "expm"
+                                 (exact matrix exponential, which stays positive for long transport intervals).
+        @param splitting: How the chemistry and the transport are combined, "lie", "strang" or "coupled".
+        @param executor: What runs the rooms in parallel, one of executor_backends ("serial", "thread", "process"
+                         or "mpi"), or an Executor already started (which is then not closed by close()).
+                         Its pool is started when it is first used and kept until close(), so use the simulation
+                         in a with statement (or call close()) to stop its processes.
+        """
+        self._configure(global_settings, rooms, apertures, wind_definition, cpu_count, transport_method, splitting,
+                        executor)
+
+        try:
+            if not resident_workers:
+                # For each room, build a room_evolver (performed in parallel)
+                self._room_evolvers = self._build_room_evolvers()
+
+            self._aperture_calculators = self._build_aperture_calculators()
+            self._stacked_wind_responses = self._stack_wind_responses(self._aperture_calculators)
+
+            if resident_workers:
+                # The rooms are run by the workers, so the pool of the executor is not kept alongside them
+                if self._owns_executor:
+                    self._executor.close()
+                self._start_room_workers()
+        except BaseException:
+            self.close()
+            raise
+
+    def _configure(self, global_settings: GlobalSettings, rooms: List[RoomChemistry], apertures: List[Aperture],
+                   wind_definition: WindDefinition, cpu_count: int, transport_method: str, splitting: str,
+                   executor: Union[str, Executor]):
         """
+        Check and record the options of the simulation, before anything is built
+        """
+        if transport_method not in TransportEngine.methods:
+            raise ValueError(f"Unknown transport method {transport_method}, expected one of {TransportEngine.methods}")
+        if splitting not in self.splitting_schemes:
+            raise ValueError(f"Unknown splitting scheme {splitting}, expected one of {self.splitting_schemes}")
+        airflow_model = getattr(global_settings, "airflow_model", "transport_paths")
+        if airflow_model not in self.airflow_models:
+            raise ValueError(f"Unknown airflow model {airflow_model}, expected one of {self.airflow_models}")
 
         # Number of cores to use in multiprocessing
         self._cpu_count = cpu_count
 
+        # The executor (started by its first use) is kept for every run of the simulation
+        self._owns_executor = not isinstance(executor, Executor)
+        self._executor: Executor = make_executor(executor, cpu_count)
+
         self._global_settings = global_settings
         self._rooms = rooms
         self._apertures = apertures
         self._wind_definition = wind_definition
+        self._transport_method = transport_method
+        self._splitting = splitting
+        self._transport_engine: TransportEngine = None
+        self._scheduler: IntervalScheduler = None
 
-        with Pool(self._cpu_count) as pool:
+        # Either the room evolvers live in resident worker processes, or they are sent to a pool on each interval
+        self._room_workers: ResidentRoomWorkers = None
+        self._room_evolvers: List[RoomInchemPyEvolver] = []
 
-            # For each room, build a room_evolver (performed in parallel)
-            args = [(r, self._global_settings) for r in self._rooms]
-            self._room_evolvers: List[RoomInchemPyEvolver] = pool.starmap(self.build_room_evolver_starmap, args)
+    def _build_aperture_calculators(self) -> List[Tuple[Any, int, int, float, float]]:
+        """
+        For each aperture, build its calculation and the accompanying data to use it
+        """
+        airflow_model = getattr(self._global_settings, "airflow_model", "transport_paths")
+        if airflow_model == "pressure_network":
+            # One network for the whole building, shared by the calculations of its apertures (built here, as
+            # the network is quick to build and must not be copied for each aperture)
+            network = PressureNetwork(self._rooms,
+                                      self._apertures,
+                                      self._global_settings.building_direction_in_radians,
+                                      self._global_settings.air_density,
+                                      (self._global_settings.upwind_pressure_coefficient,
+                                       self._global_settings.downwind_pressure_coefficient))
+            return [(NetworkApertureCalculation(network, a),) + self._aperture_data(w, self._rooms)
+                    for a, w in enumerate(self._apertures)]
+
+        # Build an ApertureCalculation for each aperture (performed in parallel)
+        limits = dict(max_length=getattr(self._global_settings, "max_path_length", None),
+                      max_paths=getattr(self._global_settings, "max_transport_paths", None),
+                      k_shortest=getattr(self._global_settings, "k_shortest_paths", None))
+        warn_if_many_paths(self._rooms, self._apertures, threshold=self.path_count_warning, **limits)
+        transport_paths = paths_through_building(self._rooms, self._apertures, **limits)
+        path_index = TransportPathIndex(transport_paths, self._global_settings.building_direction_in_radians)
+        args = [(w, transport_paths, self._apertures, self._rooms, self._global_settings, path_index)
+                for w in self._apertures]
+        calculators = self._executor.starmap(self.build_aperture_calculator_starmap, args)
+
+        # Each calculation was given a copy of the index (which numbers the rooms the same), they share
+        # this one so the wind along the paths is found once for all of them
+        for calculator, _, _, _, _ in calculators:
+            calculator.path_index = path_index
+        return calculators
+
+    def _start_room_workers(self):
+        """
+        Start the resident worker processes, each builds the evolvers of its rooms (performed in parallel)
+        Within a worker, rooms with the same mechanism arguments share one generated main class
+        """
+        self._room_workers = ResidentRoomWorkers(self._rooms, self._global_settings,
+                                                 self._cpu_count, SharedMechanismBuilder())
 
-            # For each aperture, build an ApertureCalculation (performed in parallel)
-            transport_paths = paths_through_building(self._rooms, self._apertures)
-            args = [(w, transport_paths, self._apertures, self._rooms, self._global_settings) for w in self._apertures]
-            self._aperture_calculators: List[ApertureCalculation] = pool.starmap(
-                self.build_aperture_calculator_starmap, args)
+    @property
+    def dt(self) -> float:
+        """
+        @brief the time step of the results of the rooms (s).
+        """
+        return self._global_settings.dt
 
-    def run(self, init_conditions: dict, t0: float, t_total: float, t_interval: float):
+    @property
+    def rooms(self) -> List[RoomChemistry]:
         """
-        @brief run the simulation over a time interval.
+        @brief the rooms of the simulation, in order (the keys of the initial conditions and of the results).
+        """
+        return self._rooms
 
-        @param init_conditions: The starting state of the rooms, as a dictionary of text files.
-        @param t0: The time to start the simulation at.
-        @param t_total: Duration to simulate.
-        @param t_interval: How often to apply the effect of windows.
+    def save(self, path: str, fingerprint: str = None):
         """
+        @brief save the built simulation (the room evolvers, with their generated mechanisms, and the aperture
+        calculations, with their transport paths) to a file, from which load rebuilds it in another process
+        without building anything. Runs with other start times, lengths or initial conditions can then start at once.
 
-        t_final: float = t0+t_total
+        @param path: The file to save to.
+        @param fingerprint: Anything identifying the inputs the simulation was built from (see input_fingerprint),
+                            load can then refuse a file built from other inputs.
+        """
+        artifact = {"version": self.artifact_version,
+                    "fingerprint": fingerprint,
+                    "global_settings": self._global_settings,
+                    "rooms": self._rooms,
+                    "apertures": self._apertures,
+                    "wind_definition": self._wind_definition,
+                    "transport_method": self._transport_method,
+                    "splitting": self._splitting,
+                    "resident_workers": self._room_workers is not None,
+                    # Resident evolvers live in their workers, those are started again by load
+                    "room_evolvers": self._room_evolvers,
+                    "aperture_calculators": self._aperture_calculators}
+        # Saved with dill, as the evolvers are when they are sent to the pool
+        write_file_atomically(path, lambda file: dill.dump(artifact, file, protocol=dill.HIGHEST_PROTOCOL))
 
-        with Pool(self._cpu_count) as pool:
+    @staticmethod
+    def load(path: str, fingerprint: str = None, cpu_count: int = cpu_count(),
+             executor: Union[str, Executor] = "process") -> "Simulation":
+        """
+        @brief rebuild a simulation saved by save. Its rooms are new objects, use simulation.rooms to give
+        the initial conditions of a run.
 
-            # First step
-            # using the init_conditions, perform a solve on each room (performed in parallel)
-            room_results, solved_time = self._evolve_rooms(pool, t0, t_interval,
-                                                           [init_conditions[r] for r in self._rooms], True)
+        @param path: The file the simulation was saved to.
+        @param fingerprint: If given, the file must have been saved with the same fingerprint.
+        @param cpu_count: Cap on the number of processes to use when solving with multiprocess.
+        @param executor: What runs the rooms in parallel (see the constructor).
+        """
+        with open(path, "rb") as file:
+            artifact = dill.load(file)
+        if artifact.get("version") != Simulation.artifact_version:
+            raise Exception(f"The simulation in {path} was saved with version {artifact.get('version')}, "
+                            f"expected version {Simulation.artifact_version}")
+        if fingerprint is not None and artifact["fingerprint"] != fingerprint:
+            raise Exception(f"The simulation in {path} was built from other inputs")
+
+        simulation = Simulation.__new__(Simulation)
+        simulation._configure(artifact["global_settings"], artifact["rooms"], artifact["apertures"],
+                              artifact["wind_definition"], cpu_count, artifact["transport_method"], artifact["splitting"],
+                              executor)
+        # dill keeps the main classes shared as they were when saved
+        simulation._room_evolvers = simulation._unshare_evolvers(artifact["room_evolvers"])
+        simulation._aperture_calculators = artifact["aperture_calculators"]
+        simulation._stacked_wind_responses = simulation._stack_wind_responses(simulation._aperture_calculators)
+        if artifact["resident_workers"]:
+            simulation._start_room_workers()
+        return simulation
 
-            # Cumulate the results for this step and others into a cumulative results dictionary
-            cumulative_room_results: Dict[RoomChemistry, pd.DataFrame] = dict(
-                [(r, room_results[i].copy()) for i, r in enumerate(self._rooms)])
+    @staticmethod
+    def input_fingerprint(global_settings: GlobalSettings, files: List[str]) -> str:
+        """
+        @brief a hash of the global settings, the mechanism files and the given input files (such as the
+        building and room JSON files), which changes when any of them changes.
+        """
+        digest = hashlib.sha256(repr(sorted((k, repr(v)) for k, v in vars(global_settings).items())).encode())
+        for path in [global_settings.filename, global_settings.custom_filename, global_settings.constrained_file] + list(files):
+            digest.update(repr((path, file_digest(path))).encode())
+        return digest.hexdigest()
 
-            # Use the aperture results to adjust the room results into the input for the next iteration
-            initial_condition = self._apply_wind(pool, solved_time, t_interval, room_results)
+    def __enter__(self):
+        return self
 
-            # Loop of incrementing time by t_interval and performing the operations
-            # Stop when another increment would take it over the total
-            while (solved_time+t_interval <= t_final):
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
 
-                # Use the initial conditions and solve for the next time interval  (performed in parallel)
-                room_results, solved_time = self._evolve_rooms(pool, solved_time, t_interval, initial_condition)
-                # Add the new results to the cumulative result for all times
-                cumulative_room_results = dict(
-                    [(r, pd.concat([cumulative_room_results[r], room_results[i]], axis=0)) for i, r in enumerate(self._rooms)])
+    def close(self):
+        """
+        @brief stop any resident worker processes and the executor, the simulation can not be run after this.
+        """
+        if self._room_workers is not None:
+            self._room_workers.close()
+            self._room_workers = None
+        if self._owns_executor:
+            self._executor.close()
 
-                # Use the aperture results to adjust the room results into appropriate initial conditions for the next iteration
-                initial_condition = self._apply_wind(pool, solved_time, t_interval, room_results)
+    def use_executor(self, executor: Union[str, Executor], cpu_count: int = None):
+        """
+        @brief run the rooms with another executor from now on (see the constructor), such as one chosen by autotune.
 
-            # Final step  if there is any time smaller than a single interval left to be solved
-            if solved_time < t_final:
+        @param executor: A backend name or an Executor already started.
+        @param cpu_count: Cap on the number of processes of the new executor (by default the same as before).
+        """
+        if self._owns_executor:
+            self._executor.close()
+        if cpu_count is not None:
+            self._cpu_count = cpu_count
+        self._owns_executor = not isinstance(executor, Executor)
+        self._executor = make_executor(executor, self._cpu_count)
+        self._room_evolvers = self._unshare_evolvers(self._room_evolvers)
+
+    def calibrate(self, init_conditions: dict, t0: float, t_interval: float,
+                  concentration_floor: float = 1.0e3) -> CostModel:
+        """
+        @brief time the parts of a short run (see CostModel), from which autotune projects the wall time of a run.
+        Each room is run for an interval of t_interval then one of 2*t_interval (in this process, on copies of
+        the evolvers), which separates the cost of an interval from the cost of each simulated second,
+        and one transport step is applied.
 
-                final_t_interval = t_final-solved_time
+        @param init_conditions: The starting state of the rooms, as a dictionary of text files.
+        @param t0: The time to start the calibration at.
+        @param t_interval: The length of the first calibration interval.
+        @param concentration_floor: Concentrations below this are ignored when judging how fast the transport
+                                    changes the building (as AdaptiveIntervalScheduler).
+        """
+        if self._room_workers is not None:
+            raise Exception("A simulation with resident workers can not be calibrated")
+
+        room_fixed, room_per_second, send_seconds, result_seconds_per_row, room_results = [], [], [], [], []
+        for evolver, room in zip(self._room_evolvers, self._rooms):
+            # Copying the evolver is what sending it to a worker process costs
+            start = perf_counter()
+            evolver = dill.loads(dill.dumps(evolver))
+            send_seconds.append(perf_counter()-start)
+
+            start = perf_counter()
+            first = self.run_room_evolver_starmap(evolver, t0, t_interval, init_conditions[room], True)
+            first_seconds = perf_counter()-start
+
+            start = perf_counter()
+            second = self.run_room_evolver_starmap(evolver, t0+t_interval, 2*t_interval, first.iloc[[-1]], False)
+            second_seconds = perf_counter()-start
+
+            # As _evolve_rooms, each run must reach the end of its interval
+            for result, t_end in ((first, t0+t_interval), (second, t0+3*t_interval)):
+                if result.index[-1] != t_end:
+                    raise Exception(f"Calibration incomplete, only ran to time {result.index[-1]}, expected {t_end} "
+                                    f"(the calibration interval should be a multiple of dt)")
+
+            # first takes fixed + per_second*t_interval, second fixed + per_second*2*t_interval
+            room_per_second.append((second_seconds-first_seconds)/t_interval)
+            room_fixed.append(2*first_seconds-second_seconds)
+
+            start = perf_counter()
+            dill.loads(dill.dumps(second))
+            result_seconds_per_row.append((perf_counter()-start)/len(second))
+            room_results.append(second)
+
+        solved_time = t0+3*t_interval
+        start = perf_counter()
+        self._apply_wind(solved_time, t_interval, room_results)
+        transport_seconds = perf_counter()-start
+
+        probe = TransportProbe(self.trans_matrix, [r.volume_in_m3 for r in self._rooms])
+        probe.set_state(self._state_source(room_results))
+        transport_rate = probe.relative_transport_rate(solved_time, concentration_floor)
+
+        return CostModel(room_fixed, room_per_second, send_seconds, result_seconds_per_row, transport_seconds,
+                         self._global_settings.dt, transport_rate)
+
+    def run(self, init_conditions: dict, t0: float, t_total: float, t_interval: Union[float, IntervalScheduler],
+            align_to_breakpoints: bool = True, checkpoint: Checkpointer = None, sink: ResultSink = None,
+            output: OutputSpec = None):
+        """
+        @brief run the simulation over a time interval.
 
-                room_results, solved_time = self._evolve_rooms(pool, solved_time, final_t_interval, initial_condition)
+        @param init_conditions: The starting state of the rooms, as a dictionary of text files.
+        @param t0: The time to start the simulation at.
+        @param t_total: Duration to simulate.
+        @param t_interval: How often to apply the effect of windows, either a fixed interval
+                           or an IntervalScheduler which chooses the length of each interval
+                           (the coupled scheme has no intervals, so does not use it). An AdaptiveIntervalScheduler
+                           without a granularity is given the time step, so its intervals are whole numbers of steps.
+        @param align_to_breakpoints: End intervals at the times when a step value of a room (see
+                                     RoomChemistry.schedule_times) or the wind changes, so each change applies
+                                     from the start of an interval.
+        @param checkpoint: Write checkpoints of the run at interval boundaries, which resume can restart from.
+        @param sink: Where to put the results of each interval as they are computed, by default they are kept
+                     in memory and returned as DataFrames. A sink which writes to disk (such as NpyResultSink)
+                     keeps the memory flat, and the results returned are readers of what it wrote.
+        @param output: Which columns and times of the results to store (by default all of them), the full state
+                       of the rooms is still carried from one interval to the next.
+        """
+        t_final: float = t0+t_total
 
-                # Add the new results to the cumulative result for all times
-                cumulative_room_results = dict(
-                    [(r, pd.concat([cumulative_room_results[r], room_results[i]], axis=0)) for i, r in enumerate(self._rooms)])
+        # A fixed interval is scheduled in the same way as any other
+        scheduler = t_interval if isinstance(t_interval, IntervalScheduler) else FixedIntervalScheduler(t_interval)
+        if isinstance(scheduler, AdaptiveIntervalScheduler) and not scheduler.granularity:
+            # The solver only gives results every dt, so an interval ending between two steps could not be run
+            scheduler.granularity = self._global_settings.dt
+        scheduler.reset(t0, t_final, self.breakpoints() if align_to_breakpoints else ())
+        self._scheduler = scheduler
+        probe = TransportProbe(self.trans_matrix, [r.volume_in_m3 for r in self._rooms])
+
+        # By default preallocate space for the results of every interval, the rows are only turned into DataFrames at the end
+        if sink is None:
+            capacity = self._estimated_result_rows(scheduler, t0, t_final)
+            if output is not None and output.output_interval is not None:
+                # Grow as needed rather than preallocate for every row of the solver
+                capacity = 0
+            sink = MemoryResultSink(len(self._rooms), capacity)
+        if output is not None:
+            output.check_time_step(self._global_settings.dt)
+            sink = OutputSpecSink(sink, output)
+
+        if self._splitting == "coupled":
+            if checkpoint is not None:
+                raise Exception("A coupled run has no intervals, so can not write checkpoints")
+            sink.append(self._run_coupled(init_conditions, t0, t_total, scheduler.breakpoints))
+            sink.close()
+            return dict(zip(self._rooms, sink.results()))
+
+        if checkpoint is not None:
+            checkpoint.start()
+
+        initial_condition = [init_conditions[r] for r in self._rooms]
+        txt_file = True
+
+        if self._splitting == "strang":
+            # The initial state of each room as InChemPy reads it from its text file (an interval of no time),
+            # with all the columns of the results, including the outdoor concentrations the transport needs
+            room_states, _ = self._evolve_rooms(t0, 0, initial_condition, True)
+            probe.set_state(self._state_source(room_states))
+            txt_file = False
+
+        length = scheduler.next_interval(t0, probe)
+
+        if self._splitting == "strang":
+            # Apply the first half interval of transport to the initial state
+            initial_condition = self._apply_wind(t0, length/2, room_states)
+
+        # The results start from the initial state (as with Lie splitting), not the state after the first half
+        # interval of transport
+        initial_rows = room_states if self._splitting == "strang" else None
+        self._run_intervals(scheduler, probe, sink, t0, length, initial_condition, txt_file, checkpoint, initial_rows)
+
+        sink.close()
+        cumulative_room_results: Dict[RoomChemistry, pd.DataFrame] = dict(zip(self._rooms, sink.results()))
 
         return cumulative_room_results
 
+    def resume(self, checkpoint: Checkpointer):
+        """
+        @brief carry on a run from its latest checkpoint, the results already written are read back, not recomputed.
+        The simulation must be built with the same rooms, apertures and options as the run which wrote the checkpoint.
+        The results go to the same kind of sink as the run (a sink writing to disk carries on in the same folder).
+
+        @param checkpoint: The checkpoints of the run, which carries on writing checkpoints to the same folder.
+        """
+        state = checkpoint.load()
+        if state["n_rooms"] != len(self._rooms):
+            raise Exception(f"The checkpoint has {state['n_rooms']} rooms, the simulation has {len(self._rooms)}")
+        if state["splitting"] != self._splitting or state["transport_method"] != self._transport_method:
+            raise Exception(f"The checkpoint was written with {state['splitting']} splitting and {state['transport_method']} "
+                            f"transport, the simulation uses {self._splitting} and {self._transport_method}")
+
+        scheduler: IntervalScheduler = state["scheduler"]
+        self._scheduler = scheduler
+        probe = TransportProbe(self.trans_matrix, [r.volume_in_m3 for r in self._rooms])
+        sink: ResultSink = state["sink"]
+        initial_condition = Checkpointer.initial_condition(state["room_states"], state["columns"], state["start"])
+
+        self._run_intervals(scheduler, probe, sink, state["start"], state["length"], initial_condition,
+                            False, checkpoint)
+
+        sink.close()
+        return dict(zip(self._rooms, sink.results()))
+
+    def _run_intervals(self, scheduler: IntervalScheduler, probe: TransportProbe, sink: ResultSink,
+                       start: float, length: float, initial_condition, txt_file: bool, checkpoint: Checkpointer,
+                       initial_rows: List[pd.DataFrame] = None):
+        """
+        Evolve the rooms one interval after another from start, until the scheduler has no more intervals
+        Between intervals the transport is applied, and a checkpoint written when one is due
+        The initial rows (if given) are stored in place of the first row of the first interval
+        """
+        while length is not None:
+
+            # Use the initial conditions and solve for this interval (performed in parallel)
+            room_results, solved_time = self._evolve_rooms(start, length, initial_condition, txt_file)
+            txt_file = False
+
+            if initial_rows is not None:
+                room_results = [r.copy() for r in room_results]
+                for r, initial_row in zip(room_results, initial_rows):
+                    r.iloc[0, :] = initial_row.iloc[-1, :].reindex(r.columns)
+                initial_rows = None
+
+            # Add the new results to the cumulative result for all times
+            sink.append(room_results)
+
+            # Choose the next interval from the state at the end of this one
+            probe.set_state(self._state_source(room_results))
+            next_length = scheduler.next_interval(solved_time, probe)
+
+            if next_length is not None:
+                # Use the flux matrix to adjust the room results into the input for the next interval
+                # With Strang splitting this is the second half of this interval and the first half of the next
+                transport_time = (length+next_length)/2 if self._splitting == "strang" else length
+                initial_condition = self._apply_wind(solved_time, transport_time, room_results)
+
+                if checkpoint is not None and checkpoint.interval_done():
+                    checkpoint.write({"n_rooms": len(self._rooms),
+                                      "splitting": self._splitting,
+                                      "transport_method": self._transport_method,
+                                      "start": solved_time,
+                                      "length": next_length,
+                                      "room_states": Checkpointer.room_states(initial_condition),
+                                      "columns": room_results[0].columns,
+                                      "scheduler": scheduler}, sink)
+
+            elif self._splitting == "strang":
+                # The final half interval of transport gives the state at the end of the simulation
+                final_state = self._apply_wind(solved_time, length/2, room_results)
+                sink.replace_last_row(final_state)
+
+            start, length = solved_time, next_length
+
+    def _run_coupled(self, init_conditions: dict, t0: float, t_total: float,
+                     breakpoints: List[float]) -> List[pd.DataFrame]:
+        """
+        Solve the chemistry and the transport of the whole building as one ODE system (see CoupledBuildingSolver),
+        restarting only at the breakpoints. Returns the results of each room every time step.
+        """
+        if self._room_workers is not None:
+            raise Exception("The coupled scheme needs the room evolvers in this process, not in resident workers")
+        for i, evolver in enumerate(self._room_evolvers):
+            if not hasattr(evolver, "ode_system"):
+                raise Exception(f"The evolver of room {i} does not give its chemistry as an ODE system "
+                                f"(InChemPy does not expose its right hand side), use lie or strang splitting")
+        room_systems = [evolver.ode_system() for evolver in self._room_evolvers]
+
+        transported, _ = ApertureFlowCalculator.get_trans_vars(pd.Index(room_systems[0].species))
+        solver = CoupledBuildingSolver(room_systems, [r.volume_in_m3 for r in self._rooms], transported,
+                                       self.trans_matrix)
+
+        # The initial state of each room as its evolver reads it from its text file (an interval of no time)
+        initial, _ = self._evolve_rooms(t0, 0, [init_conditions[r] for r in self._rooms], True)
+        initial_states = [i.reindex(columns=solver.species, fill_value=0.0).iloc[-1, :].to_numpy(dtype=float)
+                          for i in initial]
+
+        # The results every time step, as the split schemes give them
+        dt = self._global_settings.dt
+        output_times = np.append(t0 + dt*np.arange(math.floor(t_total/dt + 1.0e-9)+1), t0+t_total)
+        times, states = solver.solve(t0, t_total, initial_states, np.unique(output_times), breakpoints)
+        return solver.to_dataframes(times, states)
+
+    def breakpoints(self) -> List[float]:
+        """
+        @brief every time at which a step value of a room (read at the start of each interval), or the wind,
+        changes (in order).
+        """
+        times = set()
+        for r in self._rooms:
+            times.update(r.schedule_times())
+        if self._wind_definition is not None:
+            times.update(self._wind_definition.times())
+        return sorted(times)
+
+    def step_report(self) -> pd.DataFrame:
+        """
+        @brief the intervals of the last run, with their start, length and what limited their length.
+        """
+        if self._scheduler is None:
+            raise Exception("The simulation has not been run")
+        return self._scheduler.step_report()
+
+    @staticmethod
+    def interval_schedule(t0: float, t_total: float, t_interval: float) -> List[Tuple[float, float]]:
+        """
+        The (start time, length) of each interval of chemistry in a run with a fixed interval
+        Intervals of t_interval are taken while they fit in the total time, then any time left is one shorter interval
+        """
+        return FixedIntervalScheduler(t_interval).planned_intervals(t0, t0+t_total)
+
+    def _estimated_result_rows(self, scheduler: IntervalScheduler, t0: float, t_final: float) -> int:
+        """
+        Estimate how many rows of results a run will produce,
+        each interval gives one row per time step of the solver plus its starting row
+        """
+        dt = self._global_settings.dt
+        planned = scheduler.planned_intervals(t0, t_final, scheduler.breakpoints)
+        if planned is not None:
+            return sum(math.ceil(length/dt)+1 for _, length in planned)
+        return math.ceil((t_final-t0)/dt) + scheduler.estimated_interval_count(t0, t_final)
+
+    def _state_source(self, room_results: List[pd.DataFrame]):
+        """
+        How to gather the building state at the end of the room results, for an interval scheduler
+        """
+        def building_state():
+            engine = self._engine_for(room_results)
+            return engine.building_state(np.stack([r.iloc[-1, :].to_numpy(dtype=float) for r in room_results]))
+        return building_state
+
+    def _engine_for(self, room_results: List[pd.DataFrame]) -> TransportEngine:
+        """
+        The transport engine for the columns of these results (which are the same for every room),
+        rebuilt when the columns change (such as a later run with another mechanism or output)
+        """
+        columns = room_results[0].columns
+        engine = self._transport_engine
+        if engine is None or not (columns is engine.columns or columns.equals(engine.columns)):
+            self._transport_engine = TransportEngine(columns,
+                                                     [r.volume_in_m3 for r in self._rooms],
+                                                     self._transport_method)
+        return self._transport_engine
+
     def wind_state(self, time):
         """
         Determine the wind speed and direction (in radians)
@@ -142,31 +633,37 @@ class Simulation:
                 wind_direction)
             return wind_speed, wind_direction_in_radians
 
-    def _apply_wind(self, pool, time, t_interval, room_results):
+    def _apply_wind(self, time, t_interval, room_results):
         """
         Applies the effect of the wind, to alter the state of the rooms
-        Uses the pool to calculate the impact of each aperture on the room concentrations
-        Applies these changes to the concentrations
+        Builds the flux matrix of all the apertures, and applies it to the state of the whole building at once
         Return the new room concentrations
         """
-        # Determine the properties of the wind at this time
+        engine = self._engine_for(room_results)
+
+        # The transport only depends on the wind and the interval, so the engine reuses it for the same wind state
         wind_speed, wind_direction_in_radians = self.wind_state(time)
-        # For each aperture  calculate a aperture result  (performed in parallel)
-        args = [(w, wind_speed, wind_direction_in_radians, t_interval, room_results, time)
-                for w in self._aperture_calculators]
-        aperture_results = pool.starmap(self.run_aperture_calculation_starmap, args)
-        # Use the aperture results to adjust the room results into the input for the next iteration
-        return self.apply_aperture_results(room_results, aperture_results, time)
+        cache_key = (wind_speed, wind_direction_in_radians, t_interval)
 
-    def _evolve_rooms(self, pool, t0, t_interval, initial_condition, txt_file=False):
+        # The fluxes through every aperture from the wind at this time (unless the engine already has them)
+        flux_matrix = None if engine.is_cached(cache_key) else self.trans_matrix(time)
+
+        # Use the flux matrix to adjust the room results into the input for the next iteration
+        return self.apply_transport(engine, room_results, flux_matrix, t_interval, time, cache_key)
+
+    def _evolve_rooms(self, t0, t_interval, initial_condition, txt_file=False):
         """
         Evolves each of the rooms independently for one interval of time
-        Uses the pool to calculate the new concentration in each room
+        Uses the executor to calculate the new concentration in each room
         Return the new room concentrations, and the time at which these are true
         """
         # Use the initial conditions (text or dataframe) to produce new room results using the room evolvers
-        args = [(self._room_evolvers[i], t0, t_interval, initial_condition[i], txt_file) for i in range(len(self._rooms))]
-        room_results = pool.starmap(self.run_room_evolver_starmap, args)
+        if self._room_workers is not None:
+            # The evolvers are resident in the workers, only the initial states are sent
+            room_results = self._room_workers.evolve(t0, t_interval, initial_condition, txt_file)
+        else:
+            args = [(self._room_evolvers[i], t0, t_interval, initial_condition[i], txt_file) for i in range(len(self._rooms))]
+            room_results = self._executor.starmap(self.run_room_evolver_starmap, args)
         # Check that each room resulted in a result at the final time
         # If a room failed to complete, then raise the exception
         success = True
@@ -179,59 +676,111 @@ class Simulation:
         # This results in a new time which we have solved to
         return room_results, t0+t_interval
 
+    def wind_states(self, times) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Determine the wind speeds and directions (in radians) at many times at once
+        """
+        times = np.asarray(times, dtype=float)
+        if self._wind_definition is None:
+            return np.zeros(times.shape), np.zeros(times.shape)
+        wind_speeds = self._wind_definition.wind_speed.values_at_times(times)
+        wind_directions = self._wind_definition.wind_direction.values_at_times(times)
+        return wind_speeds, wind_directions if self._wind_definition.in_radians else np.radians(wind_directions)
+
     def trans_matrix(self, time: float):
         """
         @brief calculate the whole trans matrix at a given time.
 
         @param time: The time to calculate at.
         """
-        # Determine the properties of the wind at this time
-        wind_speed, wind_direction_in_radians = self.wind_state(time)
-        size = len(self._rooms)+1
+        return self.trans_matrix_series([time])[0]
+
+    def trans_matrix_series(self, times) -> np.ndarray:
+        """
+        @brief calculate the whole trans matrix at many times at once, for example at the start of each
+        transport interval of a run (the matrices only depend on the wind, not on the concentrations).
+
+        @param times: The times to calculate at.
+        @return An array of shape (len(times), rooms+1, rooms+1), one trans matrix for each time.
+        """
+        return self.trans_matrices(*self.wind_states(times))
 
-        # Make a result numpy matrix
-        result = np.zeros((size, size))
+    def trans_matrices(self, wind_speeds, wind_directions_in_radians) -> np.ndarray:
+        """
+        @brief calculate the whole trans matrix for each of a series of winds, in one pass over all the apertures.
+
+        @param wind_speeds: The wind speeds.
+        @param wind_directions_in_radians: The wind directions (in radians).
+        @return An array of shape (len(wind_speeds), rooms+1, rooms+1).
+        """
+        wind_speeds = np.asarray(wind_speeds, dtype=float)
+        wind_directions_in_radians = np.asarray(wind_directions_in_radians, dtype=float)
+        size = len(self._rooms)+1
 
-        # For each aperture calculate the flux and add it to the resultant matrix
-        for c in self._aperture_calculators:
-            aperture_calculator, origin_index, destination_index, _, _ = c
-            is_outdoor_aperture = destination_index is None
-            i = origin_index+1
-            j = 0 if is_outdoor_aperture else destination_index+1
-            f = aperture_calculator.trans_matrix_contributions(wind_speed, wind_direction_in_radians)
-            result[i, j] += f.from_1_to_2
-            result[j, i] += f.from_2_to_1
+        # The row and column of the fluxes of each aperture, the outside is row and column 0
+        i = np.array([origin_index+1 for _, origin_index, _, _, _ in self._aperture_calculators], dtype=int)
+        j = np.array([0 if destination_index is None else destination_index+1
+                      for _, _, destination_index, _, _ in self._aperture_calculators], dtype=int)
 
+        table = self._wind_response_table()
+        if table is not None:
+            from_1_to_2, from_2_to_1 = table.fluxes(wind_speeds, wind_directions_in_radians)
+        else:
+            # Calculations without a wind response (a pressure network) are found one wind at a time
+            fluxes = [[c.lookup_trans_matrix_contributions(wind_speed, wind_direction) for c, _, _, _, _ in self._aperture_calculators]
+                      for wind_speed, wind_direction in zip(wind_speeds, wind_directions_in_radians)]
+            from_1_to_2 = np.array([[f.from_1_to_2 for f in row] for row in fluxes]).reshape(len(wind_speeds), len(i))
+            from_2_to_1 = np.array([[f.from_2_to_1 for f in row] for row in fluxes]).reshape(len(wind_speeds), len(i))
+
+        # Add the fluxes of each aperture (several apertures may join the same rooms)
+        result = np.zeros((len(wind_speeds), size, size))
+        np.add.at(result, (slice(None), i, j), from_1_to_2)
+        np.add.at(result, (slice(None), j, i), from_2_to_1)
         return result
 
+    def _wind_response_table(self) -> WindResponseTable:
+        """
+        The wind responses of all the apertures stacked together, None if the apertures are not ApertureCalculations
+        """
+        return self._stacked_wind_responses
+
+    @staticmethod
+    def _stack_wind_responses(aperture_calculators) -> WindResponseTable:
+        """
+        Stack the wind responses of the aperture calculations (built with them, so the table always matches them),
+        None if the apertures are not ApertureCalculations
+        """
+        calculations = [c for c, _, _, _, _ in aperture_calculators]
+        if not all(isinstance(c, ApertureCalculation) for c in calculations):
+            return None
+        return WindResponseTable(calculations)
+
     @staticmethod
-    def apply_aperture_results(room_results, aperture_results, solved_time):
+    def apply_transport(transport_engine: TransportEngine, room_results, flux_matrix, delta_time, solved_time, cache_key=None):
         """
-        Applies the effect of the aperture results, to alter the state of the rooms
+        Applies the effect of the fluxes through the apertures, to alter the state of the rooms
         Return the new room concentrations at the final time
         """
-        # Make a new result from the current result at the solved time
-        result = [result.loc[[solved_time], :].astype(float) for result in room_results]
-        # Go through all the aperture results
-        for room_1_concentration_change, room_2_concentration_change, origin_index, destination_index in aperture_results:
-            # Adjust the concentrations of room_1 int the new results
-            new_room_1_value = result[origin_index].loc[solved_time, :].add(
-                room_1_concentration_change, fill_value=0.0)
-            result[origin_index].loc[solved_time, :] = new_room_1_value
-            # If there is a room 2, adjust the concentrations of room_2 int the new results
-            if (destination_index is not None):
-                new_room_2_value = result[destination_index].loc[solved_time, :].add(
-                    room_2_concentration_change, fill_value=0.0)
-                result[destination_index].loc[solved_time, :] = new_room_2_value
-
-        # TODO: Do something here about the risk of negative concentrations
-        # for example: `result = [r.clip(lower=0).fillna(0) for r in result]`
-
-        # If a room concentration fell below 0, print a warning
-        for i, r in enumerate(result):
-            solved_time_result = r.loc[solved_time, :]
-            negative_solved_time_result = solved_time_result[solved_time_result < 0]
-            negative_species = negative_solved_time_result.index.tolist()
+        # The engine works on the rows of every room side by side, so they must have its columns in its order
+        columns = transport_engine.columns
+        for i, r in enumerate(room_results):
+            if not (r.columns is columns or r.columns.equals(columns)):
+                raise Exception(f"The results of room {i} do not have the same columns as those of the other rooms")
+
+        # The state of every room at the solved time
+        concentrations = np.stack([r.loc[solved_time, :].to_numpy(dtype=float) for r in room_results])
+
+        # Apply the transport to the whole building in one step
+        new_concentrations = transport_engine.apply(concentrations, flux_matrix, delta_time, cache_key)
+
+        # Make a new result for each room at the solved time
+        result = [pd.DataFrame(new_concentrations[[i], :], index=[solved_time], columns=columns)
+                  for i in range(len(room_results))]
+
+        # Negative concentrations are kept rather than clipped (which would not conserve the transported mass),
+        # the "expm" transport method never gives them. If a room concentration fell below 0, print a warning
+        for i, negative in enumerate(new_concentrations < 0):
+            negative_species = columns[negative].tolist()
             if negative_species:
                 species_str = ", ".join(negative_species)
                 print(
@@ -241,6 +790,40 @@ class Simulation:
         # return the augmented results
         return result
 
+    def _build_room_evolvers(self) -> List[RoomInchemPyEvolver]:
+        """
+        Build the room evolvers, generating the InChemPy main class only once for each set of mechanism arguments
+        (performed in parallel), the other rooms with the same arguments share it
+        """
+        keys = [mechanism_key(RoomInchemPyEvolver.mechanism_arguments(r, self._global_settings)) for r in self._rooms]
+        first_room_of_key: Dict[Hashable, int] = {}
+        for i, key in enumerate(keys):
+            first_room_of_key.setdefault(key, i)
+
+        generated = list(first_room_of_key.values())
+        args = [(self._rooms[i], self._global_settings) for i in generated]
+        evolvers = dict(zip(generated, self._executor.starmap(self.build_room_evolver_starmap, args)))
+
+        # The evolvers are sent to a pool of processes (so copied) on each interval, so they can share the same main class
+        room_evolvers = [evolvers[i] if i in evolvers else
+                         RoomInchemPyEvolver(room, self._global_settings,
+                                             main_class=evolvers[first_room_of_key[keys[i]]].inchem)
+                         for i, room in enumerate(self._rooms)]
+        return self._unshare_evolvers(room_evolvers)
+
+    def _unshare_evolvers(self, room_evolvers: List[RoomInchemPyEvolver]) -> List[RoomInchemPyEvolver]:
+        """
+        An executor which runs the evolvers in this process (rather than on copies) needs a main class for each
+        room, so each evolver sharing its main class with an earlier one is given a copy of it
+        """
+        if self._executor.shares_memory:
+            seen = set()
+            for evolver in room_evolvers:
+                if id(evolver.inchem) in seen:
+                    evolver.inchem = copy.deepcopy(evolver.inchem)
+                seen.add(id(evolver.inchem))
+        return room_evolvers
+
     @staticmethod
     def build_room_evolver_starmap(room, global_settings):
         """
@@ -261,67 +844,27 @@ class Simulation:
         return df
 
     @staticmethod
-    def build_aperture_calculator_starmap(aperture, transport_paths, apertures, rooms, global_settings):
+    def build_aperture_calculator_starmap(aperture, transport_paths, apertures, rooms, global_settings, path_index=None):
         """
         Create one ApertureCalculation and the accompanying data to use it
         """
-        origin_index = rooms.index(aperture.origin)
-        destination_index = None if type(aperture.destination) == Side else rooms.index(aperture.destination)
-        origin_volume = aperture.origin.volume_in_m3
-        destination_volume = None if type(aperture.destination) == Side else aperture.destination.volume_in_m3
         calculator = ApertureCalculation(aperture,
                                          transport_paths,
                                          apertures,
                                          global_settings.building_direction_in_radians,
                                          global_settings.air_density,
                                          (global_settings.upwind_pressure_coefficient,
-                                          global_settings.downwind_pressure_coefficient))
-        return calculator, origin_index, destination_index, origin_volume, destination_volume
+                                          global_settings.downwind_pressure_coefficient),
+                                         path_index)
+        return (calculator,) + Simulation._aperture_data(aperture, rooms)
 
     @staticmethod
-    def run_aperture_calculation_starmap(aperture_calculator_data,
-                                         wind_speed, wind_direction,
-                                         delta_time,
-                                         room_results,
-                                         solved_time):
-        """
-        Use the aperture calculation to:
-        - calculate a flux based on the current wind
-        - use an ApertureFlowCalculator to calculate the concentration changes
-        - return the concentration changes, and the room indices they need to be applied to
-
-        This does not apply the concentration changes, the changes can't be done in parallel
-        """
-        aperture_calculator, origin_index, destination_index, origin_volume, destination_volume = aperture_calculator_data
-
-        # Calculate the flux relating to this aperture
-        flux = aperture_calculator.trans_matrix_contributions(wind_speed, wind_direction)
-
-        # build a flow calculator
-        calculator = ApertureFlowCalculator(room_results[origin_index].columns)
-
-        # switch depending on whether the aperture goes outside
-        is_outdoor_aperture = (destination_index is None)
-        if (is_outdoor_aperture):
-            # For an outside aperture, only one concentration is used as an input
-            origin_concentration = room_results[origin_index].loc[solved_time, :]
-            origin_concentration_change = calculator.outdoor_concentration_changes(
-                flux,
-                delta_time,
-                origin_concentration,
-                origin_volume)
-            # For an outside aperture, only one concentration change is calculated
-            return origin_concentration_change, None, origin_index, None
-        else:
-            # For an indoor aperture, one concentration per room is used as an input
-            origin_concentration = room_results[origin_index].loc[solved_time, :]
-            destination_concentration = room_results[destination_index].loc[solved_time, :]
-            origin_concentration_change, destination_concentration_change = calculator.concentration_changes(
-                flux,
-                delta_time,
-                origin_concentration,
-                destination_concentration,
-                origin_volume,
-                destination_volume)
-            # For an indoor aperture, one concentration change per room is calculated
-            return origin_concentration_change, destination_concentration_change, origin_index, destination_index
+    def _aperture_data(aperture: Aperture, rooms: List[RoomChemistry]) -> Tuple[int, int, float, float]:
+        """
+        The positions and volumes of the rooms each side of an aperture
+        """
+        origin_index = rooms.index(aperture.origin)
+        destination_index = None if type(aperture.destination) == Side else rooms.index(aperture.destination)
+        origin_volume = aperture.origin.volume_in_m3
+        destination_volume = None if type(aperture.destination) == Side else aperture.destination.volume_in_m3
+        return origin_index, destination_index, origin_volume, destination_volume
@@ -0,0 +1,179 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import json
+from typing import Dict, List, Sequence, Union
+import numpy as np
+import pandas as pd
+
+from .result_accumulator import typed_dataframe
+from .result_sink import ChunkedResultStore, write_json_atomically, write_npy_atomically
+
+
+class SimulationResult:
+    """
+        @brief The results of a simulation stored in a folder, and read lazily
+
+        The folder holds:
+        - values.npy: a rooms x times x species array of floats, stored so that each species is contiguous
+          (Fortran order), so reading a few species reads only those parts of the file
+        - times.npy: the times of the results, shared by every room
+        - index.json: the names of the rooms and species, the types of the species and the name of the time index
+        Opening a result only reads the indexes and memory maps the values, whatever the size of the results.
+        index.json is written last, so a folder with one holds complete results.
+
+    """
+
+    values_file = "values.npy"
+    times_file = "times.npy"
+    index_file = "index.json"
+
+    def __init__(self, folder: str):
+        """
+        @param folder: The folder the results were written to (by write or write_from_store).
+        """
+        self.folder = folder
+        with open(os.path.join(folder, self.index_file)) as file:
+            index = json.load(file)
+        self.rooms = pd.Index(index["rooms"])
+        self.species = pd.Index(index["species"])
+        self.dtypes = [np.dtype(d) for d in index["dtypes"]]
+        self.index_name = index["index_name"]
+        self.times = np.load(os.path.join(folder, self.times_file))
+        self._values = np.load(os.path.join(folder, self.values_file), mmap_mode="r")
+
+        if self._values.shape != (len(self.rooms), len(self.times), len(self.species)):
+            raise Exception(f"The values in {folder} have shape {self._values.shape}, "
+                            f"expected {(len(self.rooms), len(self.times), len(self.species))}")
+
+    @property
+    def shape(self):
+        return self._values.shape
+
+    @staticmethod
+    def write(folder: str, results: Dict[str, pd.DataFrame]) -> "SimulationResult":
+        """
+        Write the results of each room (all with the same times and columns) to a folder, keyed by the name of the room
+        """
+        names = list(results.keys())
+        first = results[names[0]]
+        for name in names:
+            if not results[name].columns.equals(first.columns):
+                raise Exception(f"The columns of room {name} do not match the columns of room {names[0]}")
+            if not np.array_equal(results[name].index.to_numpy(dtype=float), first.index.to_numpy(dtype=float)):
+                raise Exception(f"The times of room {name} do not match the times of room {names[0]}")
+
+        values = SimulationResult._create(folder, len(names), len(first), len(first.columns))
+        for i, name in enumerate(names):
+            values[i, :, :] = results[name].to_numpy(dtype=float)
+
+        return SimulationResult._finish(folder, values, names, first.index.to_numpy(dtype=float), first.columns,
+                                        list(first.dtypes), first.index.name)
+
+    @staticmethod
+    def write_from_store(folder: str, store: ChunkedResultStore, rooms: Sequence[str]) -> "SimulationResult":
+        """
+        Write the results in a chunked result store (as written by NpyResultSink) to a folder, one chunk at a time
+        @param rooms: The names of the rooms, in the order of the store.
+        """
+        if len(rooms) != store.n_rooms:
+            raise Exception(f"The store has {store.n_rooms} rooms, {len(rooms)} names were given")
+        times = store.times()
+
+        values = SimulationResult._create(folder, store.n_rooms, len(times), len(store.columns))
+        for i in range(store.n_rooms):
+            row = 0
+            for chunk in store.chunks:
+                chunk_values = store.read_chunk(i, chunk)
+                values[i, row:row+len(chunk_values), :] = chunk_values
+                row += len(chunk_values)
+
+        return SimulationResult._finish(folder, values, list(rooms), times, store.columns, store.dtypes, store.index_name)
+
+    @staticmethod
+    def _create(folder: str, n_rooms: int, n_times: int, n_species: int) -> np.ndarray:
+        os.makedirs(folder, exist_ok=True)
+        if os.path.exists(os.path.join(folder, SimulationResult.index_file)):
+            os.remove(os.path.join(folder, SimulationResult.index_file))
+        return np.lib.format.open_memmap(os.path.join(folder, SimulationResult.values_file), mode="w+", dtype=float,
+                                         shape=(n_rooms, n_times, n_species), fortran_order=True)
+
+    @staticmethod
+    def _finish(folder: str, values: np.ndarray, rooms: List[str], times: np.ndarray, species: pd.Index,
+                dtypes: List[np.dtype], index_name) -> "SimulationResult":
+        values.flush()
+        del values
+        write_npy_atomically(os.path.join(folder, SimulationResult.times_file), times)
+        write_json_atomically(os.path.join(folder, SimulationResult.index_file), {
+            "rooms": [str(r) for r in rooms],
+            "species": [str(s) for s in species],
+            "dtypes": [str(d) for d in dtypes],
+            "index_name": index_name})
+        return SimulationResult(folder)
+
+    def _positions(self, index: pd.Index, labels, what: str) -> np.ndarray:
+        if labels is None:
+            return np.arange(len(index))
+        if isinstance(labels, str):
+            labels = [labels]
+        positions = index.get_indexer(list(labels))
+        if (positions < 0).any():
+            missing = [l for l, p in zip(labels, positions) if p < 0]
+            raise Exception(f"Unknown {what}: {missing}")
+        return positions
+
+    def _time_slice(self, t_start: float = None, t_end: float = None) -> slice:
+        start = 0 if t_start is None else np.searchsorted(self.times, t_start, side="left")
+        end = len(self.times) if t_end is None else np.searchsorted(self.times, t_end, side="right")
+        return slice(start, end)
+
+    def values(self, rooms: Union[str, Sequence[str]] = None, species: Union[str, Sequence[str]] = None,
+               t_start: float = None, t_end: float = None) -> np.ndarray:
+        """
+        The values (rooms x times x species) of some (or all) rooms and species between two times (inclusive)
+        """
+        room_positions = self._positions(self.rooms, rooms, "rooms")
+        species_positions = self._positions(self.species, species, "species")
+        times = np.arange(len(self.times))[self._time_slice(t_start, t_end)]
+        return self._values[np.ix_(room_positions, times, species_positions)]
+
+    def to_dataframe(self, room: str, species: Union[str, Sequence[str]] = None,
+                     t_start: float = None, t_end: float = None) -> pd.DataFrame:
+        """
+        The results of one room as a DataFrame, in the same form as the results returned by Simulation.run
+        """
+        species_positions = self._positions(self.species, species, "species")
+        time_slice = self._time_slice(t_start, t_end)
+        values = self.values(room, self.species[species_positions], t_start, t_end)[0]
+        index = pd.Index(self.times[time_slice], name=self.index_name)
+        return typed_dataframe(values, index, self.species[species_positions], [self.dtypes[p] for p in species_positions])
+
+    def to_dataframes(self, species: Union[str, Sequence[str]] = None,
+                      t_start: float = None, t_end: float = None) -> Dict[str, pd.DataFrame]:
+        """
+        The results of every room as DataFrames, keyed by the name of the room
+        """
+        return dict((room, self.to_dataframe(room, species, t_start, t_end)) for room in self.rooms)
+
+    def species_dataframe(self, species: str, t_start: float = None, t_end: float = None) -> pd.DataFrame:
+        """
+        One species in every room as a DataFrame, with a column for each room
+        """
+        values = self.values(None, species, t_start, t_end)[:, :, 0]
+        index = pd.Index(self.times[self._time_slice(t_start, t_end)], name=self.index_name)
+        return pd.DataFrame(values.T, index=index, columns=self.rooms)
@@ -15,7 +15,8 @@
 #
 # ############################################################################ #
 
-from typing import List, Tuple
+from typing import List, Tuple, Sequence
+import numpy as np
 
 
 class TimeDependentValue:
@@ -78,3 +79,22 @@ class TimeDependentValue:
                     return v0
 
         raise Exception("Invalid time")
+
+    def values_at_times(self, times: Sequence[float]) -> np.ndarray:
+        """
+        Returns the values at many times at once, the same as value_at_time at each of them.
+        """
+        times = np.asarray(times, dtype=float)
+        defined_times = np.array(self.times(), dtype=float)
+        defined_values = np.array(self.values(), dtype=float)
+
+        if times.size and times.min() < defined_times[0]:
+            raise Exception("Time is too early")
+        if times.size and times.max() > defined_times[-1]:
+            raise Exception("Time is too late")
+
+        if self._continuous:
+            # Linear interpolation between 2 times (exact at the defined times)
+            return np.interp(times, defined_times, defined_values)
+        # Discrete step, the value at the last defined time at or before each time
+        return defined_values[np.searchsorted(defined_times, times, side="right")-1]
@@ -0,0 +1,178 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+from typing import List, Hashable
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from scipy.linalg import expm
+
+from .aperture_flow_calculations import ApertureFlowCalculator
+
+
+def transport_generator(flux_matrix: np.ndarray, volumes: np.ndarray) -> np.ndarray:
+    """
+    The (rooms x 2*rooms) matrix G such that d(indoor state)/dt = G @ [indoor state; outdoor state]
+
+    For room i (row i+1 of the flux matrix):
+    - inflow from room j is flux[j+1, i+1]/V_i
+    - outflow to every room and the outside is the sum of flux[i+1, :]/V_i
+    - inflow from its outdoor boundary is flux[0, i+1]/V_i
+    """
+    n = len(volumes)
+    room_fluxes = flux_matrix[1:, 1:]
+
+    generator = np.zeros((n, 2*n))
+    generator[:, :n] = room_fluxes.T
+    generator[:, :n] -= np.diag(flux_matrix[1:, :].sum(axis=1))
+    generator[:, n:] = np.diag(flux_matrix[0, 1:])
+    return generator/np.asarray(volumes, dtype=float)[:, np.newaxis]
+
+
+class TransportEngine:
+    """
+        @brief Applies the transport through every aperture to the state of the whole building at once
+
+        The building state is a dense array with one row per room followed by one row per room's outdoor
+        boundary, and one column per transported species. The outdoor rows hold each room's own outdoor
+        concentrations (the XOUT columns), and are zero for species which have no outdoor concentration.
+
+        The fluxes come from a flux matrix as built by Simulation.trans_matrix, where element [i, j] is the
+        flow (m3/s) from i to j, and index 0 is the outside. The whole transport step is a single
+        (rooms x 2*rooms) matrix product with the building state.
+
+        Two methods are available to build that matrix:
+        - "euler": an explicit Euler step, which overshoots when the step is long compared with the
+          residence time of a room (and can give negative concentrations)
+        - "expm": the exact solution of the linear transport over the step (the matrix exponential),
+          holding the outdoor concentrations constant. It conserves mass and stays positive for any step.
+
+    """
+
+    methods = ("euler", "expm")
+
+    # How many propagators to keep, each is reused while the wind and the step stay the same
+    propagator_cache_size: int = 256
+
+    def __init__(self, columns: pd.Index, volumes: List[float], method: str = "euler"):
+        """
+        @param columns: The columns of the room results (the same for every room).
+        @param volumes: The volume of each room (m3), in the order of the rooms.
+        @param method: How to step the transport, either "euler" or "expm".
+        """
+        if method not in self.methods:
+            raise ValueError(f"Unknown transport method {method}, expected one of {self.methods}")
+
+        self.columns = columns
+        self.volumes = np.asarray(volumes, dtype=float)
+        self.method = method
+        self._propagators: OrderedDict = OrderedDict()
+
+        indoor_var_list, outdoor_var_list = ApertureFlowCalculator.get_trans_vars(columns)
+        self.species: List[str] = indoor_var_list
+
+        # Positions of the transported species in the columns
+        self._indoor_positions = columns.get_indexer(indoor_var_list)
+
+        # For each transported species, the position of its outdoor counterpart in the columns (if it has one)
+        outdoor_positions = columns.get_indexer([s+'OUT' for s in indoor_var_list])
+        outdoor_positions[~np.isin(outdoor_positions, columns.get_indexer(outdoor_var_list))] = -1
+        self._has_outdoor = outdoor_positions >= 0
+        self._outdoor_positions = outdoor_positions[self._has_outdoor]
+
+    @property
+    def n_rooms(self) -> int:
+        return len(self.volumes)
+
+    def building_state(self, room_concentrations: np.ndarray) -> np.ndarray:
+        """
+        Gather the building state from the concentrations of every room (rooms x columns)
+        Returns the dense (2*rooms x species) array of indoor rows then outdoor rows
+        """
+        n = self.n_rooms
+        state = np.zeros((2*n, len(self.species)))
+        state[:n, :] = room_concentrations[:, self._indoor_positions]
+        state[n:, self._has_outdoor] = room_concentrations[:, self._outdoor_positions]
+        return state
+
+    def generator(self, flux_matrix: np.ndarray) -> np.ndarray:
+        """
+        The (rooms x 2*rooms) matrix G such that d(indoor state)/dt = G @ building state
+        """
+        return transport_generator(flux_matrix, self.volumes)
+
+    def is_cached(self, cache_key: Hashable) -> bool:
+        """
+        Whether a propagator is already stored for this key (in which case the flux matrix is not needed)
+        """
+        return cache_key in self._propagators
+
+    def propagator(self, flux_matrix: np.ndarray, delta_time: float, cache_key: Hashable = None) -> np.ndarray:
+        """
+        The (rooms x 2*rooms) matrix taking the building state to the new indoor state after delta_time
+        If a cache key is given (for example the wind state and the step) the matrix is reused for the same key
+        """
+        if cache_key is not None and cache_key in self._propagators:
+            self._propagators.move_to_end(cache_key)
+            return self._propagators[cache_key]
+
+        if self.method == "expm":
+            propagator = self.exact_propagator(flux_matrix, delta_time)
+        else:
+            propagator = self.euler_propagator(flux_matrix, delta_time)
+
+        if cache_key is not None:
+            self._propagators[cache_key] = propagator
+            if len(self._propagators) > self.propagator_cache_size:
+                self._propagators.popitem(last=False)
+        return propagator
+
+    def euler_propagator(self, flux_matrix: np.ndarray, delta_time: float) -> np.ndarray:
+        """
+        The propagator of an explicit Euler step
+        """
+        n = self.n_rooms
+        propagator = delta_time*self.generator(flux_matrix)
+        propagator[:, :n] += np.identity(n)
+        return propagator
+
+    def exact_propagator(self, flux_matrix: np.ndarray, delta_time: float) -> np.ndarray:
+        """
+        The propagator of the exact solution, expm(A*delta_time), where A is the generator
+        extended with zero rows for the outdoor boundary (whose concentrations are held constant)
+        """
+        n = self.n_rooms
+        extended_generator = np.zeros((2*n, 2*n))
+        extended_generator[:n, :] = self.generator(flux_matrix)
+        return expm(extended_generator*delta_time)[:n, :]
+
+    def step(self, building_state: np.ndarray, flux_matrix: np.ndarray, delta_time: float, cache_key: Hashable = None) -> np.ndarray:
+        """
+        Apply the transport for delta_time to the building state
+        Returns the new (rooms x species) indoor state
+        """
+        return self.propagator(flux_matrix, delta_time, cache_key) @ building_state
+
+    def apply(self, room_concentrations: np.ndarray, flux_matrix: np.ndarray, delta_time: float, cache_key: Hashable = None) -> np.ndarray:
+        """
+        Apply the transport for delta_time to the concentrations of every room (rooms x columns)
+        Returns a new array of concentrations where only the transported species have changed
+        """
+        new_indoor_state = self.step(self.building_state(room_concentrations), flux_matrix, delta_time, cache_key)
+        result = np.array(room_concentrations, dtype=float)
+        result[:, self._indoor_positions] = new_indoor_state
+        return result
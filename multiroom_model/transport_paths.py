@@ -15,9 +15,12 @@
 #
 # ############################################################################ #
 
-from typing import List,  Dict, Union, TypeVar
+from typing import List,  Dict, Union, TypeVar, Optional, Iterator, Tuple, Any
 from dataclasses import dataclass
-from itertools import combinations
+from itertools import combinations, islice
+import heapq
+import random
+import warnings
 from .aperture import Aperture, Side
 
 Room = TypeVar('Room')
@@ -44,68 +47,226 @@ class TransportPath:
     route: List[TransportPathParticipation]
 
 
-def paths_through_building(rooms: List[Room], apertures: List[Aperture]) -> List[TransportPath]:
+@dataclass
+class _Node:
+    item: Union[Room | Side]
+    edges: List
+
+
+@dataclass
+class _Edge:
+    source: _Node
+    destination: _Node
+    aperture: TransportPathParticipation
+
+
+_outsides = [Side.Front, Side.Left, Side.Back, Side.Right]
+
+
+def _building_graph(rooms: List[Room], apertures: List[Aperture]) -> Dict[Union[Room | Side], _Node]:
+    """
+        @brief A graph where nodes are either rooms or outsides, and edges are apertures (in both directions)
+    """
+    graph: Dict[Union[Room | Side], _Node] = {}
+    for s in _outsides:
+        graph[s] = _Node(item=s, edges=[])
+    for r in rooms:
+        graph[r] = _Node(item=r, edges=[])
+
+    for a in apertures:
+        node_1: _Node = graph[a.origin]
+        node_2: _Node = graph[a.destination]
+        node_1.edges.append(_Edge(source=node_1, destination=node_2, aperture=TransportPathParticipation(a, False)))
+        node_2.edges.append(_Edge(source=node_2, destination=node_1, aperture=TransportPathParticipation(a, True)))
+    return graph
+
+
+def _depth_first_paths(graph: Dict[Union[Room | Side], _Node], start_node: _Node, end_node: _Node,
+                       max_length: Optional[int]) -> Iterator[TransportPath]:
+    """
+        @brief The paths from one outside node to another, in depth first order
+
+        The traversal keeps one stack of edge positions, one route and one set of the nodes on the route,
+        which are extended and shortened in place, so a route is only copied when a path is found.
+    """
+    # we don't want to be able to leave the building and reenter it
+    # exclude the outside nodes from path
+    on_route = set(id(graph[s]) for s in _outsides)
+
+    route: List[TransportPathParticipation] = []
+    nodes: List[_Node] = [start_node]
+    positions: List[int] = [0]
+
+    while positions:
+        current_node = nodes[-1]
+        position = positions[-1]
+        if position == len(current_node.edges):
+            # Every edge of this node has been followed, step back
+            positions.pop()
+            nodes.pop()
+            if route:
+                route.pop()
+            if nodes:
+                on_route.discard(id(current_node))
+            continue
+        positions[-1] = position+1
+
+        edge: _Edge = current_node.edges[position]
+        if max_length is not None and len(route) >= max_length:
+            continue
+        if edge.destination is end_node:
+            yield TransportPath(start=start_node.item, end=end_node.item, route=route + [edge.aperture])
+        elif id(edge.destination) not in on_route:
+            on_route.add(id(edge.destination))
+            route.append(edge.aperture)
+            nodes.append(edge.destination)
+            positions.append(0)
+
+
+def _shortest_first_paths(graph: Dict[Union[Room | Side], _Node], start_node: _Node, end_node: _Node,
+                          max_length: Optional[int]) -> Iterator[TransportPath]:
+    """
+        @brief The paths from one outside node to another, shortest first
+
+        Partial routes are kept in a heap by their length, each as its last edge and the partial route it
+        extends, so extending a route does not copy it.
+    """
+    excluded = set(id(graph[s]) for s in _outsides)
+
+    # (length, order of creation, node, (edge, previous partial route))
+    heap: List[Tuple[int, int, _Node, Any]] = [(0, 0, start_node, None)]
+    created = 1
+    while heap:
+        length, _, current_node, partial = heapq.heappop(heap)
+        if max_length is not None and length >= max_length:
+            continue
+
+        # The nodes already on this route
+        visited = set()
+        link = partial
+        while link is not None:
+            visited.add(id(link[0].destination))
+            link = link[1]
+
+        for edge in current_node.edges:
+            if edge.destination is end_node:
+                route = [edge.aperture]
+                link = partial
+                while link is not None:
+                    route.append(link[0].aperture)
+                    link = link[1]
+                yield TransportPath(start=start_node.item, end=end_node.item, route=route[::-1])
+            elif id(edge.destination) not in excluded and id(edge.destination) not in visited:
+                heapq.heappush(heap, (length+1, created, edge.destination, (edge, partial)))
+                created += 1
+
+
+def paths_through_building(rooms: List[Room], apertures: List[Aperture], max_length: int = None,
+                           max_paths: int = None, k_shortest: int = None) -> List[TransportPath]:
     """
         @brief Given a list of rooms and a list of apertures joining them (either to each other or the outside)
         Produces a list of the unique transport paths from one outside side of the house to another
         Each path goes through each room only once, preventing cycles
         Note that a path and its exact reversal are NOT both in the list, this is to prevent double-counting paths.
+
+        The number of paths can grow exponentially with the number of rooms, for a large building
+        (see estimate_path_count) the paths can be limited:
+        @param max_length: Only paths through at most this many apertures.
+        @param max_paths: At most this many paths in all (with a warning when some are left out). The paths
+                          are then found shortest first, and shared out between the pairs of outside sides,
+                          so every pair keeps its shortest paths rather than the first pairs using them all.
+        @param k_shortest: Only the k shortest paths between each pair of outside sides, which are then found
+                           shortest first (without k_shortest or max_paths the paths are in depth first order).
     """
+    graph = _building_graph(rooms, apertures)
 
-    # build a graph where nodes are either rooms or outsides, and edges are apertures
-    @dataclass
-    class Node:
-        item: Union[Room | Side]
-        edges: List
+    # Use all combinations of 2 of the outside nodes (there are 6 combinations of 2 outside nodes: 4C2=6)
+    # We don't use permutations, because that would double-count the paths by reversing the start and end
+    pairs = list(combinations(_outsides, 2))
+    if max_paths is None and k_shortest is None:
+        return [path for start, end in pairs for path in _depth_first_paths(graph, graph[start], graph[end], max_length)]
 
-    @dataclass
-    class Edge:
-        source: Node
-        destination: Node
-        aperture: TransportPathParticipation
+    searches = [islice(_shortest_first_paths(graph, graph[start], graph[end], max_length), k_shortest)
+                for start, end in pairs]
+    if max_paths is None:
+        return [path for search in searches for path in search]
 
-    outsides = [Side.Front, Side.Left, Side.Back, Side.Right]
+    # Share max_paths out between the pairs, taking the next shortest path of each pair in turn,
+    # so a pair with fewer paths leaves the rest of the budget to the others
+    found: List[List[TransportPath]] = [[] for _ in pairs]
+    searching = list(range(len(pairs)))
+    count = 0
+    truncated = False
+    while searching:
+        for n in list(searching):
+            path = next(searches[n], None)
+            if path is None:
+                searching.remove(n)
+            elif count == max_paths:
+                truncated = True
+                searching = []
+                break
+            else:
+                found[n].append(path)
+                count += 1
 
-    graph: Dict[Union[Room | Side], Node] = {}
-    for s in outsides:
-        graph[s] = Node(item=s, edges=[])
-    for r in rooms:
-        graph[r] = Node(item=r, edges=[])
+    result = [path for paths in found for path in paths]
+    if truncated:
+        warnings.warn(f"Kept the shortest {len(result)} transport paths (max_paths={max_paths}), about "
+                      f"{estimate_path_count(rooms, apertures, max_length=max_length):.3g} paths "
+                      f"are expected (see estimate_path_count)")
+    return result
 
-    for a in apertures:
-        node_1: Node = graph[a.origin]
-        node_2: Node = graph[a.destination]
-        node_1.edges.append(Edge(source=node_1, destination=node_2, aperture=TransportPathParticipation(a, False)))
-        node_2.edges.append(Edge(source=node_2, destination=node_1, aperture=TransportPathParticipation(a, True)))
-
-    # method to find all the paths from one start node to an end node
-    def all_paths_between(start_node, end_node) -> List[TransportPath]:
-        result: List[TransportPath] = []
-
-        # recursive utility function
-        def find_all_paths(current_node: Node, final_destination: Node, visited: List[Node], path: List[TransportPathParticipation]):
-            new_visited = visited + [current_node]
-            for edge in current_node.edges:
-                new_path = path + [edge.aperture]
-                if (edge.destination == final_destination):
-                    result.append(TransportPath(start=start_node.item, end=end_node.item, route=new_path))
-                elif (edge.destination not in visited):
-                    find_all_paths(edge.destination, final_destination, new_visited, new_path)
-
-        # we don't want to be able to leave the building and reenter it
-        # exclude the outside nodes from path
-        excluded_nodes = list(graph[s] for s in outsides)
-
-        # invoke the recursive function
-        find_all_paths(start_node, end_node, excluded_nodes, [])
-        return result
-
-    # Use this method 6 times to accumulate all routes between the 4 outside nodes, and not their exact reversals
-    result: List[TransportPath] = []
 
-    # Use all combinations of 2 of the outside nodes (there are 6 combinations of 2 outside nodes: 4C2=6)
-    # We don't use permutations, because that would double-count the paths by reversing the start and end
-    for start, end in combinations(outsides, 2):
-        result.extend(all_paths_between(graph[start], graph[end]))
+def warn_if_many_paths(rooms: List[Room], apertures: List[Aperture], max_length: int = None,
+                       max_paths: int = None, k_shortest: int = None, threshold: float = 1.0e5) -> float:
+    """
+        @brief Warn, before finding them, when paths_through_building would find more than threshold paths
+        with these limits (which could take hours or never finish). Returns the estimated number of paths.
+    """
+    expected = estimate_path_count(rooms, apertures, max_length=max_length, samples=200)
+    if max_paths is not None:
+        expected = min(expected, max_paths)
+    if k_shortest is not None:
+        expected = min(expected, k_shortest*len(_outsides)*(len(_outsides)-1)/2)
+    if expected > threshold:
+        warnings.warn(f"About {expected:.3g} transport paths are expected through the {len(rooms)} rooms, "
+                      f"finding them may not finish. Limit them with max_path_length, max_transport_paths or "
+                      f"k_shortest_paths, or use the pressure_network airflow model")
+    return expected
 
-    return result
+
+def estimate_path_count(rooms: List[Room], apertures: List[Aperture], max_length: int = None,
+                        samples: int = 1000, seed: int = 0) -> float:
+    """
+        @brief An estimate of how many paths paths_through_building would find, without finding them
+
+        Knuth's estimator of the size of a search tree: a random walk follows one untried route from each outside
+        side, at each step counting the paths it could finish and multiplying by the number of ways it could go on.
+        The average over the samples is an unbiased estimate, found in time proportional to samples x rooms.
+    """
+    graph = _building_graph(rooms, apertures)
+    excluded = set(id(graph[s]) for s in _outsides)
+    generator = random.Random(seed)
+
+    total = 0.0
+    for start, end in combinations(_outsides, 2):
+        end_node = graph[end]
+        estimate = 0.0
+        for _ in range(samples):
+            weight = 1.0
+            current_node = graph[start]
+            visited = set()
+            length = 0
+            while max_length is None or length < max_length:
+                estimate += weight*sum(1 for e in current_node.edges if e.destination is end_node)
+                onward = [e for e in current_node.edges
+                          if id(e.destination) not in excluded and id(e.destination) not in visited]
+                if not onward:
+                    break
+                weight *= len(onward)
+                current_node = generator.choice(onward).destination
+                visited.add(id(current_node))
+                length += 1
+        total += estimate/samples
+    return total
@@ -16,6 +16,7 @@
 # ############################################################################ #
 
 from dataclasses import dataclass
+from typing import List
 from .time_dep_value import TimeDependentValue
 
 
@@ -28,3 +29,9 @@ class WindDefinition:
     wind_speed: TimeDependentValue
     wind_direction: TimeDependentValue
     in_radians: bool = True
+
+    def times(self) -> List[float]:
+        """
+        The times at which the wind speed or direction is defined (in order)
+        """
+        return sorted(set(self.wind_speed.times()) | set(self.wind_direction.times()))
@@ -15,7 +15,10 @@
 #
 # ############################################################################ #
 
+import io
 import math
+import pickle
+import contextlib
 import unittest
 
 from unittest.mock import Mock, patch
@@ -24,9 +27,11 @@ from multiroom_model.aperture_calculations import (
     room_has_outdoor_aperture,
     transport_path_angle_in_radians,
     transport_path_windspeed,
+    is_room_cross_ventilated,
     flow_advection,
     flow_exchange,
     ApertureCalculation,
+    TransportPathIndex,
     Fluxes,
 )
 from multiroom_model.aperture import Side, Aperture
@@ -459,3 +464,97 @@ class TestApertureCalculationsWithWind(unittest.TestCase):
             self.assertEqual(catagory, 2)
             self.assertEqual(result.from_1_to_2, 0.123)
             self.assertEqual(result.from_2_to_1, 0.123)
+
+
+class TestWindResponse(unittest.TestCase):
+    def setUp(self):
+        # Rooms in an L, with windows on every side, so the paths through an aperture go in several directions
+        self.rooms = [MockRoom() for _ in range(4)]
+        room1, room2, room3, room4 = self.rooms
+        self.apertures = [
+            Aperture(room1, Side.Front, 1.0),
+            Aperture(room1, Side.Left, 0.5),
+            Aperture(room1, room2, 2.0),
+            Aperture(room2, Side.Back, 1.5),
+            Aperture(room2, room3, 2.0),
+            Aperture(room3, Side.Right, 0.8),
+            Aperture(room3, room4, 2.0),
+        ]
+        transport_paths = paths_through_building(self.rooms, self.apertures)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.calculations = [ApertureCalculation(a, transport_paths, self.apertures, math.radians(30), 1.2, (0.3, -0.2))
+                                 for a in self.apertures]
+
+    @patch('multiroom_model.aperture_calculations.flow_exchange')
+    def test_lookup_matches_contributions(self, mock_flow_exchange):
+        # The exchange flow is the category, so the categories are compared too
+        mock_flow_exchange.side_effect = lambda category: category
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for c in self.calculations:
+                for wind_speed in (0.0, 1.0e-6, 0.5, 3.0):
+                    # Every 15 degrees includes the directions across the paths
+                    for degrees in range(0, 360, 15):
+                        wind_direction = math.radians(degrees)
+                        expected = c.trans_matrix_contributions(wind_speed, wind_direction)
+                        result = c.lookup_trans_matrix_contributions(wind_speed, wind_direction)
+                        self.assertAlmostEqual(result.from_1_to_2, expected.from_1_to_2, places=12)
+                        self.assertAlmostEqual(result.from_2_to_1, expected.from_2_to_1, places=12)
+
+    def test_built_on_first_use_without_air_density(self):
+        transport_paths = paths_through_building(self.rooms, self.apertures)
+        c = ApertureCalculation(self.apertures[2], transport_paths, self.apertures)
+        c.air_density = 1.2
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertGreater(len(c.wind_response.path_angles), 1)
+            self.assertLessEqual(len(c.wind_response.path_angles), 8)
+
+
+class TestTransportPathIndex(unittest.TestCase):
+    def setUp(self):
+        self.rooms = [MockRoom() for _ in range(5)]
+        room1, room2, room3, room4, room5 = self.rooms
+        self.apertures = [
+            Aperture(room1, Side.Front),
+            Aperture(room1, Side.Left),
+            Aperture(room1, room2),
+            Aperture(room2, Side.Back),
+            Aperture(room2, room3),
+            Aperture(room3, Side.Right),
+            Aperture(room3, room4),
+            # A room off the side of another, with no path through it
+            Aperture(room4, room5),
+        ]
+        self.transport_paths = paths_through_building(self.rooms, self.apertures)
+        self.index = TransportPathIndex(self.transport_paths, math.radians(30))
+
+    def test_matches_scanning_the_paths(self):
+        for wind_speed in (0.0, 1.0e-6, 2.0):
+            for degrees in range(0, 360, 15):
+                wind_direction = math.radians(degrees)
+
+                windspeeds = self.index.path_windspeeds(wind_speed, wind_direction)
+                for t, windspeed in zip(self.transport_paths, windspeeds):
+                    self.assertAlmostEqual(windspeed, transport_path_windspeed(t, wind_speed, wind_direction, math.radians(30)))
+
+                for room in self.rooms + [Side.Front, Side.Back, Side.Left, Side.Right, Side.Upward]:
+                    self.assertEqual(self.index.is_cross_ventilated(self.index.node(room), wind_speed, wind_direction),
+                                     is_room_cross_ventilated(room, self.transport_paths, wind_speed, wind_direction, math.radians(30)))
+
+    def test_rooms_off_the_paths(self):
+        self.assertIsNone(self.index.node(self.rooms[4]))
+        self.assertEqual(len(self.index.paths_through(None)), 0)
+        for room in self.rooms[:4]:
+            self.assertEqual(sorted(self.index.paths_through(self.index.node(room)).tolist()),
+                             [p for p, t in enumerate(self.transport_paths) if transport_path_contains_room(room, t)])
+
+    def test_windspeeds_found_once_per_wind(self):
+        first = self.index.path_windspeeds(2.0, 0.5)
+        self.index.is_cross_ventilated(0, 2.0, 0.5)
+        self.assertIs(self.index.path_windspeeds(2.0, 0.5), first)
+        self.assertIsNot(self.index.path_windspeeds(2.0, 0.6), first)
+
+    def test_copy_numbers_rooms_the_same(self):
+        rooms, index = pickle.loads(pickle.dumps((self.rooms, self.index)))
+        for original, copy in zip(self.rooms, rooms):
+            self.assertEqual(index.node(copy), self.index.node(original))
@@ -0,0 +1,106 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import unittest
+
+from multiroom_model.autotune import CostModel, autotune, interval_ladder, makespan
+
+
+class CalibratedBuilding:
+    """
+    A built simulation as autotune sees it, with a cost model already measured
+    """
+
+    def __init__(self, cost_model, n_rooms, breakpoints=()):
+        self.cost_model = cost_model
+        self.rooms = list(range(n_rooms))
+        self._breakpoints = list(breakpoints)
+        self.dt = cost_model.dt
+        self.calibration_intervals = []
+
+    def calibrate(self, init_conditions, t0, t_interval):
+        self.calibration_intervals.append(t_interval)
+        return self.cost_model
+
+    def breakpoints(self):
+        return self._breakpoints
+
+
+class TestAutotune(unittest.TestCase):
+    def test_makespan(self):
+        # Longest first onto the least busy worker: 3+2+2 and 3+2
+        self.assertEqual(makespan([3.0, 3.0, 2.0, 2.0, 2.0], 2), 7.0)
+        self.assertEqual(makespan([3.0, 1.0], 1), 4.0)
+        self.assertEqual(makespan([3.0, 1.0], 8), 3.0)
+
+    def test_projected_seconds(self):
+        model = CostModel(room_fixed=[1.0, 1.0], room_per_second=[0.1, 0.1], send_seconds=[0.5, 0.5],
+                          result_seconds_per_row=[0.0, 0.0], transport_seconds=0.25, dt=1.0)
+        # Each interval of 10 s: 2 rooms of 2 s, and the transport
+        self.assertAlmostEqual(model.projected_seconds("serial", 1, [10.0, 10.0]), 2*4.25)
+        # The rooms in parallel, after sending both evolvers
+        self.assertAlmostEqual(model.projected_seconds("process", 2, [10.0, 10.0]), 2*(1.0+2.0+0.25))
+        with self.assertRaises(ValueError):
+            model.projected_seconds("thread", 2, [10.0])
+
+    def test_interval_ladder(self):
+        self.assertEqual(interval_ladder(5.0, 60.0, 1.0), [60.0, 30.0, 15.0, 7.0])
+        self.assertEqual(interval_ladder(5.0, 3.0, 1.0), [5.0])
+
+    def test_small_rooms_run_serially(self):
+        # Sending the evolvers costs more than the chemistry
+        model = CostModel([0.01]*2, [0.001]*2, [0.5]*2, [0.0]*2, 0.001, 1.0)
+        result = autotune(CalibratedBuilding(model, 2), {}, 0.0, 3600.0, max_interval=60.0, max_workers=4)
+
+        self.assertEqual((result.backend, result.workers, result.t_interval), ("serial", 1, 60.0))
+        self.assertAlmostEqual(result.projected_seconds, 60*(0.02+0.12+0.001))
+        self.assertIn("serial", result.summary())
+
+    def test_large_rooms_run_in_processes(self):
+        model = CostModel([0.1]*8, [1.0]*8, [0.01]*8, [0.0]*8, 0.01, 1.0)
+        result = autotune(CalibratedBuilding(model, 8), {}, 0.0, 3600.0, max_interval=60.0, max_workers=4)
+
+        self.assertEqual((result.backend, result.workers), ("process", 4))
+        # Every option was projected
+        self.assertEqual(len(result.candidates), len(interval_ladder(60.0/16, 60.0, 1.0))*(1+4))
+
+    def test_intervals_are_whole_steps(self):
+        # The run_mbm settings, the default shortest interval of 6/16 s is less than one step
+        model = CostModel([1.0]*2, [0.1]*2, [0.0]*2, [0.0]*2, 0.0, 1.0)
+        building = CalibratedBuilding(model, 2)
+        result = autotune(building, {}, 0.0, 25.0, max_interval=6.0)
+
+        self.assertEqual(building.calibration_intervals, [1.0])
+        self.assertTrue(all(t % 1.0 == 0 for t in result.candidates["t_interval"]))
+
+        model = CostModel([1.0]*2, [0.1]*2, [0.0]*2, [0.0]*2, 0.0, 0.002)
+        building = CalibratedBuilding(model, 2)
+        autotune(building, {}, 0.0, 25.0, max_interval=0.1, calibration_interval=0.0065)
+        self.assertAlmostEqual(building.calibration_intervals[0], 0.006)
+
+    def test_interval_is_limited_by_the_transport(self):
+        # A transport step of more than 10 s would change the concentrations by more than 10%
+        model = CostModel([1.0]*2, [0.0]*2, [0.0]*2, [0.0]*2, 0.0, 1.0, transport_rate=0.01)
+        result = autotune(CalibratedBuilding(model, 2, breakpoints=[95.0]), {}, 0.0, 200.0, max_interval=60.0)
+
+        self.assertEqual(result.t_interval, 10.0)
+        # The intervals end at the breakpoint
+        self.assertEqual(result.candidates.loc[0, "intervals"], 21)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,14 +15,33 @@
 #
 # ############################################################################ #
 
+import os
+import pickle
+import tempfile
 import unittest
 import math
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_allclose
+from scipy.linalg import expm
 
 from multiroom_model.json_parser import BuildingJSONParser
 from multiroom_model.transport_paths import paths_through_building
 from multiroom_model.aperture_calculations import ApertureCalculation, Side
 from multiroom_model.simulation import Simulation
+from multiroom_model.aperture_flow_calculations import ApertureFlowCalculator
 from multiroom_model.global_settings import GlobalSettings
+from multiroom_model.interval_scheduler import AdaptiveIntervalScheduler
+from multiroom_model.checkpoint import Checkpointer
+from multiroom_model.result_sink import NpyResultSink
+from multiroom_model.output_spec import OutputSpec
+from multiroom_model.autotune import autotune
+from multiroom_model.coupled_engine import LinearRoomODESystem
+from multiroom_model.room_chemistry import RoomChemistry
+from multiroom_model.surface_composition import SurfaceComposition
+from multiroom_model.aperture import Aperture
+from multiroom_model.wind_definition import WindDefinition
+from multiroom_model.time_dep_value import TimeDependentValue
 
 
 class TestBuildingSimulation(unittest.TestCase):
@@ -64,6 +83,10 @@ class TestBuildingSimulation(unittest.TestCase):
         )
         cls.simulation = Simulation(cls.global_settings, cls.rooms, cls.apertures, cls.wind_definition)
 
+    @classmethod
+    def tearDownClass(cls):
+        cls.simulation.close()
+
     def test_aperture_calculations(self):
 
         transport_paths = paths_through_building(self.rooms, self.apertures)
@@ -112,6 +135,58 @@ class TestBuildingSimulation(unittest.TestCase):
             self.assertEqual(calculator.trans_matrix_contributions(1, 0).from_2_to_1,
                              sim_calc.trans_matrix_contributions(1, 0).from_2_to_1)
 
+    def test_apply_wind_matches_aperture_flow_calculations(self):
+
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            phase_1 = pickle.load(file)
+        room_results = [phase_1*(i+1) for i in range(len(self.rooms))]
+        time, delta_time = 180.0, 60.0
+
+        result = self.simulation._apply_wind(time, delta_time, room_results)
+
+        # Accumulate the changes aperture by aperture
+        flow_calculator = ApertureFlowCalculator(phase_1.columns)
+        expected = [r.loc[time, :].astype(float) for r in room_results]
+        wind_speed, wind_direction = self.simulation.wind_state(time)
+        for calculator, origin_index, destination_index, origin_volume, destination_volume in self.simulation._aperture_calculators:
+            flux = calculator.trans_matrix_contributions(wind_speed, wind_direction)
+            if destination_index is None:
+                change = flow_calculator.outdoor_concentration_changes(
+                    flux, delta_time, room_results[origin_index].loc[time, :], origin_volume)
+                expected[origin_index] = expected[origin_index].add(change, fill_value=0.0)
+            else:
+                change_1, change_2 = flow_calculator.concentration_changes(
+                    flux, delta_time, room_results[origin_index].loc[time, :],
+                    room_results[destination_index].loc[time, :], origin_volume, destination_volume)
+                expected[origin_index] = expected[origin_index].add(change_1, fill_value=0.0)
+                expected[destination_index] = expected[destination_index].add(change_2, fill_value=0.0)
+
+        for r, e in zip(result, expected):
+            assert_allclose(r.loc[time, :].to_numpy(), e.reindex(phase_1.columns).to_numpy(), rtol=1.0e-12, atol=1.0e-300)
+
+    def test_transport_engine_follows_the_columns(self):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            phase_1 = pickle.load(file)
+        room_results = [phase_1 for _ in self.rooms]
+        engine = self.simulation._engine_for(room_results)
+        self.assertIs(self.simulation._engine_for([r.copy() for r in room_results]), engine)
+
+        # Results with fewer columns (as from another run) get an engine of their own
+        fewer = [r.drop(columns=["O3", "O3OUT"]) for r in room_results]
+        self.assertNotIn("O3", self.simulation._engine_for(fewer).species)
+        self.assertIn("O3", self.simulation._engine_for(room_results).species)
+
+    def test_transport_needs_the_same_columns_in_every_room(self):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            phase_1 = pickle.load(file)
+        room_results = [phase_1 for _ in self.rooms]
+        room_results[1] = phase_1[phase_1.columns[::-1]]
+        engine = self.simulation._engine_for(room_results)
+        flux_matrix = self.simulation.trans_matrix(180.0)
+
+        with self.assertRaises(Exception):
+            Simulation.apply_transport(engine, room_results, flux_matrix, 3.0, 180.0)
+
     def test_running(self):
 
         initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
@@ -122,3 +197,309 @@ class TestBuildingSimulation(unittest.TestCase):
             t_interval=3.0,
             init_conditions=initial_conditions
         )
+
+    def test_interval_schedule(self):
+        self.assertEqual(Simulation.interval_schedule(0.0, 25, 3.0),
+                         [(float(t), 3.0) for t in range(0, 24, 3)] + [(24.0, 1.0)])
+        self.assertEqual(Simulation.interval_schedule(10.0, 6, 3.0), [(10.0, 3.0), (13.0, 3.0)])
+
+    def test_running_with_strang_splitting(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+
+        with Simulation(self.global_settings, self.rooms, self.apertures, self.wind_definition,
+                        transport_method="expm", splitting="strang") as simulation:
+            result = simulation.run(
+                t0=0.0,
+                t_total=25,
+                t_interval=3.0,
+                init_conditions=initial_conditions
+            )
+
+        for r in self.rooms:
+            self.assertEqual(result[r].index[0], 0.0)
+            self.assertEqual(result[r].index[-1], 25.0)
+            self.assertEqual(len(result[r].index), int(25/1)+1+int(25/3))
+
+    def test_lie_and_strang_start_from_the_same_row(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        results = []
+        for splitting in ("lie", "strang"):
+            with Simulation(self.global_settings, self.rooms, self.apertures, self.wind_definition,
+                            splitting=splitting) as simulation:
+                results.append(simulation.run(initial_conditions, 0.0, 6, 3.0))
+
+        for r in self.rooms:
+            self.assertTrue(results[0][r].iloc[[0], :].equals(results[1][r].iloc[[0], :]))
+            self.assertIn("O3OUT", results[1][r].columns)
+
+    def test_running_with_adaptive_intervals(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        scheduler = AdaptiveIntervalScheduler(min_interval=2.0, max_interval=8.0, granularity=1.0)
+
+        result = self.simulation.run(
+            t0=0.0,
+            t_total=25,
+            t_interval=scheduler,
+            init_conditions=initial_conditions
+        )
+
+        report = self.simulation.step_report()
+        self.assertEqual(report["start"].iloc[0], 0.0)
+        self.assertEqual(report["start"].iloc[-1]+report["length"].iloc[-1], 25.0)
+        for r in self.rooms:
+            self.assertEqual(result[r].index[0], 0.0)
+            self.assertEqual(result[r].index[-1], 25.0)
+            self.assertEqual(len(result[r].index), int(25/1)+len(report))
+
+    def test_adaptive_intervals_are_whole_time_steps(self):
+
+        # No granularity is given, so the run rounds the intervals to its time step
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        scheduler = AdaptiveIntervalScheduler(min_interval=1.5, max_interval=7.5)
+
+        result = self.simulation.run(t0=0.0, t_total=25, t_interval=scheduler, init_conditions=initial_conditions)
+
+        self.assertEqual(scheduler.granularity, self.global_settings.dt)
+        report = self.simulation.step_report()
+        self.assertTrue(((report["length"] % self.global_settings.dt) == 0).all())
+        for r in self.rooms:
+            self.assertEqual(result[r].index[-1], 25.0)
+
+    def test_resume_from_checkpoint(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+
+        with tempfile.TemporaryDirectory() as folder:
+            checkpoint = Checkpointer(folder, every_intervals=3)
+            result = self.simulation.run(
+                t0=0.0,
+                t_total=25,
+                t_interval=3.0,
+                init_conditions=initial_conditions,
+                checkpoint=checkpoint
+            )
+
+            # Carry on from the last checkpoint (after 6 intervals, at 18s)
+            resumed = self.simulation.resume(Checkpointer(folder, every_intervals=3))
+
+        for r in self.rooms:
+            self.assertTrue(resumed[r].index.equals(result[r].index))
+            assert_allclose(resumed[r].to_numpy(dtype=float), result[r].to_numpy(dtype=float), rtol=1.0e-6)
+
+    def test_run_to_npy_sink(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        result = self.simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions)
+
+        with tempfile.TemporaryDirectory() as folder:
+            streamed = self.simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions,
+                                           sink=NpyResultSink(folder, len(self.rooms), chunk_rows=5))
+
+            for r in self.rooms:
+                self.assertTrue(streamed[r].to_dataframe().equals(result[r]))
+
+    def test_run_with_output_spec(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        result = self.simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions)
+        selected = self.simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions,
+                                       output=OutputSpec(species=["O3"], output_interval=3.0))
+
+        for r in self.rooms:
+            self.assertEqual(list(selected[r].columns), ["O3", "O3OUT"])
+            self.assertEqual(list(selected[r].index), [0.0, 3.0, 6.0, 9.0])
+            self.assertEqual(selected[r].loc[9.0, "O3"], result[r].loc[9.0, "O3"])
+            # At the boundaries the state after the transport, which the next interval starts from
+            self.assertEqual(selected[r].loc[3.0, "O3"], result[r].loc[[3.0], "O3"].iloc[-1])
+
+        with self.assertRaises(ValueError):
+            self.simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions,
+                                output=OutputSpec(species=["O3"], output_interval=1.5))
+
+    def test_running_on_every_executor(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        result = self.simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions)
+
+        for executor in ("serial", "thread"):
+            with self.subTest(executor=executor):
+                with Simulation(self.global_settings, self.rooms, self.apertures, self.wind_definition,
+                                executor=executor) as simulation:
+                    # Run twice with the same executor
+                    for _ in range(2):
+                        other = simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions)
+                        for r in self.rooms:
+                            assert_allclose(other[r].to_numpy(dtype=float), result[r].to_numpy(dtype=float), rtol=1.0e-12)
+
+    def test_resident_workers_do_not_keep_the_executor_pool(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        with Simulation(self.global_settings, self.rooms, self.apertures, self.wind_definition,
+                        resident_workers=True) as simulation:
+            # Only the workers run the rooms, the pool which built the aperture calculations was stopped
+            self.assertIsNone(simulation._executor._pool)
+            result = simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions)
+            self.assertIsNone(simulation._executor._pool)
+
+        for r in self.rooms:
+            self.assertEqual(result[r].index[-1], 9.0)
+
+    def test_autotune(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        result = autotune(self.simulation, initial_conditions, 0.0, 25, max_interval=6.0, min_interval=2.0, max_workers=2)
+
+        self.assertIn(result.backend, ("serial", "process"))
+        self.assertLessEqual(result.t_interval, 6.0)
+        self.assertGreater(result.projected_seconds, 0.0)
+        self.assertEqual(len(result.cost_model.room_fixed), len(self.rooms))
+
+    def test_autotune_default_min_interval(self):
+
+        # The settings of run_mbm, whose default shortest interval is less than one step
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        result = autotune(self.simulation, initial_conditions, 0.0, 25, max_interval=6.0, max_workers=2)
+
+        self.assertEqual(result.t_interval % self.global_settings.dt, 0)
+        self.assertGreater(result.projected_seconds, 0.0)
+
+    def test_save_and_load(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        result = self.simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = f"{folder}/simulation.pkl"
+            fingerprint = Simulation.input_fingerprint(self.global_settings, ["config_rooms/building.json"])
+            self.simulation.save(path, fingerprint)
+            loaded = Simulation.load(path, fingerprint)
+            self.addCleanup(loaded.close)
+
+            with self.assertRaises(Exception):
+                Simulation.load(path, "another building")
+
+        # The loaded simulation has its own rooms, in the same order
+        self.assertEqual(len(loaded.rooms), len(self.rooms))
+        loaded_result = loaded.run(t0=0.0, t_total=9, t_interval=3.0,
+                                   init_conditions=dict([(r, 'initial_concentrations.txt') for r in loaded.rooms]))
+        for original, r in zip(self.rooms, loaded.rooms):
+            self.assertTrue(loaded_result[r].equals(result[original]))
+        assert_allclose(loaded.trans_matrix(100.0), self.simulation.trans_matrix(100.0))
+
+    def test_load_then_run_on_threads(self):
+
+        initial_conditions = dict([(r, 'initial_concentrations.txt') for r in self.rooms])
+        result = self.simulation.run(t0=0.0, t_total=9, t_interval=3.0, init_conditions=initial_conditions)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = f"{folder}/simulation.pkl"
+            self.simulation.save(path)
+            loaded = Simulation.load(path, executor="thread")
+
+        # Each room has its own main class when the rooms run in this process
+        main_classes = [id(e.inchem) for e in loaded._room_evolvers]
+        self.assertEqual(len(set(main_classes)), len(main_classes))
+
+        loaded_result = loaded.run(t0=0.0, t_total=9, t_interval=3.0,
+                                   init_conditions=dict([(r, 'initial_concentrations.txt') for r in loaded.rooms]))
+        loaded.close()
+        for original, r in zip(self.rooms, loaded.rooms):
+            assert_allclose(loaded_result[r].to_numpy(), result[original].to_numpy())
+
+    def test_unknown_splitting_raises(self):
+        with self.assertRaises(ValueError):
+            Simulation(self.global_settings, self.rooms, self.apertures, self.wind_definition, splitting="yoshida")
+
+
+class LinearRoomEvolver:
+    """
+    A room whose chemistry is linear, solved exactly over each interval, and given as an ODE system to the
+    coupled scheme
+    """
+
+    def __init__(self, system: LinearRoomODESystem, dt: float):
+        self.system = system
+        self.dt = dt
+
+    def ode_system(self):
+        return self.system
+
+    def run(self, t0, seconds_to_integrate, initial_dataframe=None, initial_text_file=None):
+        if initial_text_file is not None:
+            with open(initial_text_file) as file:
+                concentrations = dict(line.strip().rstrip(';').split('=') for line in file if '=' in line)
+            initial_dataframe = pd.DataFrame({k.strip(): [float(v)] for k, v in concentrations.items()}, index=[t0])
+        y0 = initial_dataframe.reindex(columns=self.system.species, fill_value=0.0).iloc[-1, :].to_numpy(dtype=float)
+
+        times = t0 + self.dt*np.arange(round(seconds_to_integrate/self.dt)+1)
+        states = [expm(self.system.rate_matrix*(t-t0)) @ y0 for t in times]
+        result = pd.DataFrame(states, index=times, columns=self.system.species)
+        for species, outdoor in zip(self.system.species, self.system.outdoor):
+            result[species+"OUT"] = outdoor
+        return result, None
+
+
+class LinearSimulation(Simulation):
+    """
+    A simulation of rooms with linear chemistry (A decays into B, and B into CSURF which stays in the room)
+    """
+
+    def _build_room_evolvers(self):
+        rate_matrix = np.array([[-2.0e-2, 0.0, 0.0],
+                                [2.0e-2, -5.0e-3, 0.0],
+                                [0.0, 5.0e-3, 0.0]])
+        system = LinearRoomODESystem(["A", "B", "CSURF"], rate_matrix, outdoor=[1.0e9, 5.0e8, 0.0])
+        return [LinearRoomEvolver(system, self.dt) for _ in self._rooms]
+
+
+class TestCoupledSimulation(unittest.TestCase):
+
+    def setUp(self):
+        # Two rooms in a row, with a window at the front and one at the back
+        self.rooms = [RoomChemistry(volume, 50.0, "LED", "glass_C", SurfaceComposition()) for volume in (30.0, 20.0)]
+        self.apertures = [Aperture(self.rooms[0], Side.Front, 0.1),
+                          Aperture(self.rooms[0], self.rooms[1], 1.0),
+                          Aperture(self.rooms[1], Side.Back, 0.1)]
+        self.wind_definition = WindDefinition(TimeDependentValue([(0.0, 2.0), (3600.0, 2.0)], False),
+                                              TimeDependentValue([(0.0, 0.3), (3600.0, 0.3)], False), True)
+        self.global_settings = GlobalSettings(dt=1.0, air_density=1.2)
+
+        self.folder = tempfile.TemporaryDirectory()
+        self.initial_conditions = {}
+        for i, r in enumerate(self.rooms):
+            self.initial_conditions[r] = os.path.join(self.folder.name, f"room_{i}.txt")
+            with open(self.initial_conditions[r], "w") as file:
+                file.write(f"A={(i+1)*1.0e10} ;\nCSURF=1.0e9 ;\n")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def run_simulation(self, splitting, t_interval=10.0):
+        simulation = LinearSimulation(self.global_settings, self.rooms, self.apertures, self.wind_definition,
+                                      transport_method="expm", splitting=splitting, executor="serial")
+        with simulation:
+            result = simulation.run(self.initial_conditions, 0.0, 120.0, t_interval)
+        return np.stack([result[r].loc[[120.0], ["A", "B", "CSURF"]].iloc[-1, :].to_numpy() for r in self.rooms])
+
+    def test_coupled_matches_split(self):
+        coupled = self.run_simulation("coupled")
+
+        # The split schemes converge to the coupled solution, Strang faster than Lie
+        strang_errors = [np.abs(self.run_simulation("strang", t) - coupled).max() for t in (10.0, 5.0)]
+        lie_error = np.abs(self.run_simulation("lie", 5.0) - coupled).max()
+        self.assertLess(strang_errors[1], strang_errors[0]/3)
+        self.assertLess(strang_errors[1], lie_error/10)
+        assert_allclose(self.run_simulation("strang", 1.0), coupled, rtol=1.0e-4)
+
+        # The species on the surfaces are not transported, only made from B
+        self.assertGreater(coupled[0, 2], 1.0e9)
+
+    def test_coupled_needs_ode_systems(self):
+        # The InChemPy evolvers do not give their right hand side
+        with Simulation(self.global_settings, self.rooms, self.apertures, self.wind_definition,
+                        splitting="coupled", executor="serial") as simulation:
+            with self.assertRaises(Exception):
+                simulation.run(self.initial_conditions, 0.0, 10.0, 5.0)
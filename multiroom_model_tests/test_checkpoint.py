@@ -0,0 +1,145 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from multiroom_model.checkpoint import Checkpointer, write_atomically
+from multiroom_model.interval_scheduler import FixedIntervalScheduler, TransportProbe
+from multiroom_model.result_sink import MemoryResultSink
+
+
+class TestCheckpoint(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            cls.phase_1 = pickle.load(file)
+        with open('multiroom_model_tests/run_180_to_360.pickle', 'rb') as file:
+            cls.phase_2 = pickle.load(file)
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def run_state(self, scheduler, start, length, room_results):
+        return {"n_rooms": len(room_results),
+                "splitting": "lie",
+                "transport_method": "euler",
+                "start": start,
+                "length": length,
+                "room_states": Checkpointer.room_states(room_results),
+                "columns": room_results[0].columns,
+                "scheduler": scheduler}
+
+    def test_write_and_load(self):
+        scheduler = FixedIntervalScheduler(180.0)
+        scheduler.reset(0.0, 720.0)
+        probe = TransportProbe(lambda t: np.zeros((3, 3)), [1.0, 1.0])
+        scheduler.next_interval(0.0, probe)
+
+        checkpoint = Checkpointer(self.folder.name, every_intervals=1)
+        checkpoint.start()
+
+        results = MemoryResultSink(2)
+        results.append([self.phase_1, self.phase_1*2])
+        checkpoint.write(self.run_state(scheduler, 180.0, 180.0, [self.phase_1, self.phase_1*2]), results)
+        scheduler.next_interval(180.0, probe)
+        results.append([self.phase_2, self.phase_2*2])
+        checkpoint.write(self.run_state(scheduler, 360.0, 180.0, [self.phase_2, self.phase_2*2]), results)
+
+        state = Checkpointer(self.folder.name, every_intervals=1).load()
+
+        # The results are read back in full, and match the originals including their types
+        self.assertEqual(len(state["sink_info"]["chunks"]), 2)
+        for loaded, original in zip(state["sink"].results(), results.results()):
+            self.assertTrue(loaded.equals(original))
+            self.assertTrue(loaded.dtypes.equals(original.dtypes))
+
+        # The state of the rooms at the start of the next interval
+        self.assertEqual(state["start"], 360.0)
+        initial_condition = Checkpointer.initial_condition(state["room_states"], state["columns"], state["start"])
+        self.assertEqual(list(initial_condition[1].index), [360.0])
+        np.testing.assert_array_equal(initial_condition[1].to_numpy(dtype=float),
+                                      (self.phase_2*2).iloc[[-1], :].to_numpy(dtype=float))
+
+        # The scheduler carries on from where it was
+        self.assertEqual(state["scheduler"].next_interval(360.0, probe), 180.0)
+        self.assertEqual(state["scheduler"].next_interval(540.0, probe), 180.0)
+        self.assertIsNone(state["scheduler"].next_interval(720.0, probe))
+
+    def test_only_new_rows_are_written(self):
+        checkpoint = Checkpointer(self.folder.name, every_intervals=1)
+        checkpoint.start()
+        results = MemoryResultSink(1)
+        results.append([self.phase_1])
+        checkpoint.write(self.run_state(None, 180.0, 180.0, [self.phase_1]), results)
+        results.append([self.phase_2])
+        checkpoint.write(self.run_state(None, 360.0, 180.0, [self.phase_2]), results)
+
+        state = checkpoint.load()
+        with open(os.path.join(self.folder.name, state["sink_info"]["chunks"][1]), "rb") as file:
+            times, values = pickle.load(file)
+
+        self.assertEqual(list(times), [180.0, 240.0, 300.0, 360.0])
+        self.assertEqual(values.shape, (1, 4, len(self.phase_1.columns)))
+
+    def test_due(self):
+        checkpoint = Checkpointer(self.folder.name, every_intervals=3)
+        checkpoint.start()
+        self.assertEqual([checkpoint.interval_done() for _ in range(3)], [False, False, True])
+
+        checkpoint = Checkpointer(self.folder.name, every_seconds=0.0)
+        checkpoint.start()
+        self.assertTrue(checkpoint.interval_done())
+
+        with self.assertRaises(ValueError):
+            Checkpointer(self.folder.name)
+
+    def test_missing_checkpoint_raises(self):
+        checkpoint = Checkpointer(os.path.join(self.folder.name, "none"), every_intervals=1)
+        self.assertFalse(checkpoint.exists())
+        with self.assertRaises(Exception):
+            checkpoint.load()
+
+    def test_write_atomically(self):
+        path = os.path.join(self.folder.name, "data.pkl")
+        write_atomically(path, {"a": 1})
+        write_atomically(path, {"a": 2})
+
+        with open(path, "rb") as file:
+            self.assertEqual(pickle.load(file), {"a": 2})
+        self.assertEqual(os.listdir(self.folder.name), ["data.pkl"])
+
+    def test_new_run_does_not_overwrite_earlier_results(self):
+        checkpoint = Checkpointer(self.folder.name, every_intervals=1)
+
+        # Each run has its own sink
+        for _ in range(2):
+            results = MemoryResultSink(1)
+            results.append([self.phase_1])
+            checkpoint.start()
+            checkpoint.write(self.run_state(None, 180.0, 180.0, [self.phase_1]), results)
+
+        self.assertEqual(len([f for f in os.listdir(self.folder.name) if f.startswith("results_")]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.linalg import expm
+
+from multiroom_model.coupled_engine import CoupledBuildingSolver, LinearRoomODESystem
+from multiroom_model.transport_engine import transport_generator
+
+
+class TestCoupledEngine(unittest.TestCase):
+
+    def setUp(self):
+        # Three rooms in a corridor, room 0 and room 2 have windows
+        self.volumes = [12.5, 30.0, 20.0]
+        self.flux = np.array([[0.0, 0.02, 0.0, 0.01],
+                              [0.04, 0.0, 0.03, 0.0],
+                              [0.0, 0.02, 0.0, 0.01],
+                              [0.015, 0.0, 0.02, 0.0]])
+
+        # A and B are transported, A decays into B, and C is a product which stays in the room
+        self.species = ['A', 'B', 'C']
+        self.rate_matrix = np.array([[-1.0e-3, 0.0, 0.0],
+                                     [1.0e-3, -2.0e-4, 0.0],
+                                     [0.0, 2.0e-4, 0.0]])
+        self.outdoor = np.array([1.0e9, 5.0e8, 0.0])
+        self.initial_states = [np.array([1.0e10, 0.0, 0.0]),
+                               np.array([0.0, 1.0e10, 0.0]),
+                               np.array([2.0e9, 2.0e9, 1.0e9])]
+
+    def rooms(self, rate_matrix=None):
+        rate_matrix = self.rate_matrix if rate_matrix is None else rate_matrix
+        return [LinearRoomODESystem(self.species, rate_matrix, outdoor=self.outdoor) for _ in self.volumes]
+
+    def solver(self, rooms, flux=None, **kwargs):
+        flux = self.flux if flux is None else flux
+        return CoupledBuildingSolver(rooms, self.volumes, ['A', 'B'], lambda t: flux, rtol=1.0e-10, atol=1.0e-3, **kwargs)
+
+    def exact_solution(self, t):
+        """
+        The whole building is linear, so its exact solution is a matrix exponential
+        of the system extended with the (constant) outdoor concentrations
+        """
+        n, s = len(self.volumes), len(self.species)
+        generator = transport_generator(self.flux, self.volumes)
+        transported = np.diag([1.0, 1.0, 0.0])
+
+        system = np.zeros((n*s + s, n*s + s))
+        system[:n*s, :n*s] = np.kron(np.identity(n), self.rate_matrix) + np.kron(generator[:, :n], transported)
+        system[:n*s, n*s:] = np.vstack([generator[i, n+i]*transported for i in range(n)])
+        y = np.concatenate(self.initial_states + [self.outdoor])
+        return (expm(system*t) @ y)[:n*s].reshape(n, s)
+
+    def test_matches_exact_solution(self):
+        times, states = self.solver(self.rooms()).solve(0.0, 3600.0, self.initial_states, output_times=[0.0, 600.0, 3600.0])
+
+        assert_allclose(states[:, 0, :], np.stack(self.initial_states))
+        assert_allclose(states[:, 1, :], self.exact_solution(600.0), rtol=1.0e-6, atol=1.0)
+        assert_allclose(states[:, 2, :], self.exact_solution(3600.0), rtol=1.0e-6, atol=1.0)
+
+    def strang_split_solution(self, t, t_interval):
+        """
+        The operator split solution, with the chemistry and the transport each solved exactly
+        """
+        n = len(self.volumes)
+        generator = transport_generator(self.flux, self.volumes)
+        extended_generator = np.zeros((2*n, 2*n))
+        extended_generator[:n, :] = generator
+
+        chemistry = expm(self.rate_matrix*t_interval)
+        half_transport = expm(extended_generator*t_interval/2)[:n, :]
+        outdoor = np.tile(self.outdoor, (n, 1))
+
+        state = np.stack(self.initial_states)
+        for _ in range(int(round(t/t_interval))):
+            state[:, :2] = half_transport @ np.vstack([state, outdoor])[:, :2]
+            state = state @ chemistry.T
+            state[:, :2] = half_transport @ np.vstack([state, outdoor])[:, :2]
+        return state
+
+    def test_operator_splitting_converges_to_coupled(self):
+        _, states = self.solver(self.rooms()).solve(0.0, 3600.0, self.initial_states)
+        coupled = states[:, -1, :]
+
+        errors = [np.abs(self.strang_split_solution(3600.0, t_interval) - coupled).max() for t_interval in (150.0, 75.0)]
+
+        # second order, halving the interval quarters the error
+        self.assertAlmostEqual(errors[0]/errors[1], 4.0, delta=0.5)
+
+    def test_jacobian_matches_finite_differences(self):
+        solver = self.solver(self.rooms())
+        solver._set_segment(0.0)
+        y = np.linspace(1.0e3, 9.0e3, 9)
+
+        jacobian = solver.jacobian(0.0, y).toarray()
+        finite_differences = np.stack([(solver.rhs(0.0, y + e) - solver.rhs(0.0, y - e))/2
+                                       for e in np.identity(y.size)], axis=1)
+
+        assert_allclose(jacobian, finite_differences, rtol=1.0e-6, atol=1.0e-10)
+
+    def test_untransported_species_stay_in_their_room(self):
+        solver = self.solver(self.rooms(np.zeros((3, 3))))
+        _, states = solver.solve(0.0, 3600.0, self.initial_states)
+
+        assert_allclose(states[:, -1, 2], [0.0, 0.0, 1.0e9])
+
+    def test_conserves_mass_without_outdoor_exchange(self):
+        indoor_flux = self.flux.copy()
+        indoor_flux[0, :] = 0.0
+        indoor_flux[:, 0] = 0.0
+        solver = self.solver(self.rooms(np.zeros((3, 3))), flux=indoor_flux)
+
+        _, states = solver.solve(0.0, 1.0e5, self.initial_states)
+
+        volumes = np.array(self.volumes)[:, np.newaxis]
+        assert_allclose((volumes*states[:, -1, :]).sum(axis=0), (volumes*np.stack(self.initial_states)).sum(axis=0), rtol=1.0e-8)
+
+    def test_breakpoints(self):
+        # The windows close at 600s, after which nothing comes in from the outside
+        closed = self.flux.copy()
+        closed[0, :] = 0.0
+        closed[:, 0] = 0.0
+        solver = CoupledBuildingSolver(self.rooms(np.zeros((3, 3))), self.volumes, ['A', 'B'],
+                                       lambda t: self.flux if t < 600.0 else closed, rtol=1.0e-10, atol=1.0e-3)
+
+        times, states = solver.solve(0.0, 1200.0, self.initial_states, output_times=[600.0, 900.0, 1200.0], breakpoints=[600.0])
+
+        volumes = np.array(self.volumes)[:, np.newaxis, np.newaxis]
+        mass = (volumes*states).sum(axis=0)
+        assert_allclose(mass[1], mass[0], rtol=1.0e-8)
+        assert_allclose(mass[2], mass[0], rtol=1.0e-8)
+
+    def test_to_dataframes(self):
+        solver = self.solver(self.rooms())
+        times, states = solver.solve(0.0, 60.0, self.initial_states, output_times=[0.0, 30.0, 60.0])
+
+        result = solver.to_dataframes(times, states)
+
+        self.assertEqual(len(result), 3)
+        self.assertEqual(list(result[1].columns), self.species)
+        self.assertEqual(list(result[1].index), [0.0, 30.0, 60.0])
+
+    def test_mismatched_species_raise(self):
+        rooms = self.rooms()
+        rooms[1] = LinearRoomODESystem(['A', 'B', 'D'], self.rate_matrix)
+        with self.assertRaises(Exception):
+            self.solver(rooms)
+
+    def test_unknown_transported_species_raise(self):
+        with self.assertRaises(Exception):
+            CoupledBuildingSolver(self.rooms(), self.volumes, ['A', 'X'], lambda t: self.flux)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import importlib.util
+import os
+import unittest
+
+import pandas as pd
+
+from multiroom_model.executors import Executor, SerialExecutor, make_executor
+
+
+def scaled(frame, factor):
+    return frame*factor, os.getpid()
+
+
+class TestExecutors(unittest.TestCase):
+    def check_backend(self, backend):
+        frames = [pd.DataFrame({"O3": [1.0, 2.0]}, index=[0.0, 1.0]) for _ in range(3)]
+        with make_executor(backend, 2) as executor:
+            results = executor.starmap(scaled, [(f, i) for i, f in enumerate(frames)])
+            # The executor can be used again
+            again = executor.starmap(scaled, [(frames[0], 5)])
+
+        # The results come back in the order of the arguments
+        for i, (result, _) in enumerate(results):
+            self.assertTrue(result.equals(frames[i]*i))
+        self.assertTrue(again[0][0].equals(frames[0]*5))
+
+        in_this_process = set(pid for _, pid in results) == {os.getpid()}
+        self.assertEqual(in_this_process, executor.shares_memory)
+
+    def test_serial(self):
+        self.check_backend("serial")
+
+    def test_thread(self):
+        self.check_backend("thread")
+
+    def test_process(self):
+        self.check_backend("process")
+
+    @unittest.skipUnless(importlib.util.find_spec("mpi4py"), "mpi4py is not installed")
+    def test_mpi(self):
+        self.check_backend("mpi")
+
+    def test_pool_started_when_used(self):
+        executor = make_executor("process", 2)
+        # Nothing is started until the first call, nor after the executor is closed
+        self.assertIsNone(executor._pool)
+        executor.starmap(scaled, [(1.0, 2.0)])
+        executor.close()
+        self.assertIsNone(executor._pool)
+
+        # A closed executor starts a new pool if it is used again
+        self.assertEqual(executor.starmap(scaled, [(1.0, 3.0)])[0][0], 3.0)
+        executor.close()
+
+    def test_started_executor_is_returned(self):
+        executor = SerialExecutor()
+        self.assertIs(make_executor(executor), executor)
+        self.assertIsInstance(make_executor("serial"), Executor)
+
+    def test_unknown_backend_raises(self):
+        with self.assertRaises(ValueError):
+            make_executor("gpu")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from multiroom_model.checkpoint import Checkpointer
+from multiroom_model.exposure_metrics import ExposureMetrics, who_2021_thresholds
+from multiroom_model.result_sink import MemoryResultSink, TeeResultSink
+
+
+def interval(times, o3, adults, children=None):
+    children = [0]*len(times) if children is None else children
+    return pd.DataFrame({"O3": o3, "NO2": [1.0]*len(times), "adults": adults, "children": children},
+                        index=pd.Index(times, dtype=float))
+
+
+class TestExposureMetrics(unittest.TestCase):
+
+    def test_metrics_of_one_room(self):
+        metrics = ExposureMetrics(1, ["O3", "NO2"], thresholds={"O3": [15.0]})
+
+        # O3 rises from 0 to 20 over 20s then stays, 2 adults are in the room from 10s to 30s
+        metrics.append([interval([0.0, 10.0, 20.0], [0.0, 10.0, 20.0], [0, 2, 2])])
+        metrics.append([interval([20.0, 30.0, 40.0], [20.0, 20.0, 20.0], [2, 0, 0])])
+
+        result, = metrics.results()
+
+        self.assertEqual(result["occupancy", "duration"], 40.0)
+        self.assertEqual(result["occupancy", "time_adults"], 20.0)
+        self.assertEqual(result["occupancy", "mean_adults"], 1.0)
+        self.assertEqual(result["occupancy", "time_children"], 0.0)
+
+        self.assertEqual(result["O3", "mean"], (200.0+400.0)/40.0)
+        self.assertEqual(result["O3", "max"], 20.0)
+        self.assertEqual(result["O3", "mean_adults"], (150.0+200.0)/20.0)
+        self.assertEqual(result["O3", "max_adults"], 20.0)
+        self.assertEqual(result["O3", "exposure_adults"], 2*(150.0+200.0))
+        self.assertTrue(np.isnan(result["O3", "mean_children"]))
+        self.assertTrue(np.isnan(result["O3", "max_children"]))
+
+        # Above 15 from 15s onwards
+        self.assertEqual(result["O3", "time_above_15"], 25.0)
+        self.assertEqual(result["O3", "time_above_15_adults"], 15.0)
+        self.assertNotIn(("NO2", "time_above_15"), result.index)
+        self.assertEqual(result["NO2", "mean"], 1.0)
+
+    def test_replace_last_row(self):
+        metrics = ExposureMetrics(2, ["O3"])
+        metrics.append([interval([0.0, 10.0], [0.0, 10.0], [1, 1]), interval([0.0, 10.0], [0.0, 0.0], [0, 0])])
+        metrics.replace_last_row([interval([10.0], [30.0], [1]), interval([10.0], [10.0], [0])])
+
+        room_1, room_2 = metrics.results()
+        self.assertEqual(room_1["O3", "mean"], 15.0)
+        self.assertEqual(room_1["O3", "max"], 30.0)
+        self.assertEqual(room_2["O3", "mean"], 5.0)
+
+        with self.assertRaises(Exception):
+            metrics.replace_last_row([interval([20.0], [0.0], [0]), interval([20.0], [0.0], [0])])
+
+    def test_matches_the_time_series(self):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            phase_1 = pickle.load(file)
+        with open('multiroom_model_tests/run_180_to_360.pickle', 'rb') as file:
+            phase_2 = pickle.load(file)
+
+        species = ["O3", "NO2", "OH"]
+        metrics = ExposureMetrics(1, species)
+        metrics.append([phase_1])
+        metrics.append([phase_2])
+        result, = metrics.results()
+
+        for s in species:
+            integral = 0.0
+            for p in (phase_1, phase_2):
+                values, times = p[s].to_numpy(dtype=float), p.index.to_numpy(dtype=float)
+                integral += ((values[1:]+values[:-1])/2*np.diff(times)).sum()
+            self.assertAlmostEqual(result[s, "mean"], integral/360.0, delta=1e-12*abs(integral))
+            self.assertEqual(result[s, "max"], max(phase_1[s].max(), phase_2[s].max()))
+
+    def test_checkpoint_with_stored_results(self):
+        with tempfile.TemporaryDirectory() as folder:
+            checkpoint = Checkpointer(folder, every_intervals=1)
+            checkpoint.start()
+            sink = TeeResultSink([MemoryResultSink(1), ExposureMetrics(1, ["O3"])])
+            sink.append([interval([0.0, 10.0], [0.0, 10.0], [0, 0])])
+            checkpoint.write({}, sink)
+            sink.append([interval([10.0, 20.0], [10.0, 10.0], [0, 0])])
+
+            restored = Checkpointer(folder, every_intervals=1).load()["sink"]
+            restored.append([interval([10.0, 20.0], [10.0, 10.0], [0, 0])])
+
+            for (series, metrics), (restored_series, restored_metrics) in zip(sink.results(), restored.results()):
+                self.assertTrue(series.equals(restored_series))
+                self.assertTrue(metrics.equals(restored_metrics))
+                self.assertEqual(metrics["O3", "mean"], 7.5)
+            self.assertTrue(any(f.startswith("results_") for f in os.listdir(folder)))
+
+    def test_invalid_thresholds_and_columns(self):
+        with self.assertRaises(ValueError):
+            ExposureMetrics(1, ["O3"], thresholds={"NO2": [1.0]})
+        with self.assertRaises(Exception):
+            ExposureMetrics(1, ["HONO"]).append([interval([0.0], [0.0], [0])])
+
+    def test_who_thresholds(self):
+        thresholds = who_2021_thresholds()
+        self.assertEqual(thresholds["O3"], [60.0*2.46e10/2, 100.0*2.46e10/2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import pickle
+import tempfile
+import unittest
+
+import pandas as pd
+
+import MBM_extractor
+from multiroom_model.result_sink import MemoryResultSink
+from multiroom_model.simulation_result import SimulationResult
+
+
+class TestExtractor(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            phase_1 = pickle.load(file)
+        with open('multiroom_model_tests/run_180_to_360.pickle', 'rb') as file:
+            phase_2 = pickle.load(file)
+        sink = MemoryResultSink(2)
+        sink.append([phase_1, phase_1*2])
+        sink.append([phase_2, phase_2*2])
+        cls.results = dict(zip(["room1", "room2"], sink.results()))
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.output_dir = self.folder.name
+
+    def read_csv(self, name):
+        return pd.read_csv(os.path.join(self.output_dir, "extracted_outputs", name), index_col="Time")
+
+    def check_extracted(self):
+        room2 = self.read_csv("room2.csv")
+        self.assertEqual(list(room2.columns), ["O3", "NO", "adults"])
+        self.assertEqual(list(room2.index), [120.0, 240.0, 360.0])
+        self.assertAlmostEqual(room2.loc[360.0, "O3"]/self.results["room2"].loc[360.0, "O3"], 1.0, places=12)
+
+        outdoor = self.read_csv("room2_outdoor.csv")
+        self.assertEqual(list(outdoor.columns), ["O3OUT", "NOOUT"])
+
+    def arguments(self):
+        return [self.output_dir, "--vars", "O3", "NO", "adults", "NOT_A_VARIABLE",
+                "--t-start", "100", "--output-interval", "120", "--processes", "2"]
+
+    def test_extract_from_result_folder(self):
+        SimulationResult.write(os.path.join(self.output_dir, "mbm_results"), self.results)
+        MBM_extractor.main(self.arguments())
+        self.check_extracted()
+
+    def test_room_process_returns_only_paths(self):
+        SimulationResult.write(os.path.join(self.output_dir, "mbm_results"), self.results)
+        folder = os.path.join(self.output_dir, "extracted_outputs")
+        os.makedirs(folder)
+
+        paths = MBM_extractor.extract_result_room("room2", MBM_extractor.parse_arguments(self.arguments()), folder)
+        self.assertEqual([os.path.basename(p) for p in paths], ["room2.csv", "room2_outdoor.csv"])
+        self.check_extracted()
+
+    def test_extract_from_pickle(self):
+        with open(os.path.join(self.output_dir, "mbm_results.pkl"), "wb") as file:
+            pickle.dump(self.results, file)
+        MBM_extractor.main(self.arguments())
+        self.check_extracted()
+
+    def test_compressed_csv(self):
+        SimulationResult.write(os.path.join(self.output_dir, "mbm_results"), self.results)
+        MBM_extractor.main([self.output_dir, "--vars", "O3", "--compress"])
+        self.assertEqual(len(self.read_csv("room1.csv.gz")), len(self.results["room1"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import unittest
+import numpy as np
+
+from multiroom_model.interval_scheduler import FixedIntervalScheduler, AdaptiveIntervalScheduler, TransportProbe
+
+
+def run_schedule(scheduler, t0, t_final, probe):
+    """
+    Ask the scheduler for intervals as a simulation would, returns the (start, length) of each
+    """
+    scheduler.reset(t0, t_final)
+    return run_schedule_from_reset(scheduler, t0, probe)
+
+
+def run_schedule_from_reset(scheduler, t0, probe):
+    """
+    Ask a scheduler which has already been reset for its intervals
+    """
+    intervals = []
+    time, length = t0, scheduler.next_interval(t0, probe)
+    while length is not None:
+        intervals.append((time, length))
+        time = time+length
+        length = scheduler.next_interval(time, probe)
+    return intervals
+
+
+class TestIntervalScheduler(unittest.TestCase):
+
+    def setUp(self):
+        # One room with a window, the wind is calm until 3600s, gusts until 4200s, then is calm again
+        self.volumes = [20.0]
+
+        def flux_matrix(time):
+            speed = 0.5 if (time < 3600 or time > 4200) else 0.5 + 8.0*np.sin(np.pi*(time-3600)/600)**2
+            return np.array([[0.0, 0.01*speed], [0.01*speed, 0.0]])
+
+        self.flux_matrix = flux_matrix
+
+    def test_fixed_intervals(self):
+        probe = TransportProbe(self.flux_matrix, self.volumes)
+
+        self.assertEqual(run_schedule(FixedIntervalScheduler(3.0), 0.0, 25.0, probe),
+                         [(float(t), 3.0) for t in range(0, 24, 3)] + [(24.0, 1.0)])
+        self.assertEqual(run_schedule(FixedIntervalScheduler(3.0), 10.0, 16.0, probe), [(10.0, 3.0), (13.0, 3.0)])
+
+        # The first interval is always a whole interval
+        self.assertEqual(run_schedule(FixedIntervalScheduler(3.0), 0.0, 2.0, probe), [(0.0, 3.0)])
+
+    def test_fixed_intervals_must_be_followed(self):
+        probe = TransportProbe(self.flux_matrix, self.volumes)
+        scheduler = FixedIntervalScheduler(3.0)
+        scheduler.reset(0.0, 25.0)
+        scheduler.next_interval(0.0, probe)
+        with self.assertRaises(Exception):
+            scheduler.next_interval(4.0, probe)
+
+    def test_invalid_bounds_raise(self):
+        with self.assertRaises(ValueError):
+            FixedIntervalScheduler(0.0)
+        with self.assertRaises(ValueError):
+            AdaptiveIntervalScheduler(min_interval=60.0, max_interval=30.0)
+
+    def test_adaptive_follows_the_gust(self):
+        probe = TransportProbe(self.flux_matrix, self.volumes)
+        scheduler = AdaptiveIntervalScheduler(min_interval=10.0, max_interval=900.0, flux_tolerance=0.2)
+
+        intervals = run_schedule(scheduler, 0.0, 7200.0, probe)
+        starts = np.array([s for s, _ in intervals])
+        lengths = np.array([l for _, l in intervals])
+
+        # Covers the run exactly, within the bounds
+        self.assertEqual(starts[0], 0.0)
+        self.assertAlmostEqual(starts[-1]+lengths[-1], 7200.0)
+        self.assertTrue((lengths >= 10.0).all())
+        self.assertTrue((lengths <= 900.0).all())
+
+        # Long intervals in the calm, short ones in the gust
+        in_gust = (starts >= 3600) & (starts < 4200)
+        self.assertEqual(lengths[starts < 3000].max(), 900.0)
+        self.assertLess(lengths[in_gust].max(), 100.0)
+        self.assertLess(len(intervals), 7200/100)
+
+        # The fluxes change by no more than the tolerance over any interval longer than the minimum
+        for s, l in intervals:
+            if l > 10.0:
+                self.assertLessEqual(scheduler.flux_change(probe, s, l), 0.2)
+
+    def test_adaptive_limits_the_transport_update(self):
+        probe = TransportProbe(self.flux_matrix, self.volumes)
+        probe.set_state(lambda: np.array([[1.0e9], [0.0]]))
+        scheduler = AdaptiveIntervalScheduler(min_interval=1.0, max_interval=900.0, update_tolerance=0.1,
+                                              initial_interval=900.0)
+
+        scheduler.reset(0.0, 1800.0)
+        length = scheduler.next_interval(0.0, probe)
+
+        # The room empties at 0.005/20 per second, so a tenth of it goes in 400s
+        self.assertAlmostEqual(length, 0.1/(0.005/20.0))
+        self.assertEqual(scheduler.step_report()["limited_by"].tolist(), ["update"])
+
+    def test_adaptive_granularity(self):
+        probe = TransportProbe(self.flux_matrix, self.volumes)
+        probe.set_state(lambda: np.array([[1.0e9], [0.0]]))
+        scheduler = AdaptiveIntervalScheduler(min_interval=1.0, max_interval=900.0, initial_interval=900.0, granularity=60.0)
+
+        intervals = run_schedule(scheduler, 0.0, 7230.0, probe)
+
+        for _, length in intervals[:-1]:
+            self.assertEqual(length % 60.0, 0.0)
+        self.assertEqual(sum(l for _, l in intervals), 7230.0)
+
+    def test_adaptive_does_not_leave_a_short_final_interval(self):
+        probe = TransportProbe(lambda t: np.zeros((2, 2)), self.volumes)
+        scheduler = AdaptiveIntervalScheduler(min_interval=10.0, max_interval=100.0, initial_interval=100.0)
+
+        intervals = run_schedule(scheduler, 0.0, 205.0, probe)
+
+        self.assertEqual(intervals, [(0.0, 100.0), (100.0, 105.0)])
+
+    def test_fixed_intervals_split_at_breakpoints(self):
+        probe = TransportProbe(self.flux_matrix, self.volumes)
+        scheduler = FixedIntervalScheduler(3.0)
+        scheduler.reset(0.0, 10.0, breakpoints=[0.0, 4.0, 6.0, 7.5, 12.0])
+
+        intervals = run_schedule_from_reset(scheduler, 0.0, probe)
+
+        self.assertEqual(intervals, [(0.0, 3.0), (3.0, 1.0), (4.0, 2.0), (6.0, 1.5), (7.5, 1.5), (9.0, 1.0)])
+        self.assertEqual(scheduler.step_report()["limited_by"].tolist(),
+                         ["fixed", "breakpoint", "fixed", "breakpoint", "fixed", "end"])
+        self.assertEqual(scheduler.planned_intervals(0.0, 10.0, [4.0, 6.0, 7.5]), intervals)
+
+    def test_fixed_intervals_follow_rounded_times(self):
+        probe = TransportProbe(self.flux_matrix, self.volumes)
+        scheduler = FixedIntervalScheduler(0.3)
+        scheduler.reset(0.0, 1.0, breakpoints=[0.1])
+
+        intervals = run_schedule_from_reset(scheduler, 0.0, probe)
+
+        self.assertEqual(len(intervals), 5)
+        self.assertAlmostEqual(intervals[-1][0]+intervals[-1][1], 1.0)
+
+    def test_adaptive_intervals_end_at_breakpoints(self):
+        probe = TransportProbe(lambda t: np.zeros((2, 2)), self.volumes)
+        scheduler = AdaptiveIntervalScheduler(min_interval=10.0, max_interval=100.0, initial_interval=100.0)
+        scheduler.reset(0.0, 400.0, breakpoints=[150.0, 205.0])
+
+        intervals = run_schedule_from_reset(scheduler, 0.0, probe)
+
+        # The interval before 205 would leave less than the minimum, so it reaches the breakpoint instead
+        self.assertEqual(intervals, [(0.0, 100.0), (100.0, 50.0), (150.0, 55.0), (205.0, 100.0), (305.0, 95.0)])
+        self.assertEqual(scheduler.step_report()["limited_by"].tolist(),
+                         ["initial", "breakpoint", "breakpoint", "max", "end"])
+
+    def test_step_report(self):
+        probe = TransportProbe(self.flux_matrix, self.volumes)
+        scheduler = FixedIntervalScheduler(3.0)
+        run_schedule(scheduler, 0.0, 7.0, probe)
+
+        report = scheduler.step_report()
+
+        self.assertEqual(list(report.columns), ["start", "length", "limited_by"])
+        self.assertEqual(report["start"].tolist(), [0.0, 3.0, 6.0])
+        self.assertEqual(report["length"].tolist(), [3.0, 3.0, 1.0])
+        self.assertEqual(report["limited_by"].tolist(), ["fixed", "fixed", "end"])
+
+    def test_probe_gathers_the_state_only_when_asked(self):
+        calls = []
+        probe = TransportProbe(self.flux_matrix, self.volumes)
+        probe.set_state(lambda: calls.append(1) or np.array([[1.0], [0.0]]))
+
+        run_schedule(FixedIntervalScheduler(3.0), 0.0, 9.0, probe)
+        self.assertEqual(calls, [])
+
+        probe.relative_transport_rate(0.0, 0.0)
+        probe.relative_transport_rate(0.0, 0.0)
+        self.assertEqual(calls, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
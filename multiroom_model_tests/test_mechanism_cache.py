@@ -0,0 +1,117 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import time
+import tempfile
+import unittest
+import warnings
+
+from multiroom_model.mechanism_cache import MechanismCache, main
+
+
+class FakeMainClass:
+    def __init__(self, **arguments):
+        self.arguments = arguments
+
+
+class TestMechanismCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.cache = MechanismCache(os.path.join(self.folder.name, "cache"))
+
+        self.fac = os.path.join(self.folder.name, "mechanism.fac")
+        with open(self.fac, "w") as file:
+            file.write("% 1.0e-12 : NO + O3 = NO2 ;\n")
+
+        self.generated = 0
+
+    def generate(self, **arguments):
+        self.generated += 1
+        return FakeMainClass(**arguments)
+
+    def arguments(self, **changes):
+        arguments = dict(filename=self.fac, INCHEM_additional=False, particles=False, custom=False,
+                         custom_filename=None, constrained_file=None, volume=50.0,
+                         surface_area={"WOOD": 1.0, "PAINT": 2.0}, output_folder="run_1")
+        arguments.update(changes)
+        return arguments
+
+    def test_generated_once(self):
+        first = self.cache.get(self.arguments(), self.generate)
+        # Another run writing to another output folder uses the same entry
+        second = self.cache.get(self.arguments(output_folder="run_2"), self.generate)
+
+        self.assertEqual(self.generated, 1)
+        self.assertEqual(second.arguments, first.arguments)
+        self.assertEqual(len(self.cache.entries()), 1)
+
+    def test_key_follows_content(self):
+        key = self.cache.key(self.arguments())
+        self.assertNotEqual(key, self.cache.key(self.arguments(INCHEM_additional=True)))
+        self.assertNotEqual(key, self.cache.key(self.arguments(volume=60.0)))
+        self.assertEqual(key, self.cache.key(self.arguments(surface_area={"PAINT": 2.0, "WOOD": 1.0})))
+
+        # The same file under another name has the same key, an edited file does not
+        copy = os.path.join(self.folder.name, "copy.fac")
+        with open(self.fac) as source, open(copy, "w") as file:
+            file.write(source.read())
+        self.assertEqual(key, self.cache.key(self.arguments(filename=copy)))
+        with open(self.fac, "a") as file:
+            file.write("% 2.0e-12 : NO2 + O3 = NO3 ;\n")
+        self.assertNotEqual(key, self.cache.key(self.arguments()))
+
+    def test_unreadable_entry_is_regenerated(self):
+        self.cache.get(self.arguments(), self.generate)
+        key = self.cache.key(self.arguments())
+        with open(os.path.join(self.cache.folder, f"{key}.pkl"), "wb") as file:
+            file.write(b"not a pickle")
+
+        self.cache.get(self.arguments(), self.generate)
+        self.assertEqual(self.generated, 2)
+
+    def test_unpicklable_main_class_is_not_cached(self):
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter("always")
+            main_class = self.cache.get(self.arguments(), lambda **arguments: (lambda: None))
+        self.assertTrue(callable(main_class))
+        self.assertEqual(len(self.cache.entries()), 0)
+
+    def test_evict(self):
+        for volume in (1.0, 2.0, 3.0):
+            self.cache.get(self.arguments(volume=volume), self.generate)
+        keys = [self.cache.key(self.arguments(volume=volume)) for volume in (1.0, 2.0, 3.0)]
+
+        # The first entry was last used long ago
+        old = time.time() - 10*86400
+        os.utime(os.path.join(self.cache.folder, f"{keys[0]}.pkl"), (old, old))
+        self.assertEqual(self.cache.evict(older_than_days=5), [keys[0]])
+
+        # Using an entry keeps it when the cache is made smaller
+        os.utime(os.path.join(self.cache.folder, f"{keys[1]}.pkl"), (old, old))
+        self.cache.get(self.arguments(volume=2.0), self.generate)
+        self.assertEqual(self.cache.evict(max_megabytes=self.cache.entries()["megabytes"].max()), [keys[2]])
+        self.assertEqual(list(self.cache.entries()["key"]), [keys[1]])
+
+        main([self.cache.folder, "clear"])
+        self.assertEqual(len(self.cache.entries()), 0)
+        self.assertEqual(os.listdir(self.cache.folder), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
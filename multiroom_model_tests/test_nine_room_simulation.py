@@ -56,6 +56,7 @@ class TestTwoRoomSimulation(unittest.TestCase):
             global_settings=self.global_settings,
             rooms=rooms,
             apertures=[])
+        self.addCleanup(simulation.close)
 
         initial_conditions = dict([(r, 'initial_concentrations.txt') for r in rooms])
 
@@ -90,6 +91,7 @@ class TestTwoRoomSimulation(unittest.TestCase):
             global_settings=self.global_settings,
             rooms=rooms,
             apertures=[])
+        self.addCleanup(simulation.close)
 
         initial_conditions = dict([(r, 'initial_concentrations.txt') for r in rooms])
 
@@ -0,0 +1,115 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import pickle
+import unittest
+
+import numpy as np
+
+from multiroom_model.output_spec import OutputSpec, OutputSpecSink
+from multiroom_model.result_sink import MemoryResultSink
+
+
+class TestOutputSpec(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            cls.phase_1 = pickle.load(file)
+        with open('multiroom_model_tests/run_180_to_360.pickle', 'rb') as file:
+            cls.phase_2 = pickle.load(file)
+
+    def test_species_and_pattern(self):
+        spec = OutputSpec(species=["O3", "NO2", "NOT_A_SPECIES"], pattern=r"J\d+")
+        columns = self.phase_1.columns[spec.column_positions(self.phase_1.columns)]
+
+        self.assertIn("O3", columns)
+        self.assertIn("O3OUT", columns)
+        self.assertIn("NO2OUT", columns)
+        self.assertIn("J4", columns)
+        self.assertNotIn("NO", columns)
+        self.assertTrue(all(c in ("O3", "NO2", "O3OUT", "NO2OUT") or c.startswith("J") for c in columns))
+
+        # The columns keep the order of the results
+        positions = spec.column_positions(self.phase_1.columns)
+        self.assertTrue((np.diff(positions) > 0).all())
+
+        spec = OutputSpec(species=["O3"], include_outdoor=False)
+        self.assertEqual(list(self.phase_1.columns[spec.column_positions(self.phase_1.columns)]), ["O3"])
+
+    def test_selecting_nothing_raises(self):
+        with self.assertRaises(Exception):
+            OutputSpec(species=["NOT_A_SPECIES"]).column_positions(self.phase_1.columns)
+        with self.assertRaises(ValueError):
+            OutputSpec(output_interval=0.0)
+
+    def test_output_interval(self):
+        spec = OutputSpec(output_interval=120.0)
+        times = np.array([0.0, 60.0, 120.0, 180.0, 240.0, 240.0+1e-10, 300.0])
+        self.assertEqual(list(spec.row_mask(times, 0.0)), [True, False, True, False, True, True, False])
+        self.assertEqual(list(spec.row_mask(times, 60.0)), [False, True, False, True, False, False, True])
+
+    def test_sink_stores_the_selection(self):
+        spec = OutputSpec(species=["O3", "NO"], output_interval=120.0)
+        sink = OutputSpecSink(MemoryResultSink(2), spec)
+        sink.append([self.phase_1, self.phase_1*2])
+        sink.append([self.phase_2, self.phase_2*2])
+
+        result = sink.results()[1]
+        self.assertEqual(list(result.index), [0.0, 120.0, 240.0, 360.0])
+        self.assertEqual(list(result.columns), [c for c in self.phase_1.columns if c in ("O3", "NO", "O3OUT", "NOOUT")])
+        self.assertTrue(result.loc[[240.0, 360.0], :].equals((self.phase_2*2).loc[[240.0, 360.0], result.columns]))
+        self.assertTrue(result.dtypes.equals((self.phase_1*2)[result.columns].dtypes))
+
+    def test_boundary_row_stored_once(self):
+        # The second phase starts with the row which ended the first (as the intervals of a run do)
+        spec = OutputSpec(species=["O3"], output_interval=60.0)
+        sink = OutputSpecSink(MemoryResultSink(1), spec)
+        sink.append([self.phase_1])
+        sink.append([self.phase_2])
+
+        self.assertEqual(list(sink.results()[0].index), [0.0, 60.0, 120.0, 180.0, 240.0, 300.0, 360.0])
+
+        # The row of the boundary is the state the next interval started from (after the transport)
+        sink = OutputSpecSink(MemoryResultSink(1), spec)
+        sink.append([self.phase_1])
+        sink.append([self.phase_2*2])
+        self.assertEqual(sink.results()[0].loc[180.0, "O3"], (self.phase_2*2).loc[180.0, "O3"])
+        self.assertEqual(sink.results()[0].loc[120.0, "O3"], self.phase_1.loc[120.0, "O3"])
+
+    def test_output_interval_must_be_whole_steps(self):
+        OutputSpec(output_interval=120.0).check_time_step(1.0)
+        OutputSpec(output_interval=0.006).check_time_step(0.002)
+        OutputSpec().check_time_step(0.7)
+        with self.assertRaises(ValueError):
+            OutputSpec(output_interval=2.5).check_time_step(1.0)
+
+    def test_only_stored_rows_are_replaced(self):
+        spec = OutputSpec(species=["O3"], output_interval=120.0)
+        sink = OutputSpecSink(MemoryResultSink(1), spec)
+        sink.append([self.phase_1])
+
+        # 180 was not stored, so nothing changes
+        sink.replace_last_row([self.phase_1*3])
+        self.assertTrue(sink.results()[0].equals(self.phase_1.loc[[0.0, 120.0], ["O3", "O3OUT"]]))
+
+        sink.append([self.phase_2])
+        sink.replace_last_row([self.phase_2*3])
+        self.assertEqual(sink.results()[0].loc[360.0, "O3"], (self.phase_2*3).loc[360.0, "O3"])
+
+
+if __name__ == '__main__':
+    unittest.main()
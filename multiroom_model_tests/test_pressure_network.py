@@ -0,0 +1,153 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import math
+import unittest
+import numpy as np
+
+from multiroom_model.aperture import Aperture, Side
+from multiroom_model.pressure_network import PressureNetwork, NetworkApertureCalculation
+
+
+class MockRoom:
+    pass
+
+
+def grid_building(n):
+    """
+    An n x n grid of rooms with doors between neighbours, windows on the front row and the back row
+    """
+    rooms = [[MockRoom() for _ in range(n)] for _ in range(n)]
+    apertures = []
+    for i in range(n):
+        for j in range(n):
+            if i+1 < n:
+                apertures.append(Aperture(rooms[i][j], rooms[i+1][j], 1.0))
+            if j+1 < n:
+                apertures.append(Aperture(rooms[i][j], rooms[i][j+1], 1.0))
+        apertures.append(Aperture(rooms[0][i], Side.Front, 0.5))
+        apertures.append(Aperture(rooms[n-1][i], Side.Back, 0.5))
+    return [r for row in rooms for r in row], apertures
+
+
+class TestPressureNetwork(unittest.TestCase):
+    def setUp(self):
+        self.air_density = 1.0
+        self.cp = (0.3, -0.2)
+
+    def network(self, rooms, apertures):
+        return PressureNetwork(rooms, apertures, 0, self.air_density, self.cp)
+
+    def test_two_windows_in_series(self):
+        room = MockRoom()
+        back = Aperture(room, Side.Back, 0.2)
+        front = Aperture(room, Side.Front, 0.2)
+        network = self.network([room], [back, front])
+
+        # The wind blows straight from the back to the front, each window takes half of the pressure difference
+        flows = network.solve(2.0, 0.0)
+        delta_p = 0.5*self.air_density*2.0**2*(self.cp[0]-self.cp[1])
+        expected = 0.7*0.2*math.sqrt(2*(delta_p/2)/self.air_density)
+        self.assertAlmostEqual(flows[0], -expected, places=8)
+        self.assertAlmostEqual(flows[1], expected, places=8)
+
+        # Reversing the wind reverses the flow
+        reversed_flows = network.solve(2.0, math.pi)
+        np.testing.assert_allclose(reversed_flows, -flows, atol=1e-10)
+
+        # And there is no flow without wind
+        np.testing.assert_allclose(network.solve(0.0, 0.0), 0.0)
+
+    def test_roof_vent(self):
+        room = MockRoom()
+        front = Aperture(room, Side.Front, 0.2)
+        roof = Aperture(room, Side.Upward, 0.2)
+        network = self.network([room], [front, roof])
+
+        # The roof vent has no wind pressure, so the wind on the front blows in through the window and out of the roof
+        flows = network.solve(2.0, math.pi)
+        self.assertEqual(network.side_pressures(2.0, math.pi)[1], 0.0)
+        self.assertLess(flows[0], 0.0)
+        self.assertAlmostEqual(flows[1], -flows[0], places=10)
+
+        # A room whose only opening is in the floor has no flow
+        cellar = MockRoom()
+        np.testing.assert_allclose(self.network([cellar], [Aperture(cellar, Side.Downward, 0.2)]).solve(2.0, 0.0), 0.0)
+
+        with self.assertRaises(ValueError):
+            self.network([room], [Aperture(room, Side.Unknown, 0.2)])
+
+    def test_mass_is_conserved(self):
+        rooms, apertures = grid_building(4)
+        network = self.network(rooms, apertures)
+        flows = network.solve(3.0, 0.3)
+
+        inflow = np.zeros(len(rooms))
+        for a, (origin, destination) in enumerate(network.aperture_rooms):
+            inflow[origin] -= flows[a]
+            if destination is not None:
+                inflow[destination] += flows[a]
+        np.testing.assert_allclose(inflow, 0.0, atol=1e-9*np.abs(flows).max())
+        self.assertGreater(np.abs(flows).max(), 0.0)
+
+    def test_closed_room_has_no_flow(self):
+        rooms = [MockRoom() for _ in range(3)]
+        apertures = [Aperture(rooms[0], Side.Back, 0.2),
+                     Aperture(rooms[0], Side.Front, 0.2),
+                     Aperture(rooms[1], rooms[2], 1.0)]
+        network = self.network(rooms, apertures)
+
+        self.assertEqual(network.solve(2.0, 0.0)[2], 0.0)
+        calculation = NetworkApertureCalculation(network, 2)
+        self.assertEqual(calculation.exchange_category(2.0, 0.0), 4)
+        self.assertEqual(NetworkApertureCalculation(network, 0).exchange_category(2.0, 0.0), 1)
+
+    def test_fluxes(self):
+        rooms = [MockRoom() for _ in range(2)]
+        apertures = [Aperture(rooms[0], Side.Back, 0.2),
+                     Aperture(rooms[0], rooms[1], 1.0),
+                     Aperture(rooms[1], Side.Front, 0.2)]
+        network = self.network(rooms, apertures)
+        door = NetworkApertureCalculation(network, 1)
+
+        fluxes = door.trans_matrix_contributions(2.0, 0.0)
+        self.assertGreater(fluxes.from_1_to_2, 0.0)
+        self.assertEqual(fluxes.from_2_to_1, 0.0)
+
+        fluxes = door.trans_matrix_contributions(2.0, math.pi)
+        self.assertEqual(fluxes.from_1_to_2, 0.0)
+        self.assertGreater(fluxes.from_2_to_1, 0.0)
+
+        # The wind along the windows gives the same pressure on both
+        fluxes = door.trans_matrix_contributions(2.0, math.pi/2)
+        self.assertEqual(fluxes.from_1_to_2, fluxes.from_2_to_1)
+
+    def test_large_building(self):
+        rooms, apertures = grid_building(20)
+        network = self.network(rooms, apertures)
+
+        flows = network.solve(5.0, 0.2)
+
+        # The front and back windows carry the same total flow
+        front = sum(flows[a] for a, ap in enumerate(apertures) if ap.destination is Side.Front)
+        back = sum(flows[a] for a, ap in enumerate(apertures) if ap.destination is Side.Back)
+        self.assertAlmostEqual(front, -back, places=6)
+        self.assertGreater(front, 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
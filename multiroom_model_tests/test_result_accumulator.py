@@ -0,0 +1,119 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import pickle
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from multiroom_model.result_accumulator import ResultAccumulator
+
+
+class TestResultAccumulator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            cls.phase_1 = pickle.load(file)
+        with open('multiroom_model_tests/run_180_to_360.pickle', 'rb') as file:
+            cls.phase_2 = pickle.load(file)
+
+    def assertFramesEqual(self, left: pd.DataFrame, right: pd.DataFrame):
+        self.assertTrue(left.index.equals(right.index))
+        self.assertTrue(left.columns.equals(right.columns))
+        self.assertTrue(left.dtypes.equals(right.dtypes))
+        self.assertTrue(left.equals(right))
+
+    def test_matches_concatenation(self):
+        accumulator = ResultAccumulator(2)
+        accumulator.append([self.phase_1, self.phase_1*2])
+        accumulator.append([self.phase_2, self.phase_2*2])
+
+        result = accumulator.to_dataframes()
+
+        self.assertEqual(len(accumulator), 8)
+        self.assertFramesEqual(result[0], pd.concat([self.phase_1, self.phase_2], axis=0))
+        self.assertFramesEqual(result[1], pd.concat([self.phase_1*2, self.phase_2*2], axis=0))
+
+    def test_repeated_boundary_times_are_kept(self):
+        accumulator = ResultAccumulator(1, capacity=2)
+        accumulator.append([self.phase_1])
+        accumulator.append([self.phase_2])
+
+        self.assertEqual(list(accumulator.times()), [0.0, 60.0, 120.0, 180.0, 180.0, 240.0, 300.0, 360.0])
+
+    def test_grows_past_capacity(self):
+        accumulator = ResultAccumulator(1, capacity=1)
+        for _ in range(10):
+            accumulator.append([self.phase_1])
+
+        self.assertEqual(len(accumulator), 40)
+        self.assertFramesEqual(accumulator.to_dataframes()[0], pd.concat([self.phase_1]*10, axis=0))
+
+    def test_replace_last_row(self):
+        accumulator = ResultAccumulator(2)
+        accumulator.append([self.phase_1, self.phase_1])
+        accumulator.replace_last_row([self.phase_1.iloc[[-1], :]*3, self.phase_1.iloc[[-1], :]])
+
+        result = accumulator.to_dataframes()
+
+        self.assertFramesEqual(result[0].iloc[:-1, :], self.phase_1.iloc[:-1, :])
+        self.assertTrue(result[0].iloc[-1, :].equals(self.phase_1.iloc[-1, :]*3))
+        self.assertFramesEqual(result[1], self.phase_1)
+
+    def test_replace_last_row_at_another_time_raises(self):
+        accumulator = ResultAccumulator(1)
+        accumulator.append([self.phase_1])
+        with self.assertRaises(Exception):
+            accumulator.replace_last_row([self.phase_1.iloc[[0], :]])
+
+    def test_rows_round_trip(self):
+        accumulator = ResultAccumulator(2)
+        accumulator.append([self.phase_1, self.phase_1*2])
+        accumulator.append([self.phase_2, self.phase_2*2])
+
+        copy = ResultAccumulator(2)
+        copy.append_rows(*accumulator.rows(0), layout=accumulator.layout())
+
+        for left, right in zip(copy.to_dataframes(), accumulator.to_dataframes()):
+            self.assertFramesEqual(left, right)
+        self.assertEqual(list(accumulator.rows(4)[0]), [180.0, 240.0, 300.0, 360.0])
+
+    def test_append_rows_needs_a_layout(self):
+        accumulator = ResultAccumulator(1)
+        with self.assertRaises(Exception):
+            accumulator.append_rows(np.zeros(1), np.zeros((1, 1, len(self.phase_1.columns))))
+
+    def test_wrong_number_of_rooms_raises(self):
+        accumulator = ResultAccumulator(2)
+        with self.assertRaises(Exception):
+            accumulator.append([self.phase_1])
+
+    def test_mismatched_times_raise(self):
+        accumulator = ResultAccumulator(2)
+        with self.assertRaises(Exception):
+            accumulator.append([self.phase_1, self.phase_2])
+
+    def test_empty(self):
+        accumulator = ResultAccumulator(3)
+
+        self.assertEqual(len(accumulator), 0)
+        self.assertEqual(len(accumulator.to_dataframes()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
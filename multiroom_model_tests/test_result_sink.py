@@ -0,0 +1,153 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import pickle
+import tempfile
+import unittest
+import importlib.util
+
+import numpy as np
+
+from multiroom_model.checkpoint import Checkpointer
+from multiroom_model.result_sink import MemoryResultSink, NpyResultSink, ParquetResultSink, ChunkedResultStore
+
+
+class TestResultSink(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            cls.phase_1 = pickle.load(file)
+        with open('multiroom_model_tests/run_180_to_360.pickle', 'rb') as file:
+            cls.phase_2 = pickle.load(file)
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.results_folder = os.path.join(self.folder.name, "results")
+
+    def expected(self):
+        memory = MemoryResultSink(2)
+        memory.append([self.phase_1, self.phase_1*2])
+        memory.append([self.phase_2, self.phase_2*2])
+        return memory.results()
+
+    def test_npy_sink_matches_memory_sink(self):
+        sink = NpyResultSink(self.results_folder, 2, chunk_rows=6)
+        sink.append([self.phase_1, self.phase_1*2])
+        sink.append([self.phase_2, self.phase_2*2])
+        sink.close()
+
+        self.assertEqual(len(sink), 8)
+        for reader, original in zip(sink.results(), self.expected()):
+            loaded = reader.to_dataframe()
+            self.assertTrue(loaded.equals(original))
+            self.assertTrue(loaded.dtypes.equals(original.dtypes))
+
+    def test_rows_are_held_until_a_chunk_is_full(self):
+        sink = NpyResultSink(self.results_folder, 2, chunk_rows=6)
+        sink.append([self.phase_1, self.phase_1*2])
+        self.assertFalse(os.path.exists(os.path.join(self.results_folder, NpyResultSink.manifest_file)))
+
+        # The partial run can be read while it goes on, up to the rows written so far
+        sink.append([self.phase_2, self.phase_2*2])
+        store = ChunkedResultStore(self.results_folder)
+        self.assertEqual(list(store.times()), [0.0, 60.0, 120.0, 180.0, 180.0, 240.0, 300.0, 360.0])
+
+        sink.append([self.phase_1, self.phase_1])
+        self.assertEqual(len(ChunkedResultStore(self.results_folder).times()), 8)
+
+    def test_read_columns_and_times(self):
+        sink = NpyResultSink(self.results_folder, 2, chunk_rows=4)
+        sink.append([self.phase_1, self.phase_1*2])
+        sink.append([self.phase_2, self.phase_2*2])
+        sink.close()
+
+        columns = list(self.phase_1.columns[[5, 0, 100]])
+        df = ChunkedResultStore(self.results_folder).read(1, columns, t_start=120.0, t_end=240.0)
+
+        expected = self.expected()[1].loc[120.0:240.0, columns]
+        self.assertTrue(df.equals(expected))
+
+        with self.assertRaises(Exception):
+            ChunkedResultStore(self.results_folder).read(0, ["not a species"])
+
+    def test_replace_last_row(self):
+        new_rows = [self.phase_2*3, self.phase_2*4]
+
+        # The last row is still in memory
+        sink = NpyResultSink(self.results_folder, 2, chunk_rows=100)
+        sink.append([self.phase_2, self.phase_2])
+        sink.replace_last_row(new_rows)
+        in_memory = sink.results()[1].to_dataframe()
+
+        # The last row is on disk
+        sink = NpyResultSink(self.results_folder, 2, chunk_rows=1)
+        sink.append([self.phase_2, self.phase_2])
+        sink.replace_last_row(new_rows)
+        on_disk = sink.results()[1].to_dataframe()
+
+        for df in (in_memory, on_disk):
+            np.testing.assert_array_equal(df.iloc[-1, :].to_numpy(dtype=float),
+                                          (self.phase_2*4).iloc[-1, :].to_numpy(dtype=float))
+            np.testing.assert_array_equal(df.iloc[:-1, :].to_numpy(dtype=float),
+                                          self.phase_2.iloc[:-1, :].to_numpy(dtype=float))
+
+    def test_checkpoint_and_restore(self):
+        checkpoint = Checkpointer(os.path.join(self.folder.name, "checkpoint"), every_intervals=1)
+        checkpoint.start()
+        sink = NpyResultSink(self.results_folder, 2, chunk_rows=100)
+        sink.append([self.phase_1, self.phase_1*2])
+        checkpoint.write({"start": 180.0}, sink)
+
+        # Results written after the checkpoint are dropped when the run is resumed from it
+        sink.append([self.phase_2, self.phase_2*2])
+        sink.close()
+
+        state = Checkpointer(os.path.join(self.folder.name, "checkpoint"), every_intervals=1).load()
+        restored = state["sink"]
+        self.assertIsInstance(restored, NpyResultSink)
+        self.assertEqual(len(restored), 4)
+
+        restored.append([self.phase_2, self.phase_2*2])
+        restored.close()
+        for reader, original in zip(restored.results(), self.expected()):
+            self.assertTrue(reader.to_dataframe().equals(original))
+        self.assertEqual(len(ChunkedResultStore(self.results_folder).chunks), 2)
+
+    def test_chunks_are_column_major(self):
+        sink = NpyResultSink(self.results_folder, 1, chunk_rows=1)
+        sink.append([self.phase_1])
+
+        values = np.load(os.path.join(self.results_folder, "room_000", "values_000000.npy"), mmap_mode="r")
+        self.assertTrue(values.flags.f_contiguous)
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_parquet_sink_matches_memory_sink(self):
+        sink = ParquetResultSink(self.results_folder, 2, chunk_rows=6)
+        sink.append([self.phase_1, self.phase_1*2])
+        sink.append([self.phase_2, self.phase_2*2])
+        sink.close()
+
+        store = ChunkedResultStore(self.results_folder)
+        for i, original in enumerate(self.expected()):
+            original.columns = original.columns.astype(str)
+            self.assertTrue(store.read(i).equals(original))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,12 +15,13 @@
 #
 # ############################################################################ #
 
+import copy
 import unittest
 
 from multiroom_model.global_settings import GlobalSettings
 from multiroom_model.json_parser import BuildingJSONParser
 from multiroom_model.room_chemistry import RoomChemistry
-from multiroom_model.room_inchempy_evolver import RoomInchemPyEvolver
+from multiroom_model.room_inchempy_evolver import RoomInchemPyEvolver, SharedMechanismBuilder, mechanism_key
 
 
 class TestRoomEvolverClass(unittest.TestCase):
@@ -76,3 +77,58 @@ class TestRoomEvolverClass(unittest.TestCase):
             seconds_to_integrate=10,
             initial_dataframe=output_data
         )
+
+    def test_shared_mechanism_builder(self):
+        room: RoomChemistry = self.rooms[2]
+        same_room = copy.deepcopy(room)
+
+        builder = SharedMechanismBuilder()
+        first = builder(room, self.global_settings)
+        second = builder(same_room, self.global_settings)
+
+        # The second room gets its own copy of the main class of the first
+        self.assertIsNot(first.inchem, second.inchem)
+        self.assertIs(second.room, same_room)
+
+        shared_output, _ = second.run(t0=0, seconds_to_integrate=10, initial_text_file='initial_concentrations.txt')
+        generated_output, _ = RoomInchemPyEvolver(same_room, self.global_settings).run(
+            t0=0, seconds_to_integrate=10, initial_text_file='initial_concentrations.txt')
+        self.assertTrue(shared_output.equals(generated_output))
+
+    def test_rooms_of_different_size_share_a_mechanism(self):
+        room: RoomChemistry = self.rooms[2]
+        larger_room = copy.deepcopy(room)
+        larger_room.volume_in_m3 = 2*room.volume_in_m3
+        larger_room.surf_area_in_m2 = 3*room.surf_area_in_m2
+
+        builder = SharedMechanismBuilder()
+        first = builder(room, self.global_settings)
+        second = builder(larger_room, self.global_settings)
+        self.assertIsNot(first.inchem, second.inchem)
+
+        # The copy runs with the geometry of the larger room, as if it had been generated for it
+        shared_output, _ = second.run(t0=0, seconds_to_integrate=10, initial_text_file='initial_concentrations.txt')
+        generated_output, _ = RoomInchemPyEvolver(larger_room, self.global_settings).run(
+            t0=0, seconds_to_integrate=10, initial_text_file='initial_concentrations.txt')
+        self.assertTrue(shared_output.equals(generated_output))
+        self.assertEqual(second.inchem.volume, larger_room.volume_in_m3)
+
+        # and the first room keeps its own
+        first.run(t0=0, seconds_to_integrate=10, initial_text_file='initial_concentrations.txt')
+        self.assertEqual(first.inchem.volume, room.volume_in_m3)
+
+    def test_mechanism_key(self):
+        arguments = [RoomInchemPyEvolver.mechanism_arguments(r, self.global_settings) for r in self.rooms]
+        same_room = RoomInchemPyEvolver.mechanism_arguments(copy.deepcopy(self.rooms[0]), self.global_settings)
+
+        self.assertEqual(mechanism_key(arguments[0]), mechanism_key(same_room))
+        hash(mechanism_key(arguments[0]))
+
+        # Rooms which differ only in size have the same key, those with other emissions do not
+        resized = copy.deepcopy(self.rooms[0])
+        resized.volume_in_m3 = 2*resized.volume_in_m3
+        resized.surf_area_in_m2 = 2*resized.surf_area_in_m2
+        self.assertEqual(mechanism_key(arguments[0]),
+                         mechanism_key(RoomInchemPyEvolver.mechanism_arguments(resized, self.global_settings)))
+        self.assertNotEqual(mechanism_key(arguments[0]),
+                            mechanism_key(dict(arguments[0], timed_emissions=not arguments[0]["timed_emissions"])))
@@ -219,3 +219,12 @@ class TestRoomChemistryFromJson(unittest.TestCase):
         self.assertIsInstance(self.room.n_children, TimeDependentValue)
         self.assertEqual(len(self.room.n_adults.times()), 24)
         self.assertEqual(len(self.room.n_children.times()), 24)
+
+    def test_schedule_times(self):
+        times = self.room.schedule_times()
+
+        self.assertEqual(times, sorted(set(times)))
+        self.assertEqual(set(times), set(self.room.rh_in_percent.times()) | set(self.room.n_adults.times())
+                         | set(self.room.n_children.times()))
+        self.assertIn(46800.0, times)
+        self.assertIn(50400.0, times)
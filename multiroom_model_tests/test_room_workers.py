@@ -0,0 +1,108 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from multiroom_model.room_workers import ResidentRoomWorkers
+
+
+class MockRoom:
+    def __init__(self, rate):
+        self.rate = rate
+
+
+class MockEvolver:
+    """
+    Grows species A at the rate of the room, and counts how many times it has been run
+    """
+
+    def __init__(self, room, global_settings):
+        self.room = room
+        self.runs = 0
+
+    def run(self, t0, seconds_to_integrate, initial_dataframe=None, initial_text_file=None):
+        self.runs += 1
+        start = 0.0 if initial_dataframe is None else initial_dataframe.iloc[-1]["A"]
+        times = np.arange(t0, t0+seconds_to_integrate+0.5)
+        return pd.DataFrame({"A": start + self.room.rate*(times-t0),
+                             "runs": self.runs,
+                             "pid": os.getpid()}, index=times), None
+
+
+class FloatEvolver(MockEvolver):
+    """
+    Gives only float columns
+    """
+
+    def run(self, t0, seconds_to_integrate, initial_dataframe=None, initial_text_file=None):
+        df, _ = super().run(t0, seconds_to_integrate, initial_dataframe, initial_text_file)
+        return df.astype(float), None
+
+
+def failing_evolver(room, global_settings):
+    raise ValueError("cannot build")
+
+
+class TestResidentRoomWorkers(unittest.TestCase):
+
+    def test_evolve_keeps_evolvers_resident(self):
+        rooms = [MockRoom(1.0), MockRoom(2.0), MockRoom(3.0)]
+
+        with ResidentRoomWorkers(rooms, None, 2, MockEvolver) as workers:
+            results = workers.evolve(0.0, 3.0, ["a.txt", "b.txt", "c.txt"], True)
+            for i in range(3):
+                self.assertEqual(list(results[i].index), [0.0, 1.0, 2.0, 3.0])
+                self.assertEqual(results[i]["A"].iloc[-1], 3.0*rooms[i].rate)
+
+            initial_conditions = [r.loc[[3.0], :] for r in results]
+            results = workers.evolve(3.0, 2.0, initial_conditions, False)
+            for i in range(3):
+                self.assertEqual(list(results[i].index), [3.0, 4.0, 5.0])
+                self.assertEqual(results[i]["A"].iloc[-1], 5.0*rooms[i].rate)
+                # the same evolver ran both intervals
+                self.assertEqual(results[i]["runs"].iloc[-1], 2)
+
+            # rooms 0 and 2 share a worker, room 1 has its own
+            pids = [r["pid"].iloc[-1] for r in results]
+            self.assertEqual(pids[0], pids[2])
+            self.assertNotEqual(pids[0], pids[1])
+            self.assertNotIn(os.getpid(), pids)
+
+    def test_result_dtypes_are_kept(self):
+        for evolver in (MockEvolver, FloatEvolver):
+            with self.subTest(evolver=evolver.__name__):
+                with ResidentRoomWorkers([MockRoom(1.0)], None, 1, evolver) as workers:
+                    first = workers.evolve(0.0, 3.0, ["a.txt"], True)
+                    second = workers.evolve(3.0, 2.0, [first[0].loc[[3.0], :]], False)
+
+                # The integer columns of MockEvolver stay integers, the float results are sent as arrays
+                self.assertTrue(second[0].dtypes.equals(first[0].dtypes))
+                self.assertEqual(second[0]["A"].iloc[-1], 5.0)
+                self.assertEqual(second[0]["runs"].iloc[-1], 2)
+
+    def test_build_failure_raises(self):
+        with self.assertRaises(Exception) as context:
+            ResidentRoomWorkers([MockRoom(1.0)], None, 1, failing_evolver)
+        self.assertIn("cannot build", str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from multiroom_model.result_sink import MemoryResultSink, NpyResultSink, ChunkedResultStore
+from multiroom_model.simulation_result import SimulationResult
+
+
+class TestSimulationResult(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            phase_1 = pickle.load(file)
+        with open('multiroom_model_tests/run_180_to_360.pickle', 'rb') as file:
+            phase_2 = pickle.load(file)
+        sink = MemoryResultSink(2)
+        sink.append([phase_1, phase_1*2])
+        sink.append([phase_2, phase_2*2])
+        cls.living_room, cls.kitchen = sink.results()
+        cls.results = {"living_room": cls.living_room, "kitchen": cls.kitchen}
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.result_folder = os.path.join(self.folder.name, "mbm_results")
+
+    def test_write_and_read_back(self):
+        SimulationResult.write(self.result_folder, self.results)
+        result = SimulationResult(self.result_folder)
+
+        self.assertEqual(list(result.rooms), ["living_room", "kitchen"])
+        self.assertEqual(result.shape, (2, 8, len(self.kitchen.columns)))
+        for name, original in self.results.items():
+            loaded = result.to_dataframe(name)
+            self.assertTrue(loaded.equals(original))
+            self.assertTrue(loaded.dtypes.equals(original.dtypes))
+
+    def test_slicing(self):
+        result = SimulationResult.write(self.result_folder, self.results)
+
+        # The times are inclusive, including both rows at an interval boundary
+        df = result.to_dataframe("kitchen", ["O3", "NO"], t_start=120.0, t_end=240.0)
+        self.assertTrue(df.equals(self.kitchen.iloc[2:6][["O3", "NO"]]))
+
+        values = result.values(["kitchen", "living_room"], "O3", t_end=60.0)
+        self.assertEqual(values.shape, (2, 2, 1))
+        np.testing.assert_array_equal(values[0, :, 0], self.kitchen["O3"].to_numpy()[:2])
+        np.testing.assert_array_equal(values[1, :, 0], self.living_room["O3"].to_numpy()[:2])
+
+        o3 = result.species_dataframe("O3")
+        self.assertEqual(list(o3.columns), ["living_room", "kitchen"])
+        np.testing.assert_array_equal(o3["kitchen"].to_numpy(), self.kitchen["O3"].to_numpy())
+
+        with self.assertRaises(Exception):
+            result.to_dataframe("attic")
+        with self.assertRaises(Exception):
+            result.values(species=["NOT_A_SPECIES"])
+
+    def test_species_are_contiguous(self):
+        result = SimulationResult.write(self.result_folder, self.results)
+        values = np.load(os.path.join(self.result_folder, SimulationResult.values_file), mmap_mode="r")
+        self.assertTrue(values.flags.f_contiguous)
+        self.assertIsInstance(result.values(species="O3"), np.ndarray)
+
+    def test_write_from_store(self):
+        chunks_folder = os.path.join(self.folder.name, "results")
+        sink = NpyResultSink(chunks_folder, 2, chunk_rows=3)
+        sink.append([self.living_room.iloc[:4], self.kitchen.iloc[:4]])
+        sink.append([self.living_room.iloc[4:], self.kitchen.iloc[4:]])
+        sink.close()
+
+        result = SimulationResult.write_from_store(self.result_folder, ChunkedResultStore(chunks_folder),
+                                                   ["living_room", "kitchen"])
+
+        for name, original in self.results.items():
+            self.assertTrue(result.to_dataframe(name).equals(original))
+
+    def test_mismatched_rooms_raise(self):
+        with self.assertRaises(Exception):
+            SimulationResult.write(self.result_folder, {"a": self.kitchen, "b": self.kitchen.iloc[:4]})
+        self.assertFalse(os.path.exists(os.path.join(self.result_folder, SimulationResult.index_file)))
+
+
+if __name__ == '__main__':
+    unittest.main()
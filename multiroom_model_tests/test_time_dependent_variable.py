@@ -61,6 +61,14 @@ class TestTimeDependentValueLinearInterpolation(unittest.TestCase):
             TimeDependentValue([(1.0, 10.0), (0.5, 20.0)], continuous=True)
         self.assertIn("times were not in order", str(context.exception).lower())
 
+    def test_values_at_times(self):
+        times = [0.0, 0.25, 1.0, 1.5, 2.999, 3.0]
+        values = self.tdv.values_at_times(times)
+        for t, v in zip(times, values):
+            self.assertEqual(v, self.tdv.value_at_time(t))
+        with self.assertRaises(Exception):
+            self.tdv.values_at_times([0.5, 3.1])
+
     def test_single_point(self):
         tdv_single = TimeDependentValue([(2.0, 100.0)], continuous=True)
         self.assertEqual(tdv_single.value_at_time(2.0), 100.0)
@@ -111,6 +119,14 @@ class TestTimeDependentDiscontinuous(unittest.TestCase):
             TimeDependentValue([(1.0, 10.0), (0.5, 20.0)], continuous=True)
         self.assertIn("times were not in order", str(context.exception).lower())
 
+    def test_values_at_times(self):
+        times = [0.0, 0.5, 1.0, 1.5, 2.999, 3.0]
+        values = self.tdv.values_at_times(times)
+        for t, v in zip(times, values):
+            self.assertEqual(v, self.tdv.value_at_time(t))
+        with self.assertRaises(Exception):
+            self.tdv.values_at_times([-0.5, 1.0])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -18,6 +18,7 @@
 import numpy as np
 import unittest
 import math
+import copy
 
 from multiroom_model.json_parser import BuildingJSONParser
 from multiroom_model.aperture_calculations import Side
@@ -76,6 +77,7 @@ class TestTransMatrix(unittest.TestCase):
     def test_trans_matrix(self):
 
         simulation = Simulation(self.global_settings, self.rooms, self.apertures, self.wind_definition)
+        self.addCleanup(simulation.close)
 
         for time in (0, 46805, 82800, ):
             matrix = simulation.trans_matrix(time)
@@ -102,6 +104,7 @@ class TestTransMatrix(unittest.TestCase):
         wind_definition = WindDefinition(TimeDependentValue([(0, 1),], True), TimeDependentValue([(0, 0),], True))
 
         simulation = Simulation(self.global_settings, rooms, apertures, wind_definition)
+        self.addCleanup(simulation.close)
 
         matrix = simulation.trans_matrix(0)
 
@@ -116,3 +119,43 @@ class TestTransMatrix(unittest.TestCase):
 
         self.assertEqual(matrix[0, 1], self.flow_advection(1, 10, 0))
         self.assertEqual(matrix[1, 0], self.flow_advection(1, 10, 1))
+
+    def test_pressure_network(self):
+
+        global_settings = copy.copy(self.global_settings)
+        global_settings.airflow_model = "pressure_network"
+
+        simulation = Simulation(global_settings, self.rooms, self.apertures, self.wind_definition)
+        self.addCleanup(simulation.close)
+
+        for time in (0, 46805, 82800, ):
+            matrix = simulation.trans_matrix(time)
+
+            self.assertEqual(matrix.shape, (10, 10))
+            self.assertFalse(np.isnan(matrix).any())
+            self.assertGreaterEqual(matrix.min(), 0)
+
+            # As much air flows into each room as flows out of it
+            np.testing.assert_allclose(matrix.sum(axis=0), matrix.sum(axis=1), atol=1e-9*max(matrix.max(), 1))
+
+    def test_trans_matrix_series(self):
+
+        simulation = Simulation(self.global_settings, self.rooms, self.apertures, self.wind_definition)
+        self.addCleanup(simulation.close)
+
+        wind_times = self.wind_definition.times()
+        times = np.linspace(wind_times[0], wind_times[-1], 97)
+        matrices = simulation.trans_matrix_series(times)
+        self.assertEqual(matrices.shape, (97, 10, 10))
+
+        # The same as adding up the fluxes of each aperture from its contributions, one time at a time
+        for time, matrix in zip(times[::8], matrices[::8]):
+            wind_speed, wind_direction = simulation.wind_state(time)
+            expected = np.zeros((10, 10))
+            for calculator, origin_index, destination_index, _, _ in simulation._aperture_calculators:
+                i = origin_index+1
+                j = 0 if destination_index is None else destination_index+1
+                f = calculator.trans_matrix_contributions(wind_speed, wind_direction)
+                expected[i, j] += f.from_1_to_2
+                expected[j, i] += f.from_2_to_1
+            np.testing.assert_allclose(matrix, expected, rtol=1e-12, atol=1e-15)
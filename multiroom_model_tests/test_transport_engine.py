@@ -0,0 +1,173 @@
+# ############################################################################ #
+#
+# Copyright (c) 2025 Roberto Sommariva, Neil Butcher, Adrian Garcia,
+# James Levine, Christian Pfrang.
+#
+# This file is part of MBM-Flex.
+#
+# MBM-Flex is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License (https://www.gnu.org/licenses) as
+# published by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# A copy of the GPLv3 license can be found in the file `LICENSE` at the root of
+# the MBM-Flex project.
+#
+# ############################################################################ #
+
+import pickle
+import unittest
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from multiroom_model.aperture_calculations import Fluxes
+from multiroom_model.aperture_flow_calculations import ApertureFlowCalculator
+from multiroom_model.transport_engine import TransportEngine
+
+
+class TestTransportEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open('multiroom_model_tests/run_0_to_180.pickle', 'rb') as file:
+            cls.dataframe = pickle.load(file)
+        cls.columns = cls.dataframe.columns
+        cls.volumes = [30.0, 12.5, 48.0]
+
+        # Three rooms with different concentrations
+        row = cls.dataframe.iloc[-1, :].astype(float)
+        cls.concentrations = [row*(i+1) for i in range(3)]
+        for i, c in enumerate(cls.concentrations):
+            c.loc['O3OUT'] = 7.0e11*(i+1)
+
+        # apertures as (origin index, destination index or None, fluxes)
+        cls.apertures = [
+            (0, None, Fluxes(0.02, 0.05)),
+            (0, 1, Fluxes(0.03, 0.0)),
+            (1, 2, Fluxes(0.01, 0.01)),
+            (2, None, Fluxes(0.0, 0.04)),
+        ]
+
+    def flux_matrix(self, apertures):
+        result = np.zeros((4, 4))
+        for origin, destination, flux in apertures:
+            i = origin+1
+            j = 0 if destination is None else destination+1
+            result[i, j] += flux.from_1_to_2
+            result[j, i] += flux.from_2_to_1
+        return result
+
+    def test_matches_aperture_flow_calculations(self):
+        delta_time = 15.0
+        calculator = ApertureFlowCalculator(self.columns)
+
+        # Accumulate the changes aperture by aperture
+        expected = [c.copy() for c in self.concentrations]
+        for origin, destination, flux in self.apertures:
+            if destination is None:
+                change = calculator.outdoor_concentration_changes(
+                    flux, delta_time, self.concentrations[origin], self.volumes[origin])
+                expected[origin] = expected[origin].add(change, fill_value=0.0)
+            else:
+                change_1, change_2 = calculator.concentration_changes(
+                    flux, delta_time, self.concentrations[origin], self.concentrations[destination],
+                    self.volumes[origin], self.volumes[destination])
+                expected[origin] = expected[origin].add(change_1, fill_value=0.0)
+                expected[destination] = expected[destination].add(change_2, fill_value=0.0)
+
+        engine = TransportEngine(self.columns, self.volumes)
+        result = engine.apply(np.stack([c.to_numpy() for c in self.concentrations]),
+                              self.flux_matrix(self.apertures), delta_time)
+
+        for i in range(3):
+            assert_allclose(result[i], expected[i].reindex(self.columns).to_numpy(), rtol=1.0e-12, atol=1.0e-300)
+
+    def test_only_transported_species_change(self):
+        engine = TransportEngine(self.columns, self.volumes)
+        concentrations = np.stack([c.to_numpy() for c in self.concentrations])
+
+        result = engine.apply(concentrations, self.flux_matrix(self.apertures), 15.0)
+
+        changed = self.columns[(result != concentrations).any(axis=0)]
+        for c in changed:
+            self.assertIn(c, engine.species)
+        self.assertIn('O3', changed)
+        self.assertNotIn('O3OUT', changed)
+
+    def test_indoor_transport_conserves_mass(self):
+        engine = TransportEngine(self.columns, self.volumes)
+        indoor_apertures = [a for a in self.apertures if a[1] is not None]
+        state = engine.building_state(np.stack([c.to_numpy() for c in self.concentrations]))
+
+        new_state = engine.step(state, self.flux_matrix(indoor_apertures), 15.0)
+
+        volumes = np.array(self.volumes)[:, np.newaxis]
+        assert_allclose((volumes*new_state).sum(axis=0), (volumes*state[:3]).sum(axis=0), rtol=1.0e-12, atol=1.0e-300)
+
+    def test_no_flux_is_identity(self):
+        engine = TransportEngine(self.columns, self.volumes)
+        state = engine.building_state(np.stack([c.to_numpy() for c in self.concentrations]))
+
+        self.assertTrue(np.array_equal(engine.step(state, np.zeros((4, 4)), 15.0), state[:3]))
+
+    def test_unknown_method_raises(self):
+        with self.assertRaises(ValueError):
+            TransportEngine(self.columns, self.volumes, method="runge-kutta")
+
+    def test_exact_matches_euler_for_short_steps(self):
+        euler = TransportEngine(self.columns, self.volumes, method="euler")
+        exact = TransportEngine(self.columns, self.volumes, method="expm")
+        matrix = self.flux_matrix(self.apertures)
+
+        # the error of the Euler step is second order in the step
+        for delta_time in (1.0, 0.1):
+            difference = np.abs(exact.propagator(matrix, delta_time) - euler.propagator(matrix, delta_time)).max()
+            self.assertLess(difference, delta_time**2*1.0e-4)
+
+    def test_exact_stays_positive_for_long_steps(self):
+        euler = TransportEngine(self.columns, self.volumes, method="euler")
+        exact = TransportEngine(self.columns, self.volumes, method="expm")
+        matrix = self.flux_matrix(self.apertures)
+        state = exact.building_state(np.stack([c.to_numpy() for c in self.concentrations]))
+        positive = (state[:3] > 0).all(axis=0) & (state[3:] >= 0).all(axis=0)
+
+        # a step much longer than the residence time of room 1 (12.5 m3 at 0.04 m3/s)
+        delta_time = 3600.0
+
+        self.assertTrue((euler.step(state, matrix, delta_time)[:, positive] < 0).any())
+        self.assertTrue((exact.propagator(matrix, delta_time) >= 0).all())
+        self.assertTrue((exact.step(state, matrix, delta_time)[:, positive] >= 0).all())
+
+    def test_exact_conserves_mass(self):
+        engine = TransportEngine(self.columns, self.volumes, method="expm")
+        indoor_apertures = [a for a in self.apertures if a[1] is not None]
+        state = engine.building_state(np.stack([c.to_numpy() for c in self.concentrations]))
+
+        new_state = engine.step(state, self.flux_matrix(indoor_apertures), 1.0e5)
+
+        volumes = np.array(self.volumes)[:, np.newaxis]
+        assert_allclose((volumes*new_state).sum(axis=0), (volumes*state[:3]).sum(axis=0), rtol=1.0e-10, atol=1.0e-300)
+
+    def test_exact_reaches_outdoor_concentration(self):
+        # one ventilated room tends to its outdoor concentration
+        engine = TransportEngine(self.columns, [10.0], method="expm")
+        state = engine.building_state(self.concentrations[0].to_numpy()[np.newaxis, :])
+        o3 = engine.species.index('O3')
+
+        new_state = engine.step(state, np.array([[0.0, 0.1], [0.1, 0.0]]), 1.0e4)
+
+        self.assertAlmostEqual(new_state[0, o3]/state[1, o3], 1.0)
+
+    def test_propagator_cache(self):
+        engine = TransportEngine(self.columns, self.volumes, method="expm")
+        matrix = self.flux_matrix(self.apertures)
+
+        first = engine.propagator(matrix, 60.0, cache_key=(1.0, 0.5, 60.0))
+
+        self.assertTrue(engine.is_cached((1.0, 0.5, 60.0)))
+        self.assertFalse(engine.is_cached((1.0, 0.5, 30.0)))
+        self.assertIs(engine.propagator(None, 60.0, cache_key=(1.0, 0.5, 60.0)), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,9 +16,10 @@
 # ############################################################################ #
 
 import unittest
+import warnings
 
 from multiroom_model.aperture import Aperture, Side
-from multiroom_model.transport_paths import paths_through_building
+from multiroom_model.transport_paths import paths_through_building, estimate_path_count, warn_if_many_paths
 
 
 class MockRoom:
@@ -201,3 +202,100 @@ class TestTransportPaths(unittest.TestCase):
         self.assertEqual(len(a), 2)
 
         self.assertEqual(len(result), 13)
+
+    def h_shape(self):
+        return [
+            Aperture(self.rooms[0], Side.Front, Side.Front),
+            Aperture(self.rooms[1], self.rooms[0], Side.Front),
+            Aperture(self.rooms[2], self.rooms[1], Side.Front),
+            Aperture(self.rooms[2], Side.Back, Side.Back),
+
+            Aperture(self.rooms[3], Side.Front, Side.Front),
+            Aperture(self.rooms[4], self.rooms[3], Side.Front),
+            Aperture(self.rooms[5], self.rooms[4], Side.Front),
+            Aperture(self.rooms[5], Side.Back, Side.Back),
+
+            Aperture(self.rooms[1], self.rooms[6], Side.Right),
+            Aperture(self.rooms[4], self.rooms[6], Side.Left),
+        ]
+
+    def test_max_length(self):
+        result = paths_through_building(self.rooms, self.h_shape(), max_length=5)
+
+        # Only the 2 straight routes through 4 windows
+        self.assertEqual(len(result), 2)
+        self.assertEqual([len(r.route) for r in result], [4, 4])
+
+    def test_k_shortest(self):
+        windows = self.h_shape()
+        everything = paths_through_building(self.rooms, windows)
+        result = paths_through_building(self.rooms, windows, k_shortest=3)
+
+        # The shortest first, each one of the paths found without a limit
+        self.assertEqual([len(r.route) for r in result], [4, 4, 6])
+        for r in result:
+            self.assertTrue(any(r.route == e.route for e in everything))
+
+    def test_max_paths(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            result = paths_through_building(self.rooms, self.h_shape(), max_paths=3)
+
+        self.assertEqual(len(result), 3)
+        self.assertEqual(len(caught), 1)
+
+    def grid(self):
+        """
+        A grid of 3 x 4 rooms with windows on every outside wall
+        """
+        rooms = [MockRoom() for n in range(12)]
+        grid = []
+        for i in range(3):
+            for j in range(4):
+                if j < 3:
+                    grid.append(Aperture(rooms[4*i+j], rooms[4*i+j+1], Side.Front))
+                if i < 2:
+                    grid.append(Aperture(rooms[4*i+j], rooms[4*i+j+4], Side.Front))
+        for j in range(4):
+            grid.append(Aperture(rooms[j], Side.Front, Side.Front))
+            grid.append(Aperture(rooms[8+j], Side.Back, Side.Back))
+        for i in range(3):
+            grid.append(Aperture(rooms[4*i], Side.Left, Side.Left))
+            grid.append(Aperture(rooms[4*i+3], Side.Right, Side.Right))
+
+        return rooms, grid
+
+    def test_max_paths_shared_between_sides(self):
+        rooms, grid = self.grid()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            result = paths_through_building(rooms, grid, max_paths=12)
+
+        # Each of the 6 pairs of sides keeps its 2 shortest paths
+        self.assertEqual(len(result), 12)
+        self.assertEqual(len(caught), 1)
+        pairs = [(r.start, r.end) for r in result]
+        self.assertEqual(len(set(pairs)), 6)
+        self.assertTrue(all(pairs.count(p) == 2 for p in pairs))
+
+    def test_warn_if_many_paths(self):
+        rooms, grid = self.grid()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            expected = warn_if_many_paths(rooms, grid, threshold=10)
+            self.assertEqual(len(caught), 1)
+            self.assertGreater(expected, 10)
+
+            # The limits bound the number of paths that would be found
+            self.assertEqual(warn_if_many_paths(rooms, grid, max_paths=10, threshold=10), 10)
+            self.assertEqual(warn_if_many_paths(rooms, grid, k_shortest=1, threshold=10), 6)
+            self.assertEqual(len(caught), 1)
+
+    def test_estimate_path_count(self):
+        windows = self.h_shape()
+        self.assertAlmostEqual(estimate_path_count(self.rooms, windows, samples=4000), 4, delta=0.5)
+        self.assertAlmostEqual(estimate_path_count(self.rooms, windows, max_length=5, samples=4000), 2, delta=0.25)
+
+        rooms, grid = self.grid()
+        count = len(paths_through_building(rooms, grid))
+        self.assertAlmostEqual(estimate_path_count(rooms, grid, samples=4000), count, delta=0.1*count)
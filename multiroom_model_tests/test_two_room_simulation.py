@@ -60,6 +60,7 @@ class TestTwoRoomSimulation(unittest.TestCase):
             global_settings=self.global_settings,
             rooms=rooms,
             apertures=[])
+        self.addCleanup(simulation.close)
 
         initial_conditions = dict([(r, 'initial_concentrations.txt') for r in rooms])
 
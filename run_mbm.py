@@ -27,13 +27,22 @@
 # ############################################################################ #
 
 import os
+import json
+import json5
 import math
 import pickle
+import pandas as pd
 from datetime import datetime
 from typing import Dict, List
 from multiroom_model.global_settings import GlobalSettings
 from multiroom_model.simulation import Simulation, RoomChemistry, Aperture, WindDefinition
 from multiroom_model.json_parser import BuildingJSONParser
+from multiroom_model.checkpoint import Checkpointer
+from multiroom_model.autotune import autotune
+from multiroom_model.result_sink import NpyResultSink, MemoryResultSink, TeeResultSink
+from multiroom_model.output_spec import OutputSpec, OutputSpecSink
+from multiroom_model.simulation_result import SimulationResult
+from multiroom_model.exposure_metrics import ExposureMetrics, who_2021_thresholds
 
 # ############################################################################ #
 
@@ -68,7 +77,13 @@ if __name__ == '__main__':
         building_direction_in_radians=math.radians(180),
         air_density=rho,
         upwind_pressure_coefficient=0.3,
-        downwind_pressure_coefficient=-0.2
+        downwind_pressure_coefficient=-0.2,
+        # generated mechanisms are kept in this folder and reused by later runs (None to disable)
+        # inspect or evict them with: python -m multiroom_model.mechanism_cache mechanism_cache list
+        mechanism_cache_folder='mechanism_cache',
+        # how the advection flows are found: 'transport_paths' (the wind along each path through the
+        # building) or 'pressure_network' (the pressure in each room, quicker for large buildings)
+        airflow_model='transport_paths'
     )
 
     # Simulation time control (in seconds)
@@ -79,16 +94,60 @@ if __name__ == '__main__':
     total_time=20
     transport_interval=6
 
+    # What runs the chemistry of the rooms in parallel
+    # - 'process': a pool of processes on this machine
+    # - 'thread': a pool of threads, 'serial': one room after another (quicker for a few small rooms)
+    # - 'mpi': a pool of MPI processes spanning the nodes of a cluster (needs mpi4py), started with
+    #   mpiexec -n <processes> python -m mpi4py.futures run_mbm.py
+    executor='process'
+
+    # Choose the executor, its number of workers and the transport interval (at most transport_interval)
+    # which are projected to be quickest, from the timing of a short calibration run (see autotune)
+    auto_tune=False
+
     # Name of the folder where the model results will be saved. The folder name
     # will be automatically prefixed with the date and time of the simulation.
     mbm_output='output'
 
+    # How the model results are saved
+    # - 'pickle': kept in memory and saved at the end to mbm_results.pkl
+    # - 'npy': written to the results folder as the simulation goes (the memory used stays
+    #   flat and the results so far can be read while it runs, see ChunkedResultStore), and
+    #   at the end gathered into the mbm_results folder, which is read with SimulationResult
+    #   (the results folder can then be deleted)
+    result_store='pickle'
+
+    # Which model results are saved (the simulation still carries every variable internally)
+    # - output_species: the variables to save, e.g. ['O3','NO','NO2'] (their outdoor values are
+    #   saved too), None to save every variable
+    # - output_interval: save the results every output_interval seconds, None for every time step
+    output_species=None
+    output_interval=None
+
+    # Exposure metrics computed as the simulation goes and saved to mbm_metrics.csv (see ExposureMetrics):
+    # means, maxima, exposure of the occupants and time above the WHO guidelines
+    # - metrics_species: the species to compute metrics of, e.g. ['O3','NO2'], None for no metrics
+    metrics_species=None
+
+    # Checkpoints of the simulation, so a run which is stopped (for example at the
+    # wall clock limit of a batch job) can be carried on by running this script again.
+    # - checkpoint_folder: where the checkpoints are written (None for no checkpoints)
+    # - checkpoint_minutes: how often a checkpoint is written
+    checkpoint_folder=None
+    checkpoint_minutes=30
+
+    # The built simulation (the generated mechanisms of the rooms and the transport calculations)
+    # is saved to this file, and loaded rather than built again by later runs of the same building
+    # and settings, such as runs with other times (None to build the simulation on every run)
+    simulation_file=None
+
     # ############################################################################ #
     # DO NOT CHANGE THE CODE BELOW                                                 #
     # ############################################################################ #
 
     # Read the json file for each room and extract all the data we need from it
-    input_data = BuildingJSONParser.from_json_file("config_rooms/building.json")
+    building_file = "config_rooms/building.json"
+    input_data = BuildingJSONParser.from_json_file(building_file)
 
     # Definition of the rooms
     rooms_dictionary: Dict[str,RoomChemistry] = input_data["rooms"]
@@ -102,29 +161,114 @@ if __name__ == '__main__':
     # We dont need the keys of the rooms anymore now we have populated them
     rooms: List[RoomChemistry] = list(rooms_dictionary.values())
 
-    # Build the simulation class
-    # This step will build jacobeans for each of the rooms in preparation for running later
-    simulation = Simulation(
-        global_settings=global_settings,
-        rooms=rooms,
-        apertures=apertures,
-        wind_definition=wind_definition)
-
-    # An initial conditions text file for each room
-    initial_conditions = input_data['initial_conditions']
-
-    # Run the simulation starting at time t0 for a duration of t_total seconds
-    # Interrupt the inchempy solver to apply transport every t_interval seconds
-    result = simulation.run(
-        t0=start_time,
-        t_total=total_time,
-        t_interval=transport_interval,
-        init_conditions=initial_conditions
-    )
+    simulation = None
+    if simulation_file is not None:
+        # The inputs the saved simulation must have been built from
+        with open(building_file) as file:
+            room_files = list(json5.load(file)['rooms'].values())
+        fingerprint = Simulation.input_fingerprint(global_settings, [building_file] + room_files)
+        if os.path.exists(simulation_file):
+            try:
+                simulation = Simulation.load(simulation_file, fingerprint, executor=executor)
+            except Exception as e:
+                print(f'The saved simulation {simulation_file} is not used: {e}')
+
+    if simulation is None:
+        # Build the simulation class
+        # This step will build jacobeans for each of the rooms in preparation for running later
+        simulation = Simulation(
+            global_settings=global_settings,
+            rooms=rooms,
+            apertures=apertures,
+            wind_definition=wind_definition,
+            executor=executor)
+        if simulation_file is not None:
+            simulation.save(simulation_file, fingerprint)
+
+    # The processes running the rooms are stopped when the with statement ends, even if the run fails
+    with simulation:
+        # An initial conditions text file for each room
+        initial_conditions = dict((r, input_data['initial_conditions'][original])
+                                  for r, original in zip(simulation.rooms, rooms))
+
+        # The rooms of a loaded simulation are its own (in the same order)
+        rooms_dictionary = dict(zip(rooms_dictionary.keys(), simulation.rooms))
+        rooms = simulation.rooms
+
+        if auto_tune:
+            tuning = autotune(simulation, initial_conditions, start_time, total_time, max_interval=transport_interval)
+            print(tuning.summary())
+            simulation.use_executor(tuning.backend, tuning.workers)
+            transport_interval = tuning.t_interval
+
+        checkpoint = None
+        if checkpoint_folder is not None:
+            checkpoint = Checkpointer(checkpoint_folder, every_seconds=60*checkpoint_minutes)
+            # The checkpoint folder records the folder of the model results of its run
+            output_dir_file = os.path.join(checkpoint_folder, 'mbm_output_dir.txt')
+        resuming = checkpoint is not None and checkpoint.exists()
+
+        # The folder of the model results, a resumed run carries on in the folder of the run it resumes
+        if resuming and os.path.exists(output_dir_file):
+            with open(output_dir_file) as file:
+                mbm_output_dir = file.read().strip()
+        else:
+            mbm_output_dir = ('%s_%s' % (datetime.now().strftime('%y%m%d_%H%M%S'), mbm_output))
+            os.mkdir('%s/%s' % (os.getcwd(), mbm_output_dir))
+            if checkpoint is not None:
+                os.makedirs(checkpoint_folder, exist_ok=True)
+                with open(output_dir_file, 'w') as file:
+                    file.write(mbm_output_dir)
+
+        if resuming:
+            # Carry on from the latest checkpoint of an earlier run (its results go where that run put them)
+            result = simulation.resume(checkpoint)
+        else:
+            sink = None
+            if result_store == 'npy':
+                sink = NpyResultSink('%s/results' % mbm_output_dir, len(rooms))
+                # The number of each room in the results folder
+                with open('%s/results/rooms.json' % mbm_output_dir, 'w') as file:
+                    json.dump(list(rooms_dictionary.keys()), file)
+
+            # Only a configured output spec changes what is stored, by default every column and time step is
+            output = None
+            if output_species is not None or output_interval is not None:
+                output = OutputSpec(species=output_species, output_interval=output_interval)
+
+            if metrics_species is not None:
+                # Compute the metrics from every variable and time step, as well as store the chosen results
+                thresholds = dict((k, v) for k, v in who_2021_thresholds().items() if k in metrics_species)
+                store = sink if sink is not None else MemoryResultSink(len(rooms))
+                if output is not None:
+                    store = OutputSpecSink(store, output)
+                sink = TeeResultSink([store, ExposureMetrics(len(rooms), metrics_species, thresholds)])
+                output = None
+
+            # Run the simulation starting at time t0 for a duration of t_total seconds
+            # Interrupt the inchempy solver to apply transport every t_interval seconds
+            result = simulation.run(
+                t0=start_time,
+                t_total=total_time,
+                t_interval=transport_interval,
+                init_conditions=initial_conditions,
+                checkpoint=checkpoint,
+                sink=sink,
+                output=output
+            )
+
+    if metrics_species is not None:
+        metrics = pd.concat(dict((key, result[r][1]) for key, r in rooms_dictionary.items()), axis=1)
+        metrics.to_csv('%s/mbm_metrics.csv' % mbm_output_dir)
+        result = dict((r, result[r][0]) for r in rooms)
+
+    if result_store == 'npy':
+        # Gather the chunks written during the simulation into one file, which can be read in part
+        store = result[rooms[0]].store
+        SimulationResult.write_from_store('%s/mbm_results' % mbm_output_dir, store, list(rooms_dictionary.keys()))
 
-    results_dictionary = dict((key, result[r]) for key, r in rooms_dictionary.items())
+    if result_store == 'pickle':
+        results_dictionary = dict((key, result[r]) for key, r in rooms_dictionary.items())
 
-    # Save results to pickle file
-    mbm_output_dir = ('%s_%s' % (datetime.now().strftime('%y%m%d_%H%M%S'), mbm_output))
-    os.mkdir('%s/%s' % (os.getcwd(), mbm_output_dir))
-    pickle.dump(results_dictionary, open('%s/mbm_results.pkl' % mbm_output_dir, "wb"))
+        # Save results to pickle file
+        pickle.dump(results_dictionary, open('%s/mbm_results.pkl' % mbm_output_dir, "wb"))